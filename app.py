@@ -1,8 +1,16 @@
 import streamlit as st
-from attend_selenium import get_work_codes, run_scraper, BASE_URL
+import requests
+from attend_selenium import get_work_codes, run_scraper, session_from_driver
+import attend_2way
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service as ChromeService
-from bs4 import BeautifulSoup
+from driver_pool import DriverPool
+from batch_scrape import run_batch, build_batch_zip
+from http_client import create_session
+from available_dates import AvailableDates
+from job_runner import JobRunner, DONE, FAILED, CANCELLED
+from metrics_panel import show_metrics, show_profile
+import cassette
 import time
 
 st.set_page_config(page_title="NREGA Attendance Scraper", layout="wide")
@@ -14,6 +22,10 @@ if 'stage' not in st.session_state:
     st.session_state.stage = 'initial'
 if 'driver' not in st.session_state:
     st.session_state.driver = None
+if 'http_session' not in st.session_state:
+    st.session_state.http_session = None
+if 'engine' not in st.session_state:
+    st.session_state.engine = None
 
 def init_driver():
     options = webdriver.ChromeOptions()
@@ -28,17 +40,108 @@ def init_driver():
     
     return webdriver.Chrome(service=service, options=options)
 
-@st.cache_data
+@st.cache_resource
+def get_driver_pool():
+    # Shared by every Streamlit session in this process
+    pool = DriverPool(init_driver)
+    pool.start_reaper()
+    return pool
+
+def release_driver(discard=False):
+    get_driver_pool().release(st.session_state.driver, discard=discard)
+    st.session_state.driver = None
+
+# A session still in use keeps its browser; abandoned sessions' browsers are reclaimed
+if st.session_state.driver is not None:
+    get_driver_pool().renew(st.session_state.driver)
+
+@st.cache_resource
+def get_date_lookup():
+    # One plain HTTP GET instead of a browser; shared and refreshed in the background
+    lookup = AvailableDates()
+    lookup.start_refresher()
+    return lookup
+
 def get_available_dates():
-    driver = init_driver()
-    driver.get(BASE_URL)
-    time.sleep(2)
-    soup = BeautifulSoup(driver.page_source, 'html.parser')
-    driver.quit()
-    attendance_select = soup.find('select', {'name': 'ctl00$ContentPlaceHolder1$ddl_attendance'})
-    if not attendance_select:
-        return []
-    return [opt['value'] for opt in attendance_select.find_all('option') if opt.has_attr('value') and opt['value']]
+    return get_date_lookup().get()
+
+@st.cache_resource
+def get_job_runner():
+    # Scrapes run here, outside the script thread, and outlive reruns and reconnects
+    return JobRunner()
+
+def start_job(target, kind, label, meta):
+    job_id = get_job_runner().submit(target, label=label, meta=dict(meta, kind=kind),
+                                     profile=st.session_state.get('profile_mode', False))
+    st.session_state.job_id = job_id
+    # Kept in the URL so a refreshed page can find its job again
+    st.query_params['job'] = job_id
+
+def clear_job():
+    if st.session_state.get('job_id'):
+        get_job_runner().forget(st.session_state.job_id)
+    st.session_state.job_id = None
+    if 'job' in st.query_params:
+        del st.query_params['job']
+
+def poll_job(title):
+    """Show the current job's progress; returns its final snapshot, rerunning until then."""
+    runner = get_job_runner()
+    snapshot = runner.status(st.session_state.get('job_id'))
+    if snapshot is None:
+        st.error("The scrape job is no longer available. Please start again.")
+        clear_job()
+        st.session_state.stage = 'initial'
+        return None
+    if snapshot['status'] in (DONE, FAILED, CANCELLED):
+        return snapshot
+    st.markdown(title)
+    st.progress(int(snapshot['percentage']))
+    st.text(snapshot['message'])
+    if st.button("Cancel", key=f"cancel_{snapshot['id']}"):
+        runner.cancel(snapshot['id'])
+    time.sleep(1)
+    st.rerun()
+
+def scrape_job(engine, driver, http_session, scraper_args, delta=False, fresh=False):
+    pool = get_driver_pool()
+
+    def target(report):
+        browser = driver
+        failed = True
+
+        def renewing_report(message, percentage=None):
+            # Renewed with every muster roll, so a long scrape keeps its browser
+            pool.renew(browser)
+            report(message, percentage)
+        try:
+            if engine == 'http':
+                result = attend_2way.run_scraper(attend_2way.new_navigator(http_session), *scraper_args, report, delta=delta, fresh=fresh)
+            else:
+                if browser is None and http_session is None and not cassette.replaying():
+                    # A resumed browser scrape needs a browser of its own
+                    browser = pool.checkout()
+                result = run_scraper(browser, *scraper_args, renewing_report, session=http_session, delta=delta, fresh=fresh)
+            failed = False
+            return result
+        finally:
+            # The job owns the browser, if any, once it is submitted
+            pool.release(browser, discard=failed)
+    return target
+
+def batch_job(attendance_date, panchayaths, delta=False, fresh=False):
+    def target(report):
+        outputs, combined_raw, errors = run_batch(attendance_date, panchayaths, session=create_session(), progress_callback=report, delta=delta, fresh=fresh)
+        return build_batch_zip(outputs, combined_raw, attendance_date), combined_raw, list(outputs), errors
+    return target
+
+# A reconnecting browser picks its job up again from the URL
+if 'job_id' not in st.session_state:
+    st.session_state.job_id = None
+    restored = get_job_runner().status(st.query_params.get('job'))
+    if restored is not None:
+        st.session_state.job_id = restored['id']
+        st.session_state.stage = 'batch_scraping' if restored['meta']['kind'] == 'batch' else 'scraping'
 
 
 # Step 1: Get initial inputs
@@ -57,42 +160,103 @@ with st.container():
     if not available_dates:
         st.error("Could not fetch available dates. The website might be down or its structure may have changed.")
     else:
+        st.session_state.batch_mode = st.radio(
+            "Scrape", ["Single panchayath", "Batch (several panchayaths)"], horizontal=True
+        ) != "Single panchayath"
         col1, col2 = st.columns(2)
         with col1:
             st.session_state.attendance_date = st.selectbox("Select Attendance Date", available_dates)
-        with col2:
-            st.session_state.panchayath_name = st.selectbox("Select Panchayath", panchayath_list)
-        
-        if st.button("Find Work Codes"):
-            if not st.session_state.panchayath_name:
-                st.warning("Please select a Panchayath.")
-            else:
-                st.session_state.stage = 'work_codes_loading'
-                st.rerun()
+        st.session_state.delta_mode = st.checkbox(
+            "Only fetch new or changed muster rolls", value=False,
+            help="Rereads the muster roll list and reuses every muster roll from the previous scrape of this date whose row has not changed; the files are still complete."
+        )
+        st.session_state.fresh_mode = st.checkbox(
+            "Start fresh", value=False,
+            help="Fetches every muster roll again instead of resuming an unfinished scrape of the same selection."
+        )
+        st.session_state.profile_mode = st.checkbox(
+            "Profile this scrape", value=False,
+            help="Samples where the scrape spends its time and tracks memory per stage; a flame graph and a memory report are offered with the results. Slows the scrape down."
+        )
+        if st.session_state.batch_mode:
+            with col2:
+                all_panchayaths = st.checkbox("All panchayaths", value=True)
+                batch_panchayaths = st.multiselect(
+                    "Select Panchayaths", panchayath_list,
+                    default=panchayath_list if all_panchayaths else [],
+                    disabled=all_panchayaths
+                )
+            if st.button("Run Batch Scrape", disabled=bool(st.session_state.job_id)):
+                if not all_panchayaths and not batch_panchayaths:
+                    st.warning("Please select at least one Panchayath.")
+                else:
+                    # None lets the batch pick up every panchayath listed for the date
+                    st.session_state.batch_panchayaths = None if all_panchayaths else batch_panchayaths
+                    start_job(
+                        batch_job(st.session_state.attendance_date, st.session_state.batch_panchayaths, st.session_state.delta_mode,
+                                  st.session_state.fresh_mode),
+                        'batch', f"Batch {st.session_state.attendance_date}",
+                        {'attendance_date': st.session_state.attendance_date, 'delta': st.session_state.delta_mode}
+                    )
+                    st.session_state.stage = 'batch_scraping'
+                    st.rerun()
+        else:
+            with col2:
+                st.session_state.panchayath_name = st.selectbox("Select Panchayath", panchayath_list)
+            st.session_state.hybrid_mode = st.checkbox(
+                "Fast mode (fetch muster rolls over HTTP)", value=True,
+                help="Only applies when the site has to be driven with the browser: it is then used just to navigate to the panchayath, and muster pages and original photos are downloaded in parallel."
+            )
+
+            if st.button("Find Work Codes", disabled=bool(st.session_state.job_id)):
+                if not st.session_state.panchayath_name:
+                    st.warning("Please select a Panchayath.")
+                else:
+                    st.session_state.stage = 'work_codes_loading'
+                    st.rerun()
 
 # Step 2: Fetch and display work codes
 if st.session_state.stage == 'work_codes_loading':
     with st.spinner("Fetching available work codes... This may take a moment."):
         try:
-            st.session_state.driver = init_driver()
-            work_codes, page_source, panchayath_url, workcode_idx, muster_no_idx = get_work_codes(
-                st.session_state.driver, 
-                st.session_state.attendance_date, 
-                st.session_state.panchayath_name
-            )
+            try:
+                # Browserless navigation first; Chromium is only started if it fails
+                navigator = attend_2way.new_navigator(create_session())
+                work_codes, page_source, panchayath_url, workcode_idx, muster_no_idx = attend_2way.get_work_codes(
+                    navigator,
+                    st.session_state.attendance_date,
+                    st.session_state.panchayath_name,
+                    use_cache=not (st.session_state.delta_mode or st.session_state.fresh_mode)
+                )
+                st.session_state.engine = 'http'
+                st.session_state.http_session = navigator.session
+            except (requests.exceptions.RequestException, attend_2way.NavigationError) as e:
+                # Only the site being unreachable or unusable over HTTP; "no muster rolls" is an answer
+                print(f"Browserless navigation failed, falling back to the browser: {e}")
+                st.session_state.engine = 'selenium'
+                # A replayed browser scrape is served from the recording (see cassette.py)
+                st.session_state.driver = None if cassette.replaying() else get_driver_pool().checkout()
+                work_codes, page_source, panchayath_url, workcode_idx, muster_no_idx = get_work_codes(
+                    st.session_state.driver, 
+                    st.session_state.attendance_date, 
+                    st.session_state.panchayath_name,
+                    use_cache=not (st.session_state.delta_mode or st.session_state.fresh_mode)
+                )
             st.session_state.work_codes = work_codes
             st.session_state.page_source = page_source
             st.session_state.panchayath_url = panchayath_url
             st.session_state.workcode_idx = workcode_idx
             st.session_state.muster_no_idx = muster_no_idx
+            if st.session_state.engine == 'selenium' and st.session_state.hybrid_mode:
+                # Cookies are handed to the HTTP client; the browser is no longer needed
+                st.session_state.http_session = session_from_driver(st.session_state.driver)
+                release_driver()
             st.session_state.stage = 'work_codes_loaded'
             st.rerun()
         except Exception as e:
             st.error(f"Failed to get work codes: {e}")
-            if st.session_state.driver:
-                st.session_state.driver.quit()
+            release_driver(discard=True)
             st.session_state.stage = 'initial'
-            st.session_state.driver = None
 
 
 # Step 3: Select work codes and run scraper
@@ -131,52 +295,69 @@ if st.session_state.stage == 'work_codes_loaded':
                     st.warning("Please select at least one work code.")
                 else:
                     st.session_state.selected_codes = selected_codes
+                    st.session_state.scraper_args = scraper_args = (
+                        st.session_state.page_source,
+                        st.session_state.panchayath_url,
+                        st.session_state.panchayath_name,
+                        st.session_state.attendance_date,
+                        st.session_state.workcode_idx,
+                        st.session_state.muster_no_idx,
+                        st.session_state.selected_codes,
+                    )
+                    start_job(
+                        scrape_job(st.session_state.engine, st.session_state.driver, st.session_state.http_session, scraper_args,
+                                   st.session_state.delta_mode, st.session_state.fresh_mode),
+                        'single', f"{st.session_state.panchayath_name} {st.session_state.attendance_date}",
+                        {'attendance_date': st.session_state.attendance_date, 'panchayath_name': st.session_state.panchayath_name,
+                         'delta': st.session_state.delta_mode}
+                    )
+                    st.session_state.driver = None
                     st.session_state.stage = 'scraping'
                     st.rerun()
 
-# Step 4: Run scraper and show results
+# Step 4: Follow the scrape job and show results
 if st.session_state.stage == 'scraping':
-    st.markdown("### Step 3: Download Results")
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-
-    def status_callback(message, percentage):
-        status_text.text(message)
-        progress_bar.progress(int(percentage))
-
-    try:
-        muster_rolls_excel, muster_images_excel, raw_data_excel = run_scraper(
-            st.session_state.driver,
-            st.session_state.page_source,
-            st.session_state.panchayath_url,
-            st.session_state.panchayath_name,
-            st.session_state.attendance_date,
-            st.session_state.workcode_idx,
-            st.session_state.muster_no_idx,
-            st.session_state.selected_codes,
-            status_callback
-        )
-        
-        st.session_state.muster_rolls_excel = muster_rolls_excel
-        st.session_state.muster_images_excel = muster_images_excel
-        st.session_state.raw_data_excel = raw_data_excel
-        st.session_state.stage = 'results_ready'
+    snapshot = poll_job("### Step 3: Download Results")
+    if snapshot is not None:
+        if snapshot['status'] == DONE:
+            (st.session_state.muster_rolls_excel,
+             st.session_state.muster_images_excel,
+             st.session_state.raw_data_excel,
+             st.session_state.failed_musters) = get_job_runner().result(snapshot['id'])
+            st.session_state.result_meta = snapshot['meta']
+            st.session_state.run_metrics = snapshot['metrics']
+            st.session_state.run_profile = snapshot['profile']
+            st.session_state.stage = 'results_ready'
+            st.rerun()
+        if snapshot['status'] == FAILED:
+            st.session_state.failure = f"An error occurred during scraping: {snapshot['error']}"
+        else:
+            st.session_state.failure = "Scraping was cancelled."
+        st.session_state.failed_meta = snapshot['meta']
+        st.session_state.run_metrics = snapshot['metrics']
+        st.session_state.run_profile = snapshot['profile']
+        clear_job()
+        st.session_state.stage = 'failed'
         st.rerun()
 
-    except Exception as e:
-        st.error(f"An error occurred during scraping: {e}")
-        if st.session_state.driver:
-            st.session_state.driver.quit()
-        st.session_state.stage = 'initial'
-        st.session_state.driver = None
-
 if st.session_state.stage == 'results_ready':
     st.success("Scraping complete! You can now download the files.")
+    if st.session_state.failed_musters:
+        st.warning("These muster rolls could not be fetched and are missing from the files: " + ", ".join(
+            f"{muster_roll_no} ({reason})" for muster_roll_no, reason in st.session_state.failed_musters))
+        if st.button("Retry Failed Muster Rolls"):
+            # Everything else comes from the checkpoint
+            meta = {key: value for key, value in st.session_state.result_meta.items() if key != 'kind'}
+            clear_job()
+            start_job(scrape_job(st.session_state.engine, None, st.session_state.http_session, st.session_state.scraper_args, meta['delta']),
+                      'single', f"{meta['panchayath_name']} {meta['attendance_date']}", meta)
+            st.session_state.stage = 'scraping'
+            st.rerun()
 
     col1, col2, col3 = st.columns(3)
-    dl_date = st.session_state.attendance_date.replace('/', '_')
+    dl_date = st.session_state.result_meta['attendance_date'].replace('/', '_')
     # Sanitize panchayath name for filename
-    dl_panch = st.session_state.panchayath_name.replace('.', '').replace(' ', '_')
+    dl_panch = st.session_state.result_meta['panchayath_name'].replace('.', '').replace(' ', '_')
 
     with col1:
         st.download_button("Muster Rolls Excel", st.session_state.muster_rolls_excel, f"muster_rolls_{dl_panch}_{dl_date}.xlsx")
@@ -184,10 +365,90 @@ if st.session_state.stage == 'results_ready':
         st.download_button("Muster Images Excel", st.session_state.muster_images_excel, f"muster_images_{dl_panch}_{dl_date}.xlsx")
     with col3:
         st.download_button("Raw Data Excel", st.session_state.raw_data_excel, f"raw_data_{dl_panch}_{dl_date}.xlsx")
+    show_metrics(st.session_state.get('run_metrics'), 'single')
+    show_profile(st.session_state.get('run_profile'), 'single')
 
     if st.button("Start New Scrape"):
         # Clean up session state for next run
-        for key in ['driver', 'work_codes', 'page_source', 'panchayath_url', 'workcode_idx', 'muster_no_idx', 'selected_codes', 'muster_rolls_excel', 'muster_images_excel', 'raw_data_excel']:
+        release_driver()
+        clear_job()
+        for key in ['driver', 'http_session', 'engine', 'work_codes', 'page_source', 'panchayath_url', 'workcode_idx', 'muster_no_idx', 'selected_codes', 'scraper_args', 'muster_rolls_excel', 'muster_images_excel', 'raw_data_excel', 'failed_musters', 'result_meta', 'run_metrics', 'run_profile']:
+            if key in st.session_state:
+                del st.session_state[key]
+        st.session_state.stage = 'initial'
+        st.rerun()
+
+# Batch mode: every selected panchayath over HTTP, one hierarchy walk
+if st.session_state.stage == 'batch_scraping':
+    snapshot = poll_job("### Batch Scrape")
+    if snapshot is not None:
+        if snapshot['status'] == DONE:
+            (st.session_state.batch_zip,
+             st.session_state.batch_raw_excel,
+             st.session_state.batch_done,
+             st.session_state.batch_errors) = get_job_runner().result(snapshot['id'])
+            st.session_state.result_meta = snapshot['meta']
+            st.session_state.run_metrics = snapshot['metrics']
+            st.session_state.run_profile = snapshot['profile']
+            st.session_state.stage = 'batch_ready'
+            st.rerun()
+        if snapshot['status'] == FAILED:
+            st.session_state.failure = f"An error occurred during the batch scrape: {snapshot['error']}"
+        else:
+            st.session_state.failure = "The batch scrape was cancelled."
+        st.session_state.failed_meta = snapshot['meta']
+        st.session_state.run_metrics = snapshot['metrics']
+        st.session_state.run_profile = snapshot['profile']
+        clear_job()
+        st.session_state.stage = 'failed'
+        st.rerun()
+
+# A failed or cancelled scrape keeps every muster it fetched; resuming fetches only the rest
+if st.session_state.stage == 'failed':
+    st.error(st.session_state.failure)
+    meta = st.session_state.failed_meta
+    batch = meta['kind'] == 'batch'
+    # Resuming needs the original selection, which a reloaded page no longer has
+    can_resume = 'batch_panchayaths' in st.session_state if batch else 'scraper_args' in st.session_state
+    if can_resume:
+        st.info("Muster rolls fetched so far have been saved; resuming only fetches the missing ones.")
+    col1, col2 = st.columns(2)
+    with col1:
+        if can_resume and st.button("Resume Scrape"):
+            meta = {key: value for key, value in meta.items() if key != 'kind'}
+            if batch:
+                start_job(batch_job(meta['attendance_date'], st.session_state.batch_panchayaths, meta['delta']),
+                          'batch', f"Batch {meta['attendance_date']}", meta)
+                st.session_state.stage = 'batch_scraping'
+            else:
+                start_job(scrape_job(st.session_state.engine, None, st.session_state.http_session, st.session_state.scraper_args, meta['delta']),
+                          'single', f"{meta['panchayath_name']} {meta['attendance_date']}", meta)
+                st.session_state.stage = 'scraping'
+            st.rerun()
+    show_metrics(st.session_state.get('run_metrics'), 'failed')
+    show_profile(st.session_state.get('run_profile'), 'failed')
+    with col2:
+        if st.button("Start Over"):
+            st.session_state.stage = 'initial'
+            st.rerun()
+
+if st.session_state.stage == 'batch_ready':
+    st.success(f"Batch complete: {len(st.session_state.batch_done)} panchayath(s) scraped.")
+    for name, message in st.session_state.batch_errors.items():
+        st.warning(f"{name}: {message}")
+
+    dl_date = st.session_state.result_meta['attendance_date'].replace('/', '_')
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("All Workbooks (zip)", st.session_state.batch_zip, f"muster_rolls_batch_{dl_date}.zip")
+    with col2:
+        st.download_button("Combined Raw Data Excel", st.session_state.batch_raw_excel, f"raw_data_all_{dl_date}.xlsx")
+    show_metrics(st.session_state.get('run_metrics'), 'batch')
+    show_profile(st.session_state.get('run_profile'), 'batch')
+
+    if st.button("Start New Scrape", key="batch_new_scrape"):
+        clear_job()
+        for key in ['batch_panchayaths', 'batch_zip', 'batch_raw_excel', 'batch_done', 'batch_errors', 'result_meta', 'run_metrics', 'run_profile']:
             if key in st.session_state:
                 del st.session_state[key]
         st.session_state.stage = 'initial'
@@ -0,0 +1,73 @@
+import re
+from urllib.parse import urljoin
+from html_parser import FORM_STRAINER, make_soup
+from http_client import get_session, http_get, http_post
+from metrics import NAVIGATION, timed
+
+POSTBACK_RE = re.compile(r"__doPostBack\(\s*'([^']*)'\s*,\s*'([^']*)'\s*\)")
+
+
+class AspNetNavigator:
+    """
+    Drives ASP.NET WebForms pages over plain HTTP, the way a browser would.
+
+    The current page's hidden fields (__VIEWSTATE, __EVENTVALIDATION, ...) are
+    refreshed after every response and sent back with each postback; links are
+    followed with a GET, or as a postback for javascript:__doPostBack(...) links.
+    One navigator walks one path; threads share the session, not the navigator.
+    """
+
+    def __init__(self, session=None, headers=None):
+        self.session = session or get_session()
+        self.headers = dict(headers or {})
+        self.url = None
+        self.content = b''
+        self.hidden_fields = {}
+
+    @property
+    def page_source(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def soup(self, parse_only=None):
+        return make_soup(self.content, parse_only=parse_only)
+
+    def open(self, url, use_cache=True):
+        with timed(NAVIGATION):
+            response = http_get(url, self.session, use_cache=use_cache, headers=self.headers)
+            response.raise_for_status()
+            return self._load(response)
+
+    def submit(self, fields=None, event_target=None, event_argument='', url=None):
+        """Post the current form back with its hidden fields plus fields."""
+        data = dict(self.hidden_fields)
+        if event_target is not None:
+            data['__EVENTTARGET'] = event_target
+            data['__EVENTARGUMENT'] = event_argument
+        data.update(fields or {})
+        headers = dict(self.headers)
+        if self.url:
+            headers['Referer'] = self.url
+        with timed(NAVIGATION):
+            response = http_post(url or self.url, self.session, data=data, headers=headers)
+            response.raise_for_status()
+            return self._load(response)
+
+    def follow(self, href, use_cache=True):
+        match = POSTBACK_RE.search(href)
+        if match:
+            return self.submit(event_target=match.group(1), event_argument=match.group(2))
+        return self.open(urljoin(self.url, href), use_cache=use_cache)
+
+    def _load(self, response):
+        self.url = response.url or self.url
+        self.content = response.content
+        if b'__VIEWSTATE' in self.content:
+            soup = make_soup(self.content, parse_only=FORM_STRAINER)
+            self.hidden_fields = {
+                field['name']: field.get('value', '')
+                for field in soup.find_all('input', {'type': 'hidden'})
+                if field.get('name')
+            }
+        else:
+            self.hidden_fields = {}
+        return self
@@ -1,26 +1,37 @@
-import requests
-from bs4 import BeautifulSoup
+import argparse
 from urllib.parse import urljoin
-import time
-import openpyxl
-from openpyxl.styles import Alignment, Font
-import io
-from attendance_downloader import get_attendance_data, download_photo
-from openpyxl.drawing.image import Image as XLImage
+from attendance_downloader import describe_failures, download_photo, get_attendance_data, muster_failure
 import re
-from concurrent.futures import ThreadPoolExecutor
+from http_client import DEFAULT_HEADERS, SITE_URL, get_session
+from http_cache import get_cache
+from image_processing import prepare_photo
+from html_parser import FORM_STRAINER, HIERARCHY_STRAINER, make_soup, row_signature
+from excel_writer import open_workbook
+from muster_workbooks import MusterWorkbookRenderer
+from pipeline import pipelined
+from hierarchy_cache import get_hierarchy_cache, hierarchy_key
+from aspnet_navigator import AspNetNavigator
+from concurrency_control import HOST_MAX_CONCURRENCY, report_congestion
+from checkpoint_store import describe_plan, muster_key, muster_roll_params, open_run, plan_musters
+from profiler import profiled
 
 # Constants
-BASE_URL = "https://mnregaweb4.nic.in/nregaarch/View_NMMS_atten_date_new.aspx?fin_year=2024-2025&Digest=HNrisV4bhHnb7Gve3mAKYQ"
+BASE_URL = f"{SITE_URL}View_NMMS_atten_date_new.aspx?fin_year=2024-2025&Digest=HNrisV4bhHnb7Gve3mAKYQ"
 STATE_VALUE = '15'  # Karnataka
+STATE_NAME = 'KARNATAKA'
 DISTRICT_NAME = 'BALLARI'
 BLOCK_NAME = 'SIRUGUPPA'
 TALUK_NAME = 'Siruguppa'
 DISTRICT_LABEL = 'Ballari'
+# Worker threads per stage; the requests actually in flight follow the adaptive per-host limit
+FETCH_WORKERS = HOST_MAX_CONCURRENCY
+PHOTO_WORKERS = HOST_MAX_CONCURRENCY
 
-HEADERS = {
-    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
-}
+class NavigationError(Exception):
+    """A page of the report hierarchy was missing or unusable."""
+
+class NoMusterRolls(Exception):
+    """The panchayath is not listed for the date: it generated no muster rolls."""
 
 def get_table_by_id_or_div(soup, table_id='grdTable', div_id='RepPr1'):
     table = soup.find('table', {'id': table_id})
@@ -74,18 +85,11 @@ def get_muster_roll_rows(muster_table, choice, workcodes=None, workcode_idx=None
                         rows_to_save.append((cols, muster_href))
     return rows_to_save
 
-def save_attendance_excel(wb, ws, img_wb, img_ws, panchayath_name, attendance_date):
-    wb.save(f"muster_rolls_{panchayath_name}_{attendance_date.replace('/', '_')}.xlsx")
-    img_wb.save(f"muster_roll_images_{panchayath_name}_{attendance_date.replace('/', '_')}.xlsx")
-    print(f"Saved muster_rolls_{panchayath_name}_{attendance_date.replace('/', '_')}.xlsx")
-    print(f"Saved muster_roll_images_{panchayath_name}_{attendance_date.replace('/', '_')}.xlsx")
-
-def save_raw_excel(rows_to_save, panchayath_name, attendance_date, muster_no_idx, workcode_idx, panchayath_url, muster_data_cache):
-    raw_wb = openpyxl.Workbook()
-    raw_ws = raw_wb.active
-    raw_ws.append([
-        "Taluk", "Panchayath", "Work Code", "Muster Roll No", "Job Card No", "Worker Name", "Gender", "Attendance", "Attendance Date"
-    ])
+RAW_HEADER = [
+    "Taluk", "Panchayath", "Work Code", "Muster Roll No", "Job Card No", "Worker Name", "Gender", "Attendance", "Attendance Date"
+]
+
+def iter_raw_rows(rows_to_save, panchayath_name, muster_no_idx, workcode_idx, panchayath_url, muster_data_cache):
     for cols, muster_href in rows_to_save:
         muster_url = urljoin(panchayath_url, muster_href)
         attendance_data, _, _, _ = muster_data_cache.get(muster_url, (None, None, None, None))
@@ -99,7 +103,7 @@ def save_raw_excel(rows_to_save, panchayath_name, attendance_date, muster_no_idx
             else:
                 name_part = worker_name_full
                 gender_part = ''
-            raw_ws.append([
+            yield [
                 TALUK_NAME,
                 panchayath_name,
                 work_code,
@@ -109,9 +113,15 @@ def save_raw_excel(rows_to_save, panchayath_name, attendance_date, muster_no_idx
                 gender_part,
                 att_row[4] if len(att_row) > 4 else '',
                 att_row[3] if len(att_row) > 3 else '',
-            ])
-    raw_wb.save(f"muster_rolls_raw_{panchayath_name}_{attendance_date.replace('/', '_')}.xlsx")
-    print(f"Saved muster_rolls_raw_{panchayath_name}_{attendance_date.replace('/', '_')}.xlsx")
+            ]
+
+def save_raw_excel(raw_rows, target=None):
+    raw_wb = open_workbook(target)
+    raw_ws = raw_wb.add_sheet()
+    raw_ws.append(RAW_HEADER)
+    for row in raw_rows:
+        raw_ws.append(row)
+    return raw_wb.close()
 
 def find_col_idx(header_cols, search):
     search_clean = re.sub(r'[^a-zA-Z0-9]', '', search.lower())
@@ -121,104 +131,157 @@ def find_col_idx(header_cols, search):
             return i
     return None
 
-def fetch_muster_data(muster_url):
-    return get_attendance_data(muster_url)
+def fetch_muster_data(muster_url, session=None):
+    return get_attendance_data(muster_url, session, listed=True)
 
-def main():
-    session = requests.Session()
-    resp = session.get(BASE_URL, headers=HEADERS)
-    soup = BeautifulSoup(resp.content, 'html.parser')
+def fetch_muster_photo(muster_data, session=None):
+    attendance_data, photo_url, work_name, header_cells = muster_data
+    photo = prepare_photo(download_photo(photo_url, session)) if photo_url else None
+    return attendance_data, photo_url, work_name, header_cells, photo
 
-    viewstate = soup.find('input', {'id': '__VIEWSTATE'})['value']
-    eventvalidation = soup.find('input', {'id': '__EVENTVALIDATION'})['value']
-    viewstategen = soup.find('input', {'id': '__VIEWSTATEGENERATOR'})['value']
+def new_navigator(session=None):
+    return AspNetNavigator(session or get_session(), DEFAULT_HEADERS)
 
+def load_form(navigator):
+    """Open the report form (refreshing the navigator's hidden fields) and return the dates on offer."""
+    navigator.open(BASE_URL, use_cache=False)
+    soup = navigator.soup(FORM_STRAINER)
     attendance_select = soup.find('select', {'name': 'ctl00$ContentPlaceHolder1$ddl_attendance'})
-    date_options = [opt['value'] for opt in attendance_select.find_all('option')]
-    
-    print("Available dates:", date_options)
-    attendance_date = input("Enter attendance date from above options (e.g., 18/07/2025): ").strip()
-    panchayath_name = input("Enter Panchayath name: ").strip().upper()
+    if not attendance_select:
+        return []
+    return [opt['value'] for opt in attendance_select.find_all('option') if opt.has_attr('value') and opt['value']]
 
-    data = {
-        '__VIEWSTATE': viewstate,
-        '__VIEWSTATEGENERATOR': viewstategen,
-        '__EVENTVALIDATION': eventvalidation,
+def open_block_page(navigator, attendance_date, use_cache=True):
+    """
+    Submit the report for attendance_date and walk state -> district -> block.
+    Returns (block_url, panchayath table), or (None, None) if a page is missing.
+    """
+    if navigator.url != BASE_URL or '__VIEWSTATE' not in navigator.hidden_fields:
+        load_form(navigator)
+    navigator.submit({
         'ctl00$ContentPlaceHolder1$ddlstate': STATE_VALUE,
         'ctl00$ContentPlaceHolder1$ddl_attendance': attendance_date,
         'ctl00$ContentPlaceHolder1$btn_showreport': 'Show Attendance',
-    }
-    headers_post = HEADERS.copy()
-    headers_post['Referer'] = BASE_URL
-    resp2 = session.post(BASE_URL, data=data, headers=headers_post)
-    # time.sleep(3)
-    soup2 = BeautifulSoup(resp2.content, 'html.parser')
+    })
 
     # State table navigation
-    state_table = get_table_by_id_or_div(soup2)
+    state_table = get_table_by_id_or_div(navigator.soup(HIERARCHY_STRAINER))
     if not state_table:
         print("Could not find state table.")
-        return
-    karnataka_link = get_link_from_table(state_table, 1, 'KARNATAKA')
+        return None, None
+    karnataka_link = get_link_from_table(state_table, 1, STATE_NAME)
     if not karnataka_link:
         print("Could not find Karnataka link in state table.")
-        return
-    karnataka_url = urljoin(BASE_URL, karnataka_link)
+        return None, None
 
     # Districts table navigation
-    resp3 = session.get(karnataka_url, headers=HEADERS)
-    soup3 = BeautifulSoup(resp3.content, 'html.parser')
-    dist_table = get_table_by_id_or_div(soup3)
+    navigator.follow(karnataka_link)
+    dist_table = get_table_by_id_or_div(navigator.soup(HIERARCHY_STRAINER))
     if not dist_table:
         print("Could not find districts table.")
-        return
+        get_cache().invalidate(navigator.url)
+        return None, None
     ballari_link = get_link_from_table(dist_table, 1, DISTRICT_NAME)
     if not ballari_link:
         print("Could not find Ballari link in districts table.")
-        return
-    ballari_url = urljoin(karnataka_url, ballari_link)
+        return None, None
 
     # Block/Taluk table navigation
-    resp4 = session.get(ballari_url, headers=HEADERS)
-    soup4 = BeautifulSoup(resp4.content, 'html.parser')
-    block_table = get_table_by_id_or_div(soup4)
+    navigator.follow(ballari_link)
+    block_table = get_table_by_id_or_div(navigator.soup(HIERARCHY_STRAINER))
     if not block_table:
         print("Could not find block/taluk table.")
-        return
+        get_cache().invalidate(navigator.url)
+        return None, None
     siruguppa_link = get_link_from_table(block_table, 1, BLOCK_NAME)
     if not siruguppa_link:
         print("Could not find Siruguppa link in block/taluk table.")
-        return
-    siruguppa_url = urljoin(ballari_url, siruguppa_link)
+        return None, None
+
+    navigator.follow(siruguppa_link, use_cache=use_cache)
+    return navigator.url, find_panchayath_table(navigator)
 
+def open_panchayath_list(navigator, block_url, use_cache=True):
+    if not use_cache:
+        get_cache().invalidate(block_url)
+    navigator.open(block_url, use_cache=use_cache)
+    return find_panchayath_table(navigator)
+
+def find_panchayath_table(navigator):
     # Panchayath table navigation
-    resp5 = session.get(siruguppa_url, headers=HEADERS)
-    soup5 = BeautifulSoup(resp5.content, 'html.parser')
-    panch_div = soup5.find('div', {'id': 'RepPr1'})
+    panch_div = navigator.soup(HIERARCHY_STRAINER).find('div', {'id': 'RepPr1'})
     if not panch_div:
         print("Could not find panchayath table container.")
-        return
+        get_cache().invalidate(navigator.url)
+        return None
     panch_table = panch_div.find('table')
     if not panch_table:
         print("Could not find panchayath table.")
-        return
+        return None
+    return panch_table
+
+def resolve_block(navigator, attendance_date, use_cache=True):
+    """
+    Return (block_url, panchayath table) for attendance_date. A cached block link
+    is tried first, so a repeat lookup is a single request; the form is only
+    submitted again when there is none or it stopped working. use_cache=False
+    fetches the panchayath list afresh, e.g. to see newly listed panchayaths.
+    """
+    cache = get_hierarchy_cache()
+    key = hierarchy_key(BASE_URL, attendance_date, STATE_NAME, DISTRICT_NAME, BLOCK_NAME)
+    block_url = cache.get_url(key)
+    if block_url:
+        panch_table = open_panchayath_list(navigator, block_url, use_cache)
+        if panch_table is not None:
+            return block_url, panch_table
+        cache.invalidate_url(key)
+    block_url, panch_table = open_block_page(navigator, attendance_date, use_cache)
+    if panch_table is not None:
+        cache.put_url(key, block_url)
+    return block_url, panch_table
+
+def resolve_panchayath(navigator, attendance_date, panchayath_name, use_cache=True):
+    """
+    Return (panchayath_url, muster page) where muster page is open_muster_table's
+    result, or (None, None) if a page was unusable; raises NoMusterRolls when the
+    panchayath is not listed. Uses the cached panchayath link when it still works;
+    use_cache=False makes sure the muster table, and the panchayath list if it is
+    needed, are current.
+    """
+    cache = get_hierarchy_cache()
+    key = hierarchy_key(BASE_URL, attendance_date, STATE_NAME, DISTRICT_NAME, BLOCK_NAME, panchayath_name)
+    panchayath_url = cache.get_url(key)
+    if panchayath_url:
+        muster_page = open_muster_table(navigator, panchayath_url, use_cache)
+        if muster_page is not None:
+            return panchayath_url, muster_page
+        cache.invalidate_url(key)
+    block_url, panch_table = resolve_block(navigator, attendance_date, use_cache)
+    if panch_table is None:
+        return None, None
     panchayath_link = get_panchayath_link(panch_table, panchayath_name)
     if not panchayath_link:
-        print("No NMR generated by the Panchayath")
-        return
-    panchayath_url = urljoin(siruguppa_url, panchayath_link)
-
-    # Muster Roll table navigation
-    resp6 = session.get(panchayath_url, headers=HEADERS)
-    soup6 = BeautifulSoup(resp6.content, 'html.parser')
-    muster_div = soup6.find('div', {'id': 'RepPr1'})
-    if not muster_div:
-        print("Could not find muster roll table container.")
-        return
-    muster_table = muster_div.find('table')
-    if not muster_table:
-        print("Could not find muster roll table.")
-        return
+        raise NoMusterRolls("No NMR generated by the Panchayath")
+    panchayath_url = urljoin(block_url, panchayath_link)
+    muster_page = open_muster_table(navigator, panchayath_url, use_cache)
+    if muster_page is None:
+        return None, None
+    cache.put_url(key, panchayath_url)
+    return panchayath_url, muster_page
+
+def get_panchayath_links(panch_table):
+    """Map every panchayath that generated muster rolls to its link, in table order."""
+    links = {}
+    for row in panch_table.find_all('tr'):
+        cols = row.find_all('td')
+        if len(cols) >= 4 and cols[0].get_text(strip=True).isdigit():
+            muster_rolls_a = cols[3].find('a', href=True)
+            if muster_rolls_a:
+                links[cols[1].get_text(strip=True).upper()] = muster_rolls_a['href']
+    return links
+
+def summarize_muster_table(muster_table):
+    """Return (work codes, workcode_idx, muster_no_idx), or None without the needed columns."""
     header_row = muster_table.find('tr')
     header_cols = [th.get_text(strip=True).replace('\u00a0', ' ').strip().lower() for th in header_row.find_all(['th', 'td'])]
     workcode_idx = find_col_idx(header_cols, 'work code')
@@ -226,16 +289,151 @@ def main():
     if workcode_idx is None or muster_no_idx is None:
         print("Could not find required columns in muster roll table header.")
         print("Header columns found:", header_cols)
-        return
-
+        return None
     all_workcodes = set()
     for row in muster_table.find_all('tr')[1:]:
         cols = row.find_all('td')
         if len(cols) > workcode_idx and len(cols) > muster_no_idx and cols[muster_no_idx].find('a', href=True):
             all_workcodes.add(cols[workcode_idx].get_text(strip=True))
-    
+    return sorted(all_workcodes), workcode_idx, muster_no_idx
+
+def open_muster_table(navigator, panchayath_url, use_cache=True):
+    """
+    Return (muster table, work codes, workcode_idx, muster_no_idx), or None if the page
+    is unusable. use_cache=False fetches the table afresh, e.g. to see new muster rolls.
+    """
+    if not use_cache:
+        # Nobody should be served the older copy afterwards either
+        get_cache().invalidate(panchayath_url)
+    navigator.open(panchayath_url, use_cache=use_cache)
+    muster_div = navigator.soup(HIERARCHY_STRAINER).find('div', {'id': 'RepPr1'})
+    muster_table = muster_div.find('table') if muster_div else None
+    if not muster_table:
+        print("Could not find muster roll table.")
+        report_congestion(panchayath_url)
+        get_cache().invalidate(panchayath_url)
+        get_hierarchy_cache().invalidate_muster_table(panchayath_url)
+        return None
+    cache = get_hierarchy_cache()
+    summary = cache.get_muster_table(panchayath_url) if use_cache else None
+    if summary is None:
+        summary = summarize_muster_table(muster_table)
+        if summary is None:
+            return None
+        cache.put_muster_table(panchayath_url, *summary)
+    return (muster_table,) + tuple(summary)
+
+def scrape_muster_rolls(session, rows_to_save, panchayath_name, panchayath_url, workcode_idx, muster_no_idx,
+                        attendance_target=None, images_target=None, raw_target=None,
+                        fetch_workers=FETCH_WORKERS, photo_workers=PHOTO_WORKERS, progress_callback=None,
+                        checkpoint=None):
+    """
+    Fetch, render and save the selected muster rolls of one panchayath.
+    Returns (attendance workbook, image workbook, raw workbook, raw rows, failed);
+    workbooks without a target are returned as BytesIO buffers, and failed lists
+    (muster roll no, reason) for the muster rolls that could not be fetched in full.
+
+    With a checkpoint run, every fetched muster is saved to it as soon as it is complete
+    and musters it already holds are not fetched again, unless their row in the muster
+    table changed since.
+    """
+    renderer = MusterWorkbookRenderer(panchayath_name, DISTRICT_LABEL, TALUK_NAME,
+                                      attendance_target=attendance_target, images_target=images_target)
+
+    muster_data_cache = {}
+    muster_urls = [urljoin(panchayath_url, href) for _, href in rows_to_save]
+    signatures = {muster_key(url): row_signature(cols) for url, (cols, _) in zip(muster_urls, rows_to_save)}
+    done, pending, changed = plan_musters(checkpoint, muster_urls, signatures)
+    if done or changed:
+        print(f"Resuming: {describe_plan(len(muster_urls), pending, changed)}")
+
+    def fetch_page(url):
+        return url, fetch_muster_data(url, session)
+
+    def fetch_photo(fetched):
+        url, muster_data = fetched
+        result = fetch_muster_photo(muster_data, session)
+        if checkpoint:
+            checkpoint.save(muster_key(url), result, signatures[muster_key(url)])
+        return result
+
+    # Pages are fetched in parallel, each photo download starts as soon as its page is
+    # parsed, and musters reach the renderer in muster-roll order
+    fetched = pipelined(pending, [(fetch_page, fetch_workers), (fetch_photo, photo_workers)])
+    results = (done.get(muster_key(url)) or next(fetched) for url in muster_urls)
+
+    failed = []
+    for i, (muster_url, result) in enumerate(zip(muster_urls, results)):
+        attendance_data, photo_url, work_name, header_cells, photo = result
+        muster_data_cache[muster_url] = (attendance_data, photo_url, work_name, header_cells)
+        cols = rows_to_save[i][0]
+        muster_roll_no = cols[muster_no_idx].get_text(strip=True)
+        reason = muster_failure(result)
+        if reason:
+            failed.append((muster_roll_no, reason))
+        work_code = cols[workcode_idx].get_text(strip=True)
+        print(f"Muster Roll No. {muster_roll_no} parsed ")
+        if progress_callback:
+            progress_callback(f"Processing muster roll {i+1}/{len(rows_to_save)}...", (i+1)/len(rows_to_save) * 100)
+        renderer.add_muster(muster_roll_no, work_code, attendance_data, work_name, header_cells, photo)
+    att_out, img_out = renderer.close()
+    raw_rows = list(iter_raw_rows(rows_to_save, panchayath_name, muster_no_idx, workcode_idx, panchayath_url, muster_data_cache))
+    raw_out = save_raw_excel(raw_rows, raw_target)
+    if checkpoint:
+        checkpoint.finish(not failed)
+    if failed:
+        print(f"Failed muster rolls: {describe_failures(failed)}")
+    return att_out, img_out, raw_out, raw_rows, failed
+
+def get_work_codes(navigator, attendance_date, panchayath_name, use_cache=True):
+    """Browserless counterpart of attend_selenium.get_work_codes, with the same return value."""
+    panchayath_url, muster_page = resolve_panchayath(navigator, attendance_date, panchayath_name.strip().upper(), use_cache)
+    if muster_page is None:
+        raise NavigationError("Could not open the muster roll list of the selected Panchayath.")
+    _, work_codes, workcode_idx, muster_no_idx = muster_page
+    return work_codes, navigator.page_source, panchayath_url, workcode_idx, muster_no_idx
+
+def run_scraper(navigator, page_source, panchayath_url, panchayath_name, attendance_date, workcode_idx, muster_no_idx, selected_work_codes, status_callback, max_workers=FETCH_WORKERS, delta=False, fresh=False):
+    """
+    Browserless counterpart of attend_selenium.run_scraper, with the same return value.
+    delta=True builds on the previous scrape of the same selection however old it is,
+    fetching only muster rolls that are new or changed since; fresh=True fetches them
+    all again instead of resuming an unfinished scrape.
+    """
+    soup = make_soup(page_source, parse_only=HIERARCHY_STRAINER)
+    muster_table = soup.find('div', {'id': 'RepPr1'}).find('table')
+
+    choice = 'all' if 'all' in selected_work_codes else 'work'
+    rows_to_save = get_muster_roll_rows(muster_table, choice, selected_work_codes, workcode_idx, muster_no_idx)
+    if not rows_to_save:
+        raise Exception("No muster roll data found for the selection.")
+    checkpoint = open_run('muster_rolls', muster_roll_params(panchayath_url, attendance_date, selected_work_codes),
+                          fresh=fresh, any_age=delta)
+    att_out, img_out, raw_out, _, failed = scrape_muster_rolls(
+        navigator.session, rows_to_save, panchayath_name, panchayath_url, workcode_idx, muster_no_idx,
+        fetch_workers=max_workers, photo_workers=max_workers, progress_callback=status_callback,
+        checkpoint=checkpoint)
+    return att_out, img_out, raw_out, failed
+
+def main(session=None, fresh=False):
+    navigator = new_navigator(session)
+    date_options = load_form(navigator)
+
+    print("Available dates:", date_options)
+    attendance_date = input("Enter attendance date from above options (e.g., 18/07/2025): ").strip()
+    panchayath_name = input("Enter Panchayath name: ").strip().upper()
+
+    try:
+        panchayath_url, muster_page = resolve_panchayath(navigator, attendance_date, panchayath_name, use_cache=not fresh)
+    except NoMusterRolls as e:
+        print(e)
+        return
+    if muster_page is None:
+        return
+    muster_table, work_codes, workcode_idx, muster_no_idx = muster_page
+
     print("\nAvailable work codes:")
-    for wc in sorted(list(all_workcodes)):
+    for wc in work_codes:
         print(wc)
 
     user_input = input("\nType 'all' for all muster rolls, or enter one or more work codes separated by commas: ").strip()
@@ -252,114 +450,25 @@ def main():
         print("No muster roll data found for the selection.")
         return
 
-    # Excel setup
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    row_cursor = 1
-    ws.cell(row=row_cursor, column=1, value="District:").font = Font(bold=True)
-    ws.cell(row=row_cursor, column=2, value=DISTRICT_LABEL)
-    ws.cell(row=row_cursor, column=3, value="Taluk/Block:").font = Font(bold=True)
-    ws.cell(row=row_cursor, column=4, value=TALUK_NAME)
-    row_cursor += 1
-    ws.cell(row=row_cursor, column=1, value="Panchayath:").font = Font(bold=True)
-    ws.cell(row=row_cursor, column=2, value=panchayath_name)
-    row_cursor += 1
-    workcode_row_idx_att = row_cursor
-    ws.cell(row=workcode_row_idx_att, column=1, value="Work code:").font = Font(bold=True)
-    ws.cell(row=workcode_row_idx_att, column=3, value="Work Name:").font = Font(bold=True)
-    row_cursor += 1
-    attendance_header_written = False
-    first_muster_processed = False
-    first_work_code = ''
-    first_work_name = ''
-
-    # Image-only Excel setup
-    img_wb = openpyxl.Workbook()
-    img_ws = img_wb.active
-    img_row_cursor = 1
-    img_bytes_refs = []
-    img_ws.cell(row=img_row_cursor, column=1, value="District:").font = Font(bold=True)
-    img_ws.cell(row=img_row_cursor, column=2, value=DISTRICT_LABEL)
-    img_ws.cell(row=img_row_cursor, column=3, value="Taluk/Block:").font = Font(bold=True)
-    img_ws.cell(row=img_row_cursor, column=4, value=TALUK_NAME)
-    img_row_cursor += 1
-    img_ws.cell(row=img_row_cursor, column=1, value="Panchayath:").font = Font(bold=True)
-    img_ws.cell(row=img_row_cursor, column=2, value=panchayath_name)
-    img_row_cursor += 1
-    workcode_row_idx = img_row_cursor
-    img_ws.cell(row=workcode_row_idx, column=1, value="Work code:").font = Font(bold=True)
-    img_ws.cell(row=workcode_row_idx, column=3, value="Work Name:").font = Font(bold=True)
-    img_row_cursor += 1
-    header_row_idx = img_row_cursor
-    img_ws.cell(row=header_row_idx, column=1, value='Muster Roll No').font = Font(bold=True)
-    img_ws.cell(row=header_row_idx, column=2, value='Image').font = Font(bold=True)
-    img_row_cursor += 1
-
-    # Main loop: cache attendance data for each muster roll
-    muster_data_cache = {}
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        muster_urls = [urljoin(panchayath_url, href) for _, href in rows_to_save]
-        results = list(executor.map(fetch_muster_data, muster_urls))
-    # Now results[i] corresponds to muster_urls[i]
-
-    for i, (muster_url, (attendance_data, photo_url, work_name, header_cells)) in enumerate(zip(muster_urls, results)):
-        muster_data_cache[muster_url] = (attendance_data, photo_url, work_name, header_cells)
-        img_bytes = download_photo(photo_url) if photo_url else None
-        muster_roll_no = rows_to_save[i][0][muster_no_idx].get_text(strip=True)
-        print(f"Muster Roll No. {muster_roll_no} parsed ")
-        # Attendance Excel
-        if not attendance_header_written and header_cells:
-            if not first_muster_processed:
-                first_work_code = rows_to_save[i][0][workcode_idx].get_text(strip=True)
-                first_work_name = work_name or ''
-                ws.cell(row=workcode_row_idx_att, column=2, value=first_work_code)
-                ws.cell(row=workcode_row_idx_att, column=4, value=first_work_name)
-                first_muster_processed = True
-            ws.cell(row=row_cursor, column=1, value="Muster Roll No").font = Font(bold=True)
-            for col_idx, header in enumerate(header_cells, 2):
-                ws.cell(row=row_cursor, column=col_idx, value=header).font = Font(bold=True)
-            row_cursor += 1
-            attendance_header_written = True
-        if attendance_data:
-            for att_row in attendance_data:
-                ws.cell(row=row_cursor, column=1, value=muster_roll_no)
-                for col_idx, val in enumerate(att_row, 2):
-                    ws.cell(row=row_cursor, column=col_idx, value=val)
-                row_cursor += 1
-        if img_bytes:
-            img_bytes.seek(0)
-            img = XLImage(img_bytes)
-            img_cell = f"H{row_cursor-len(attendance_data) if attendance_data else row_cursor}"
-            ws.add_image(img, img_cell)
-            row_cursor += 3
-        else:
-            row_cursor += 2
-        row_cursor += 2
-        # Image-only Excel
-        start_img_row = img_row_cursor
-        img_ws.cell(row=img_row_cursor, column=1, value=muster_roll_no).font = Font(bold=True, size=18)
-        if img_bytes:
-            img_bytes.seek(0)
-            img_bytes_for_imgwb = io.BytesIO(img_bytes.getbuffer())
-            img2 = XLImage(img_bytes_for_imgwb)
-            img_ws.add_image(img2, f"B{img_row_cursor}")
-            img_bytes_refs.append(img_bytes_for_imgwb)
-            img_height_rows = 20
-            end_img_row = img_row_cursor + img_height_rows - 1
-            img_ws.merge_cells(start_row=start_img_row, start_column=1, end_row=end_img_row, end_column=1)
-            img_ws.cell(row=start_img_row, column=1).alignment = Alignment(vertical='center', horizontal='center')
-            img_row_cursor += img_height_rows
-        else:
-            end_img_row = img_row_cursor
-            img_row_cursor += 3
-            img_ws.merge_cells(start_row=start_img_row, start_column=1, end_row=end_img_row, end_column=1)
-            img_ws.cell(row=start_img_row, column=1).alignment = Alignment(vertical='center', horizontal='center')
-        img_row_cursor += 2
-    if not first_muster_processed:
-        img_ws.cell(row=workcode_row_idx, column=2, value='')
-        img_ws.cell(row=workcode_row_idx, column=4, value='')
-    save_attendance_excel(wb, ws, img_wb, img_ws, panchayath_name, attendance_date)
-    save_raw_excel(rows_to_save, panchayath_name, attendance_date, muster_no_idx, workcode_idx, panchayath_url, muster_data_cache)
+    # All three workbooks are streamed straight to disk
+    date_part = attendance_date.replace('/', '_')
+    att_file = f"muster_rolls_{panchayath_name}_{date_part}.xlsx"
+    img_file = f"muster_roll_images_{panchayath_name}_{date_part}.xlsx"
+    raw_file = f"muster_rolls_raw_{panchayath_name}_{date_part}.xlsx"
+    checkpoint = open_run('muster_rolls', muster_roll_params(panchayath_url, attendance_date, workcodes), fresh=fresh)
+    # NMMS_PROFILE=1 profiles the muster roll scrape
+    with profiled() as profile:
+        scrape_muster_rolls(navigator.session, rows_to_save, panchayath_name, panchayath_url, workcode_idx, muster_no_idx,
+                            attendance_target=att_file, images_target=img_file, raw_target=raw_file,
+                            checkpoint=checkpoint)
+    print(f"Saved {att_file}")
+    print(f"Saved {img_file}")
+    print(f"Saved {raw_file}")
+    if profile is not None:
+        profile.save('.', f"profile_{panchayath_name}_{date_part}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Scrape the muster rolls of one panchayath, asking for the date and work codes.")
+    parser.add_argument('--fresh', action='store_true',
+                        help="Fetch every muster roll again instead of resuming an unfinished run")
+    main(fresh=parser.parse_args().fresh)
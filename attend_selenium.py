@@ -1,23 +1,37 @@
-import io
 import re
 import time
+from functools import partial
 from urllib.parse import urljoin
-import openpyxl
-from bs4 import BeautifulSoup
-from openpyxl.drawing.image import Image as XLImage
-from openpyxl.styles import Alignment, Font
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service as ChromeService
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import Select
+import attendance_downloader
+import cassette
+from html_parser import HIERARCHY_STRAINER, make_soup, parse_attendance_page, row_signature
+from http_cache import normalize_url
+from http_client import SITE_URL, create_session
+from photo_store import get_photo_store
+from image_processing import prepare_photo
+from attend_2way import iter_raw_rows, save_raw_excel
+from muster_workbooks import MusterWorkbookRenderer
+from hierarchy_cache import get_hierarchy_cache, hierarchy_key
+from pipeline import pipelined
+from concurrency_control import HOST_MAX_CONCURRENCY
+from checkpoint_store import describe_plan, muster_key, muster_roll_params, open_run, plan_musters
+import metrics
+from metrics import NAVIGATION, PAGE_FETCH, PARSE, PHOTO_FETCH, timed
 
 # Constants
-BASE_URL = "https://mnregaweb4.nic.in/nregaarch/View_NMMS_atten_date_new.aspx?fin_year=2024-2025&Digest=HNrisV4bhHnb7Gve3mAKYQ"
+BASE_URL = f"{SITE_URL}View_NMMS_atten_date_new.aspx?fin_year=2024-2025&Digest=HNrisV4bhHnb7Gve3mAKYQ"
 STATE_VALUE = '15'  # Karnataka
+STATE_NAME = 'KARNATAKA'
 DISTRICT_NAME = 'BALLARI'
 BLOCK_NAME = 'SIRUGUPPA'
 TALUK_NAME = 'Siruguppa'
 DISTRICT_LABEL = 'Ballari'
+# Worker threads in hybrid mode; the requests actually in flight follow the adaptive per-host limit
+HYBRID_MAX_WORKERS = HOST_MAX_CONCURRENCY
 
 def get_table_by_id_or_div(soup, table_id='grdTable', div_id='RepPr1'):
     table = soup.find('table', {'id': table_id})
@@ -71,44 +85,6 @@ def get_muster_roll_rows(muster_table, choice, workcodes=None, workcode_idx=None
                         rows_to_save.append((cols, muster_href))
     return rows_to_save
 
-def save_attendance_excel(wb, ws, img_wb, img_ws, panchayath_name, attendance_date):
-    wb.save(f"muster_rolls_{panchayath_name}_{attendance_date.replace('/', '_')}.xlsx")
-    img_wb.save(f"muster_roll_images_{panchayath_name}_{attendance_date.replace('/', '_')}.xlsx")
-    print(f"Saved muster_rolls_{panchayath_name}_{attendance_date.replace('/', '_')}.xlsx")
-    print(f"Saved muster_roll_images_{panchayath_name}_{attendance_date.replace('/', '_')}.xlsx")
-
-def save_raw_excel(rows_to_save, panchayath_name, attendance_date, muster_no_idx, workcode_idx, panchayath_url, muster_data_cache):
-    raw_wb = openpyxl.Workbook()
-    raw_ws = raw_wb.active
-    raw_ws.append([
-        "Taluk", "Panchayath", "Work Code", "Muster Roll No", "Job Card No", "Worker Name", "Gender", "Attendance", "Attendance Date"
-    ])
-    for cols, muster_href in rows_to_save:
-        muster_url = urljoin(panchayath_url, muster_href)
-        attendance_data, _, _, _ = muster_data_cache.get(muster_url, (None, None, None, None))
-        muster_roll_no = cols[muster_no_idx].get_text(strip=True)
-        work_code = cols[workcode_idx].get_text(strip=True)
-        for att_row in attendance_data or []:
-            worker_name_full = att_row[2] if len(att_row) > 2 else ''
-            if worker_name_full.endswith(')') and '(' in worker_name_full:
-                name_part = worker_name_full[:worker_name_full.rfind('(')].strip()
-                gender_part = worker_name_full[worker_name_full.rfind('(')+1:-1].strip()
-            else:
-                name_part = worker_name_full
-                gender_part = ''
-            raw_ws.append([
-                TALUK_NAME,
-                panchayath_name,
-                work_code,
-                muster_roll_no,
-                att_row[1] if len(att_row) > 1 else '',
-                name_part,
-                gender_part,
-                att_row[4] if len(att_row) > 4 else '',
-                att_row[3] if len(att_row) > 3 else '',
-            ])
-    return raw_wb
-
 def find_col_idx(header_cols, search):
     search_clean = re.sub(r'[^a-zA-Z0-9]', '', search.lower())
     for i, h in enumerate(header_cols):
@@ -118,63 +94,65 @@ def find_col_idx(header_cols, search):
     return None
 
 def get_attendance_data(driver, url):
-    driver.get(url)
-    soup = BeautifulSoup(driver.page_source, 'html.parser')
-    work_name = None
-    for b in soup.find_all('b'):
-        if b.text.strip().startswith('Work Name'):
-            next_text = b.next_sibling
-            if next_text:
-                work_name = str(next_text).strip(' :\u00a0-')
-            break
-    if not work_name:
-        work_name_elem = soup.find(id="ContentPlaceHolder1_lbl_dtl")
-        if work_name_elem:
-            work_name = work_name_elem.text.strip()
-    attendance_data = []
-    tables = soup.find_all('table')
-    if not tables:
-        print("No tables found on the page.")
-        return None, None, work_name, None
-    attendance_table = tables[-1]
-    rows = attendance_table.find_all('tr')
-    header_cells = [th.text.strip() for th in rows[0].find_all(['th', 'td'])]
-    col_map = {name: idx for idx, name in enumerate(header_cells)}
-    for row in rows[1:]:
-        cols = row.find_all('td')
-        if cols and any(c.get_text(strip=True) for c in cols):
-            name_td = ''
-            for td in cols:
-                span = td.find('span', id=lambda x: x and 'lbl_workerName_' in x)
-                if span:
-                    name_td = span.get_text(strip=True)
-                    break
-            extracted = [
-                cols[col_map.get('S.No', -1)].get_text(strip=True) if 'S.No' in col_map else '',
-                cols[col_map.get('Job Card No', -1)].get_text(strip=True) if 'Job Card No' in col_map else '',
-                name_td,
-                cols[col_map.get('Attendance Date', -1)].get_text(strip=True) if 'Attendance Date' in col_map else '',
-                cols[col_map.get('Present/Absent', -1)].get_text(strip=True) if 'Present/Absent' in col_map else ''
-            ]
-            attendance_data.append(extracted)
-    photo_url = None
-    img_link = soup.find('a', text='Click here for large image')
-    if img_link and img_link.has_attr('href'):
-        photo_url = urljoin(driver.current_url, img_link['href'])
+    def load():
+        driver.get(url)
+        return driver.page_source, driver.current_url
+
+    with timed(PAGE_FETCH):
+        page_source, current_url = cassette.step('page', url, load)
+    metrics.count('browser_page_loads')
+    with timed(PARSE):
+        attendance_data, photo_url, work_name, header_cells = parse_attendance_page(page_source)
+    if photo_url:
+        photo_url = urljoin(current_url, photo_url)
     return attendance_data, photo_url, work_name, header_cells
 
 def download_photo(driver, url):
     if not url:
         return None
-    try:
-        driver.get(url)
+
+    def screenshot(photo_url):
+        driver.get(photo_url)
         # This assumes the image is the only thing on the page
-        img_bytes = io.BytesIO(driver.find_element(By.TAG_NAME, 'img').screenshot_as_png)
-        return img_bytes
+        return driver.find_element(By.TAG_NAME, 'img').screenshot_as_png
+
+    def fetch_bytes(photo_url):
+        return cassette.step('photo', photo_url, partial(screenshot, photo_url))
+
+    try:
+        with timed(PHOTO_FETCH):
+            # A screenshot is a re-rendered PNG, kept apart from the original the HTTP path stores
+            return get_photo_store().fetch(url, fetch_bytes, alias=f"screenshot:{normalize_url(url)}")
     except Exception as e:
         print(f"Error downloading photo: {e}")
         return None
 
+def session_from_driver(driver, session=None):
+    """
+    Hand the browser's ASP.NET session over to a pooled HTTP client so that
+    muster pages and photos can be fetched without driving Chromium.
+    """
+    session = session or create_session()
+    user_agent, cookies = cassette.step(
+        'session', 'cookies', lambda: (driver.execute_script("return navigator.userAgent"), driver.get_cookies()))
+    session.headers['User-Agent'] = user_agent
+    for cookie in cookies:
+        session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain'), path=cookie.get('path', '/'))
+    return session
+
+def fetch_muster_browser(driver, url):
+    attendance_data, photo_url, work_name, header_cells = get_attendance_data(driver, url)
+    photo = prepare_photo(download_photo(driver, photo_url)) if photo_url else None
+    return attendance_data, photo_url, work_name, header_cells, photo
+
+def fetch_muster_http(session, url):
+    attendance_data, photo_url, work_name, header_cells = attendance_downloader.get_attendance_data(url, session, listed=True)
+    if photo_url:
+        photo_url = urljoin(url, photo_url)
+    # Original JPEG bytes, not a re-encoded screenshot of the rendered image
+    photo = prepare_photo(attendance_downloader.download_photo(photo_url, session)) if photo_url else None
+    return attendance_data, photo_url, work_name, header_cells, photo
+
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
@@ -201,7 +179,7 @@ def resilient_click(driver, by, value, retries=3, delay=2):
             raise TimeoutException(f"Element with {by}='{value}' not found or clickable after waiting.")
     raise StaleElementReferenceException(f"Element with {by}='{value}' was stale after {retries} retries.")
 
-def get_work_codes(driver, attendance_date, panchayath_name):
+def navigate_to_panchayath(driver, attendance_date, panchayath_name):
     driver.get(BASE_URL)
     wait = WebDriverWait(driver, 40)
 
@@ -212,7 +190,7 @@ def get_work_codes(driver, attendance_date, panchayath_name):
     resilient_click(driver, By.NAME, 'ctl00$ContentPlaceHolder1$btn_showreport')
 
     # --- Step 2-4: Navigate Hierarchy ---
-    resilient_click(driver, By.LINK_TEXT, 'KARNATAKA')
+    resilient_click(driver, By.LINK_TEXT, STATE_NAME)
     wait.until(EC.presence_of_element_located((By.LINK_TEXT, DISTRICT_NAME)))
     
     resilient_click(driver, By.LINK_TEXT, DISTRICT_NAME)
@@ -229,12 +207,21 @@ def get_work_codes(driver, attendance_date, panchayath_name):
         resilient_click(driver, By.XPATH, panchayath_xpath)
     except TimeoutException:
         raise Exception("The selected Panchayath has not generated any Muster Roll for the chosen date.")
-
-    # --- Step 6: Muster Roll Page ---
     wait.until(EC.presence_of_element_located((By.ID, 'RepPr1')))
-    page_source = driver.page_source
-    soup = BeautifulSoup(page_source, 'html.parser')
-    muster_table = soup.find('div', {'id': 'RepPr1'}).find('table')
+    return panchayath_url
+
+def open_cached_panchayath(driver, panchayath_url):
+    driver.get(panchayath_url)
+    try:
+        WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.ID, 'RepPr1')))
+        return True
+    except TimeoutException:
+        return False
+
+def summarize_muster_table(page_source):
+    soup = make_soup(page_source, parse_only=HIERARCHY_STRAINER)
+    muster_div = soup.find('div', {'id': 'RepPr1'})
+    muster_table = muster_div.find('table') if muster_div else None
     if not muster_table:
         raise Exception("Could not find muster roll table.")
     
@@ -250,14 +237,42 @@ def get_work_codes(driver, attendance_date, panchayath_name):
         cols = row.find_all('td')
         if len(cols) > workcode_idx and len(cols) > muster_no_idx and cols[muster_no_idx].find('a', href=True):
             all_workcodes.add(cols[workcode_idx].get_text(strip=True))
-            
-    return sorted(list(all_workcodes)), page_source, panchayath_url, workcode_idx, muster_no_idx
-
-
-
-
-def run_scraper(driver, page_source, panchayath_url, panchayath_name, attendance_date, workcode_idx, muster_no_idx, selected_work_codes, status_callback):
-    soup = BeautifulSoup(page_source, 'html.parser')
+    return sorted(list(all_workcodes)), workcode_idx, muster_no_idx
+
+def get_work_codes(driver, attendance_date, panchayath_name, use_cache=True):
+    # A cached panchayath link turns the five-page walk into a single page load
+    cache = get_hierarchy_cache()
+    key = hierarchy_key(BASE_URL, attendance_date, STATE_NAME, DISTRICT_NAME, BLOCK_NAME, panchayath_name)
+
+    def navigate(panchayath_url):
+        if panchayath_url and not open_cached_panchayath(driver, panchayath_url):
+            # The link stopped working; walk the hierarchy again
+            cache.invalidate_url(key)
+            cache.invalidate_muster_table(panchayath_url)
+            panchayath_url = None
+        navigated = not panchayath_url
+        if navigated:
+            panchayath_url = navigate_to_panchayath(driver, attendance_date, panchayath_name)
+
+        # --- Step 6: Muster Roll Page ---
+        return driver.page_source, panchayath_url, navigated
+
+    with timed(NAVIGATION):
+        page_source, panchayath_url, navigated = cassette.step(
+            'navigation', [attendance_date, panchayath_name], partial(navigate, cache.get_url(key)))
+    summary = cache.get_muster_table(panchayath_url) if use_cache else None
+    if summary is None:
+        summary = summarize_muster_table(page_source)
+        cache.put_muster_table(panchayath_url, *summary)
+    if navigated:
+        cache.put_url(key, panchayath_url)
+    work_codes, workcode_idx, muster_no_idx = summary
+    return work_codes, page_source, panchayath_url, workcode_idx, muster_no_idx
+
+
+
+def run_scraper(driver, page_source, panchayath_url, panchayath_name, attendance_date, workcode_idx, muster_no_idx, selected_work_codes, status_callback, session=None, max_workers=HYBRID_MAX_WORKERS, delta=False, fresh=False):
+    soup = make_soup(page_source, parse_only=HIERARCHY_STRAINER)
     muster_table = soup.find('div', {'id': 'RepPr1'}).find('table')
     
     choice = 'all' if 'all' in selected_work_codes else 'work'
@@ -266,127 +281,59 @@ def run_scraper(driver, page_source, panchayath_url, panchayath_name, attendance
     if not rows_to_save:
         raise Exception("No muster roll data found for the selection.")
 
-    # Excel setup
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    row_cursor = 1
-    ws.cell(row=row_cursor, column=1, value="District:").font = Font(bold=True)
-    ws.cell(row=row_cursor, column=2, value=DISTRICT_LABEL)
-    ws.cell(row=row_cursor, column=3, value="Taluk/Block:").font = Font(bold=True)
-    ws.cell(row=row_cursor, column=4, value=TALUK_NAME)
-    row_cursor += 1
-    ws.cell(row=row_cursor, column=1, value="Panchayath:").font = Font(bold=True)
-    ws.cell(row=row_cursor, column=2, value=panchayath_name)
-    row_cursor += 1
-    workcode_row_idx_att = row_cursor
-    ws.cell(row=workcode_row_idx_att, column=1, value="Work code:").font = Font(bold=True)
-    ws.cell(row=workcode_row_idx_att, column=3, value="Work Name:").font = Font(bold=True)
-    row_cursor += 1
-    attendance_header_written = False
-    first_muster_processed = False
-
-    # Image-only Excel setup
-    img_wb = openpyxl.Workbook()
-    img_ws = img_wb.active
-    img_row_cursor = 1
-    img_bytes_refs = []
-    img_ws.cell(row=img_row_cursor, column=1, value="District:").font = Font(bold=True)
-    img_ws.cell(row=img_row_cursor, column=2, value=DISTRICT_LABEL)
-    img_ws.cell(row=img_row_cursor, column=3, value="Taluk/Block:").font = Font(bold=True)
-    img_ws.cell(row=img_row_cursor, column=4, value=TALUK_NAME)
-    img_row_cursor += 1
-    img_ws.cell(row=img_row_cursor, column=1, value="Panchayath:").font = Font(bold=True)
-    img_ws.cell(row=img_row_cursor, column=2, value=panchayath_name)
-    img_row_cursor += 1
-    workcode_row_idx = img_row_cursor
-    img_ws.cell(row=workcode_row_idx, column=1, value="Work code:").font = Font(bold=True)
-    img_ws.cell(row=workcode_row_idx, column=3, value="Work Name:").font = Font(bold=True)
-    img_row_cursor += 1
-    header_row_idx = img_row_cursor
-    img_ws.cell(row=header_row_idx, column=1, value='Muster Roll No').font = Font(bold=True)
-    img_ws.cell(row=header_row_idx, column=2, value='Image').font = Font(bold=True)
-    img_row_cursor += 1
+    renderer = MusterWorkbookRenderer(panchayath_name, DISTRICT_LABEL, TALUK_NAME)
 
     muster_data_cache = {}
     total_rows = len(rows_to_save)
+    muster_urls = [urljoin(panchayath_url, muster_href) for _, muster_href in rows_to_save]
+
+    # Unchanged musters fetched by an earlier run (an interrupted one, or with delta any
+    # previous one) are taken from the checkpoint unless fresh; each newly fetched one
+    # is checkpointed as soon as it completes
+    checkpoint = open_run('muster_rolls', muster_roll_params(panchayath_url, attendance_date, selected_work_codes),
+                          fresh=fresh, any_age=delta)
+    signatures = {muster_key(url): row_signature(cols) for url, (cols, _) in zip(muster_urls, rows_to_save)}
+    done, pending, changed = plan_musters(checkpoint, muster_urls, signatures)
+    if done or changed:
+        status_callback(f"Resuming: {describe_plan(total_rows, pending, changed)}", 0)
+
+    # Hybrid mode: with a session handed over from the browser, pages and photos are
+    # fetched over HTTP in parallel and still come back in muster order.
+    if session is not None:
+        fetch = partial(fetch_muster_http, session)
+    else:
+        fetch = partial(fetch_muster_browser, driver)
+    if checkpoint:
+        fetch = checkpoint.saving(fetch, key=muster_key, signature=lambda url: signatures[muster_key(url)])
+    if session is not None:
+        fetched = pipelined(pending, [(fetch, max_workers)])
+    else:
+        fetched = map(fetch, pending)
+
+    failed = []
     for i, (cols, muster_href) in enumerate(rows_to_save):
-        muster_url = urljoin(panchayath_url, muster_href)
-        
         status_callback(f"Processing muster roll {i+1}/{total_rows}...", (i+1)/total_rows * 100)
-        
-        attendance_data, photo_url, work_name, header_cells = get_attendance_data(driver, muster_url)
+
+        muster_url = muster_urls[i]
+        result = done.get(muster_key(muster_url)) or next(fetched)
+        attendance_data, photo_url, work_name, header_cells, photo = result
         muster_data_cache[muster_url] = (attendance_data, photo_url, work_name, header_cells)
-        
-        img_bytes = download_photo(driver, photo_url) if photo_url else None
         muster_roll_no = cols[muster_no_idx].get_text(strip=True)
+        reason = attendance_downloader.muster_failure(result)
+        if reason:
+            failed.append((muster_roll_no, reason))
+        work_code = cols[workcode_idx].get_text(strip=True)
+        renderer.add_muster(muster_roll_no, work_code, attendance_data, work_name, header_cells, photo)
 
-        if not attendance_header_written and header_cells:
-            if not first_muster_processed:
-                first_work_code = cols[workcode_idx].get_text(strip=True)
-                first_work_name = work_name or ''
-                ws.cell(row=workcode_row_idx_att, column=2, value=first_work_code)
-                ws.cell(row=workcode_row_idx_att, column=4, value=first_work_name)
-                img_ws.cell(row=workcode_row_idx, column=2, value=first_work_code)
-                img_ws.cell(row=workcode_row_idx, column=4, value=first_work_name)
-                first_muster_processed = True
-            ws.cell(row=row_cursor, column=1, value="Muster Roll No").font = Font(bold=True)
-            for col_idx, header in enumerate(header_cells, 2):
-                ws.cell(row=row_cursor, column=col_idx, value=header).font = Font(bold=True)
-            row_cursor += 1
-            attendance_header_written = True
-        
-        if attendance_data:
-            for att_row in attendance_data:
-                ws.cell(row=row_cursor, column=1, value=muster_roll_no)
-                for col_idx, val in enumerate(att_row, 2):
-                    ws.cell(row=row_cursor, column=col_idx, value=val)
-                row_cursor += 1
-        
-        if img_bytes:
-            img_bytes.seek(0)
-            img = XLImage(img_bytes)
-            img_cell = f"H{row_cursor-len(attendance_data) if attendance_data else row_cursor}"
-            ws.add_image(img, img_cell)
-            row_cursor += 3
-        else:
-            row_cursor += 2
-        row_cursor += 2
-
-        start_img_row = img_row_cursor
-        img_ws.cell(row=img_row_cursor, column=1, value=muster_roll_no).font = Font(bold=True, size=18)
-        if img_bytes:
-            img_bytes.seek(0)
-            img_bytes_for_imgwb = io.BytesIO(img_bytes.getbuffer())
-            img2 = XLImage(img_bytes_for_imgwb)
-            img_ws.add_image(img2, f"B{img_row_cursor}")
-            img_bytes_refs.append(img_bytes_for_imgwb)
-            img_height_rows = 20
-            end_img_row = img_row_cursor + img_height_rows - 1
-            img_ws.merge_cells(start_row=start_img_row, start_column=1, end_row=end_img_row, end_column=1)
-            img_ws.cell(row=start_img_row, column=1).alignment = Alignment(vertical='center', horizontal='center')
-            img_row_cursor += img_height_rows
-        else:
-            end_img_row = img_row_cursor
-            img_row_cursor += 3
-            img_ws.merge_cells(start_row=start_img_row, start_column=1, end_row=end_img_row, end_column=1)
-            img_ws.cell(row=start_img_row, column=1).alignment = Alignment(vertical='center', horizontal='center')
-        img_row_cursor += 2
-
-    raw_wb = save_raw_excel(rows_to_save, panchayath_name, attendance_date, muster_no_idx, workcode_idx, panchayath_url, muster_data_cache)
-
-    wb_io = io.BytesIO()
-    wb.save(wb_io)
-    wb_io.seek(0)
-
-    img_wb_io = io.BytesIO()
-    img_wb.save(img_wb_io)
-    img_wb_io.seek(0)
-    
-    raw_wb_io = io.BytesIO()
-    raw_wb.save(raw_wb_io)
-    raw_wb_io.seek(0)
+    wb_io, img_wb_io = renderer.close()
+    raw_wb_io = save_raw_excel(iter_raw_rows(rows_to_save, panchayath_name, muster_no_idx, workcode_idx, panchayath_url, muster_data_cache))
+    if checkpoint:
+        checkpoint.finish(not failed)
+    if failed:
+        status_callback(f"{len(failed)} muster rolls could not be fetched: {attendance_downloader.describe_failures(failed)}", 100)
 
-    return wb_io, img_wb_io, raw_wb_io
+    # failed lists (muster roll no, reason) for the muster rolls missing from the workbooks
+    return wb_io, img_wb_io, raw_wb_io, failed
 
 def main():
     # This function is for standalone script execution
@@ -1,240 +1,280 @@
-import io
 import requests
-from openpyxl import Workbook
-from openpyxl.drawing.image import Image as XLImage
-from bs4 import BeautifulSoup
-from openpyxl.styles import Alignment, Font
+from excel_writer import open_workbook
+from http_client import SITE_URL, http_get
+from http_cache import get_cache
+from html_parser import is_error_page, parse_attendance_page
+from photo_store import get_photo_store
+from image_processing import prepare_photo
+from pipeline import pipelined
+from checkpoint_store import open_run
+from concurrency_control import HOST_MAX_CONCURRENCY, report_congestion
+from retry_policy import DEFAULT_POLICY
+from metrics import PAGE_FETCH, PARSE, PHOTO_FETCH, timed
 
-STARTING_URL = "https://mnregaweb4.nic.in/nregaarch/View_NMMS_atten_date_dtl_rpt.aspx?page=&short_name=KN&state_name=KARNATAKA&state_code=15&district_name=BALLARI&district_code=1505&block_name=SIRUGUPPA&block_code=1505007&"
+STARTING_URL = f"{SITE_URL}View_NMMS_atten_date_dtl_rpt.aspx?page=&short_name=KN&state_name=KARNATAKA&state_code=15&district_name=BALLARI&district_code=1505&block_name=SIRUGUPPA&block_code=1505007&"
 DEFAULT_DISTRICT = "Ballari"
 DEFAULT_TALUK = "Siruguppa"
+# Worker threads; the requests actually in flight follow the adaptive per-host limit
+MAX_IN_FLIGHT = HOST_MAX_CONCURRENCY
 
 
-def get_attendance_data(url):
+class MusterFetchError(Exception):
+    """A muster page that could not be fetched, even after retrying."""
+
+
+def fetch_attendance_page(url, session=None, listed=False, policy=None):
+    """
+    Return (attendance_data, photo_url, work_name, header_cells) for a muster page.
+
+    Error and throttle pages are fetched again with backoff, as is any page without
+    an attendance grid when listed (the URL was taken from a muster table, so the
+    muster roll exists). Otherwise a report without a grid is returned as it is: the
+    muster roll does not exist. Raises MusterFetchError when the retries run out.
+    """
+    policy = policy or DEFAULT_POLICY
+    for attempt in range(policy.attempts):
+        try:
+            # Connection errors and 429/5xx were already retried by http_get
+            with timed(PAGE_FETCH):
+                response = http_get(url, session, use_cache=attempt == 0)
+                response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            raise MusterFetchError(str(e)) from e
+        with timed(PARSE):
+            parsed = parse_attendance_page(response.content)
+        if parsed[0] is not None:
+            return parsed
+        # Do not serve this page from the cache next time
+        get_cache().invalidate(url)
+        if not listed and not is_error_page(response.content):
+            return parsed
+        report_congestion(url)
+        if attempt + 1 < policy.attempts:
+            policy.sleep(attempt)
+    raise MusterFetchError(f"still an error or throttle page after {policy.attempts} attempts")
+
+
+def get_attendance_data(url, session=None, listed=False):
+    """fetch_attendance_page that prints the error and returns Nones instead of raising."""
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
+        return fetch_attendance_page(url, session, listed)
+    except MusterFetchError as e:
         print(f"Error fetching attendance data: {e}")
         return None, None, None, None
-    soup = BeautifulSoup(response.content, 'html.parser')
-    # Extract work name
-    work_name = None
-    for b in soup.find_all('b'):
-        if b.text.strip().startswith('Work Name'):
-            next_text = b.next_sibling
-            if next_text:
-                work_name = str(next_text).strip(' :\u00a0-')
-            break
-    if not work_name:
-        work_name_elem = soup.find(id="ContentPlaceHolder1_lbl_dtl")
-        if work_name_elem:
-            work_name = work_name_elem.text.strip()
-    # Attendance Table
-    attendance_data = []
-    tables = soup.find_all('table')
-    if not tables:
-        print("No tables found on the page.")
-        return None, None, work_name, None
-    attendance_table = tables[-1]
-    rows = attendance_table.find_all('tr')
-    header_cells = [th.text.strip() for th in rows[0].find_all(['th', 'td'])]
-    col_map = {name: idx for idx, name in enumerate(header_cells)}
-    for row in rows[1:]:
-        cols = row.find_all('td')
-        if cols and any(c.get_text(strip=True) for c in cols):
-            name_td = ''
-            for td in cols:
-                span = td.find('span', id=lambda x: x and 'lbl_workerName_' in x)
-                if span:
-                    name_td = span.get_text(strip=True)
-                    break
-            extracted = [
-                cols[col_map.get('S.No', -1)].get_text(strip=True) if 'S.No' in col_map else '',
-                cols[col_map.get('Job Card No', -1)].get_text(strip=True) if 'Job Card No' in col_map else '',
-                name_td,
-                cols[col_map.get('Attendance Date', -1)].get_text(strip=True) if 'Attendance Date' in col_map else '',
-                cols[col_map.get('Present/Absent', -1)].get_text(strip=True) if 'Present/Absent' in col_map else ''
-            ]
-            attendance_data.append(extracted)
-    photo_url = None
-    img_link = soup.find('a', text='Click here for large image')
-    if img_link and img_link.has_attr('href'):
-        photo_url = img_link['href']
-    return attendance_data, photo_url, work_name, header_cells
-
-
-def download_photo(url):
+
+
+def download_photo(url, session=None, store=None, policy=None):
     if not url:
         return None
+    store = store or get_photo_store()
+    policy = policy or DEFAULT_POLICY
+
+    def fetch_bytes(photo_url):
+        for attempt in range(policy.attempts):
+            # Photos live in the photo store, so skip the response cache
+            response = http_get(photo_url, session, use_cache=False)
+            response.raise_for_status()
+            if not response.headers.get('Content-Type', '').startswith('text/'):
+                return response.content
+            # An error or throttle page served in place of the photo
+            report_congestion(photo_url)
+            if attempt + 1 < policy.attempts:
+                policy.sleep(attempt)
+        raise requests.exceptions.RetryError(f"still an error page instead of the photo after {policy.attempts} attempts")
+
     try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        img_bytes = io.BytesIO(response.content)
-        return img_bytes
+        with timed(PHOTO_FETCH):
+            return store.fetch(url, fetch_bytes)
     except requests.exceptions.RequestException as e:
         print(f"Error downloading photo: {e}")
         return None
 
 
-def write_attendance_excel(attendance_records, work_code, work_name, panchayat_name, file_base):
-    wb = Workbook()
-    ws = wb.active
-    ws.title = 'Attendance Data'
+def write_sheet_header(ws, work_code, work_name, panchayat_name):
     ws.append([f'Work Code: {work_code}'])
     ws.append([f'Work Name: {work_name if work_name else ""}'])
     ws.append([f'District: {DEFAULT_DISTRICT}'])
     ws.append([f'Taluk/Block: {DEFAULT_TALUK}'])
     ws.append([f'Panchayath Name: {panchayat_name}'])
     ws.append([])
+
+
+def write_attendance_excel(attendance_records, work_code, work_name, panchayat_name, file_base, target=None, backend=None):
+    wb = open_workbook(target, backend)
+    ws = wb.add_sheet('Attendance Data')
+    write_sheet_header(ws, work_code, work_name, panchayat_name)
     for record in attendance_records:
         ws.append([record['muster_roll_no']] + record['row'])
+    output = wb.close()
     print(f'Saved attendance_data_{file_base}.xlsx')
-    return wb
+    return output
 
 
-def write_images_excel(image_records, work_code, work_name, panchayat_name, file_base):
-    wb = Workbook()
-    ws = wb.active
-    ws.title = 'Images'
-    ws.append([f'Work Code: {work_code}'])
-    ws.append([f'Work Name: {work_name if work_name else ""}'])
-    ws.append([f'District: {DEFAULT_DISTRICT}'])
-    ws.append([f'Taluk/Block: {DEFAULT_TALUK}'])
-    ws.append([f'Panchayath Name: {panchayat_name}'])
-    ws.append([])
+def write_images_excel(image_records, work_code, work_name, panchayat_name, file_base, target=None, backend=None):
+    wb = open_workbook(target, backend)
+    ws = wb.add_sheet('Images')
+    if any(entry['image'] for entry in image_records):
+        # Column widths have to be known before the first streamed row
+        ws.set_column_width('B', 20)
+    write_sheet_header(ws, work_code, work_name, panchayat_name)
     ws.append(['Muster Roll No.', 'Image'])
-    img_row = ws.max_row + 1
-    img_refs = []
     for entry in image_records:
         muster_no = entry['muster_roll_no']
-        img_bytes = entry['image']
-        if img_bytes:
-            img_bytes.seek(0)
-            img_data = img_bytes.read()
-            img_bytes_for_excel = io.BytesIO(img_data)
-            xl_img = XLImage(img_bytes_for_excel)
-            img_refs.append(img_bytes_for_excel)
-            cell = ws.cell(row=img_row, column=1, value=muster_no)
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-            cell.font = Font(size=16, bold=True)
-            cell_ref = f'B{img_row}'
-            ws.add_image(xl_img, cell_ref)
-            try:
-                from PIL import Image as PILImage
-                img_bytes_for_excel.seek(0)
-                pil_img = PILImage.open(img_bytes_for_excel)
-                img_height_px = pil_img.height
-                img_height_pt = img_height_px * 0.75
-                ws.row_dimensions[img_row].height = img_height_pt
-                ws.column_dimensions['B'].width = 20
-            except Exception:
-                pass
+        photo = entry['image']
+        img_row = ws.row_count + 1
+        if photo:
+            # Dimensions were computed when the photo was downscaled
+            ws.set_row_height(img_row, photo.height * 0.75)
+            ws.append([muster_no], styles={1: 'bold_center_16'})
+            ws.add_image(photo.path, img_row, 2, photo.width, photo.height)
         else:
-            cell = ws.cell(row=img_row, column=1, value=muster_no)
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-            cell.font = Font(size=16, bold=True)
-            ws.cell(row=img_row, column=2, value='No Image')
-        img_row += 1
+            ws.append([muster_no, 'No Image'], styles={1: 'bold_center_16'})
+    output = wb.close()
     print(f'Saved attendance_images_{file_base}.xlsx')
-    return wb
+    return output
 
 
-def write_attendance_images_excel(option_c_records, work_code, work_name, panchayat_name, file_base):
-    wb = Workbook()
-    ws = wb.active
-    ws.title = 'Attendance+Images'
-    ws.append([f'Work Code: {work_code}'])
-    ws.append([f'Work Name: {work_name if work_name else ""}'])
-    ws.append([f'District: {DEFAULT_DISTRICT}'])
-    ws.append([f'Taluk/Block: {DEFAULT_TALUK}'])
-    ws.append([f'Panchayath Name: {panchayat_name}'])
-    ws.append([])
+def write_attendance_images_excel(option_c_records, work_code, work_name, panchayat_name, file_base, target=None, backend=None):
+    wb = open_workbook(target, backend)
+    ws = wb.add_sheet('Attendance+Images')
+    if any(entry['image'] for entry in option_c_records):
+        ws.set_column_width('G', 20)
+    write_sheet_header(ws, work_code, work_name, panchayat_name)
     table_header = ['Muster Roll No.', 'S.No', 'Job Card No', 'Worker Name(Gender)', 'Attendance Date', 'Present/Absent', 'Image']
     ws.append(table_header)
-    img_refs = []
     for entry in option_c_records:
         muster_no = entry['muster_roll_no']
         att_rows = entry['attendance']
-        img_bytes = entry['image']
-        first_row = True
+        photo = entry['image']
         if att_rows:
+            excel_rows = []
             for row in att_rows:
                 if len(row) >= 4 and row[3]:
                     row[3] = ' '.join(row[3].split()[:3])
-                excel_row = [muster_no if first_row else '',
-                             row[0] if len(row) > 0 else '',
-                             row[1] if len(row) > 1 else '',
-                             row[2] if len(row) > 2 else '',
-                             row[3] if len(row) > 3 else '',
-                             row[4] if len(row) > 4 else '',
-                             '']
-                if first_row:
-                    if img_bytes:
-                        img_bytes.seek(0)
-                        img_data = img_bytes.read()
-                        img_bytes_for_excel = io.BytesIO(img_data)
-                        xl_img = XLImage(img_bytes_for_excel)
-                        img_refs.append(img_bytes_for_excel)
-                        row_idx = ws.max_row + 1
-                        ws.append(excel_row)
-                        cell_ref = f'G{row_idx}'
-                        ws.add_image(xl_img, cell_ref)
-                        ws.row_dimensions[row_idx].height = 100
-                        ws.column_dimensions['G'].width = 20
-                    else:
-                        ws.append(excel_row)
-                    first_row = False
-                else:
-                    ws.append(excel_row)
+                excel_rows.append(['' if excel_rows else muster_no,
+                                   row[0] if len(row) > 0 else '',
+                                   row[1] if len(row) > 1 else '',
+                                   row[2] if len(row) > 2 else '',
+                                   row[3] if len(row) > 3 else '',
+                                   row[4] if len(row) > 4 else '',
+                                   ''])
         else:
-            excel_row = [muster_no, '', '', '', '', '', '']
-            if img_bytes:
-                img_bytes.seek(0)
-                img_data = img_bytes.read()
-                img_bytes_for_excel = io.BytesIO(img_data)
-                xl_img = XLImage(img_bytes_for_excel)
-                img_refs.append(img_bytes_for_excel)
-                row_idx = ws.max_row + 1
-                ws.append(excel_row)
-                cell_ref = f'G{row_idx}'
-                ws.add_image(xl_img, cell_ref)
-                ws.row_dimensions[row_idx].height = 100
-                ws.column_dimensions['G'].width = 20
-            else:
-                ws.append(excel_row)
+            excel_rows = [[muster_no, '', '', '', '', '', '']]
+        if photo:
+            row_idx = ws.row_count + 1
+            ws.set_row_height(row_idx, 100)
+            ws.add_image(photo.path, row_idx, 7, photo.width, photo.height)
+        for excel_row in excel_rows:
+            ws.append(excel_row)
+    output = wb.close()
     print(f'Saved attendance_with_images_{file_base}.xlsx')
-    return wb
+    return output
+
+
+def build_muster_urls(panchayat_name, panchayat_code, fin_year, work_code, msr_no, attendance_date, digest):
+    url_with_workcode = (
+        f"{STARTING_URL}"
+        f"panchayat_name={panchayat_name}&panchayat_code={panchayat_code}"
+        f"&fin_year={fin_year}"
+        f"&source=&work_code={work_code}"
+        f"&msr_no={msr_no}"
+        f"&AttendanceDate={attendance_date}"
+        f"&Digest={digest}"
+    )
+    url_without_workcode = (
+        f"{STARTING_URL}"
+        f"panchayat_name={panchayat_name}&panchayat_code={panchayat_code}"
+        f"&fin_year={fin_year}"
+        f"&source="
+        f"&msr_no={msr_no}"
+        f"&AttendanceDate={attendance_date}"
+        f"&Digest={digest}"
+    )
+    return url_with_workcode, url_without_workcode
+
+
+def muster_failure(result):
+    """Why a muster listed in a muster table came back incomplete, or None if it did not."""
+    attendance_data, photo_url, _, _, photo = result
+    if attendance_data is None:
+        return "page could not be fetched"
+    if photo_url and photo is None:
+        return "photo could not be downloaded"
+    return None
+
 
+def describe_failures(failed):
+    return ', '.join(f"{muster_roll_no} ({reason})" for muster_roll_no, reason in failed)
 
-def run_attendance_downloader(panchayat_name, panchayat_code, fin_year, work_code, msr_start, msr_end, attendance_date, digest, progress_callback=None):
+
+def fetch_muster_roll(url_with_workcode, url_without_workcode, session=None):
+    """
+    Raises MusterFetchError when neither page could be fetched, or the page without the
+    work code has no muster after the one with it failed; a missing photo comes back as None.
+    """
+    error = None
+    try:
+        att_data, photo_url, wname, headers = fetch_attendance_page(url_with_workcode, session)
+    except MusterFetchError as e:
+        error = e
+        att_data = None
+    if not att_data:
+        att_data, photo_url, wname, headers = fetch_attendance_page(url_without_workcode, session)
+        if not att_data and error is not None:
+            raise error
+    photo = prepare_photo(download_photo(photo_url, session)) if photo_url else None
+    return att_data, photo_url, wname, headers, photo
+
+
+def run_attendance_downloader(panchayat_name, panchayat_code, fin_year, work_code, msr_start, msr_end, attendance_date, digest, progress_callback=None, max_workers=MAX_IN_FLIGHT, session=None, fresh=False):
+    """
+    Returns (attendance, images, attendance+images, pdf, failed) where failed lists
+    (msr_no, reason) for every muster roll that could not be fetched even after
+    retrying; those are left out of the checkpoint, so a rerun fetches just them.
+    fresh=True fetches every muster roll again instead of resuming an unfinished run.
+    """
     attendance_records = []
     image_records = []
     option_c_records = []
     work_name = None
     table_headers = None
-    for msr_no in range(msr_start, msr_end + 1):
-        url_with_workcode = (
-            f"{STARTING_URL}"
-            f"panchayat_name={panchayat_name}&panchayat_code={panchayat_code}"
-            f"&fin_year={fin_year}"
-            f"&source=&work_code={work_code}"
-            f"&msr_no={msr_no}"
-            f"&AttendanceDate={attendance_date}"
-            f"&Digest={digest}"
-        )
-        url_without_workcode = (
-            f"{STARTING_URL}"
-            f"panchayat_name={panchayat_name}&panchayat_code={panchayat_code}"
-            f"&fin_year={fin_year}"
-            f"&source="
-            f"&msr_no={msr_no}"
-            f"&AttendanceDate={attendance_date}"
-            f"&Digest={digest}"
-        )
-        att_data, photo_url, wname, headers = get_attendance_data(url_with_workcode)
-        if not att_data:
-            att_data, photo_url, wname, headers = get_attendance_data(url_without_workcode)
+    msr_numbers = list(range(msr_start, msr_end + 1))
+    url_pairs = [
+        build_muster_urls(panchayat_name, panchayat_code, fin_year, work_code, msr_no, attendance_date, digest)
+        for msr_no in msr_numbers
+    ]
+    # MSRs saved by an earlier, interrupted run of the same work and date are not fetched again
+    checkpoint = open_run('msr_range', {
+        'panchayat_code': panchayat_code, 'fin_year': fin_year, 'work_code': work_code,
+        'attendance_date': attendance_date,
+    }, fresh=fresh)
+    done = checkpoint.load_all() if checkpoint else {}
+    pending = [(msr_no, urls) for msr_no, urls in zip(msr_numbers, url_pairs) if str(msr_no) not in done]
+    if done and progress_callback:
+        progress_callback(f"Resuming: {len(msr_numbers) - len(pending)} muster rolls already fetched,")
+
+    failures = {}
+
+    def fetch(item):
+        msr_no, urls = item
+        try:
+            att_data, photo_url, wname, headers, photo = fetch_muster_roll(*urls, session=session)
+        except MusterFetchError as e:
+            failures[msr_no] = str(e)
+            return None, None, None, None, None
+        # An MSR of the range that does not exist is done too; an empty grid gets it checkpointed
+        return att_data or [], photo_url, wname, headers, photo
+
+    if checkpoint:
+        fetch = checkpoint.saving(fetch, key=lambda item: str(item[0]))
+    # Each worker handles one muster at a time, so max_workers bounds the requests in flight.
+    # Results come back in submission order, keeping the workbooks in MSR order; queued
+    # fetches are dropped if the run is abandoned (e.g. a cancelled job).
+    fetched = pipelined(pending, [(fetch, max_workers)])
+    results = (done.get(str(msr_no)) or next(fetched) for msr_no in msr_numbers)
+    for msr_no, (att_data, photo_url, wname, headers, photo) in zip(msr_numbers, results):
+        if photo_url and photo is None:
+            failures.setdefault(msr_no, "photo could not be downloaded")
         if wname and not work_name:
             work_name = wname
         if headers and not table_headers:
@@ -242,28 +282,22 @@ def run_attendance_downloader(panchayat_name, panchayat_code, fin_year, work_cod
         if att_data:
             for row in att_data:
                 attendance_records.append({'muster_roll_no': msr_no, 'row': row})
-        if photo_url:
-            img_bytes = download_photo(photo_url)
-            image_records.append({'muster_roll_no': msr_no, 'image': img_bytes})
-        else:
-            image_records.append({'muster_roll_no': msr_no, 'image': None})
-        option_c_records.append({'muster_roll_no': msr_no, 'attendance': att_data, 'image': img_bytes if photo_url else None})
+        image_records.append({'muster_roll_no': msr_no, 'image': photo})
+        option_c_records.append({'muster_roll_no': msr_no, 'attendance': att_data, 'image': photo})
         print(f"Muster Roll No. {msr_no} parsed ")
         if progress_callback:
             progress_callback(f"Muster Roll {msr_no} parsed ,")
     file_base = f"{work_code}_{attendance_date}".replace('/', '_')
 
-    att_wb = write_attendance_excel(attendance_records, work_code, work_name, panchayat_name, file_base)
-    img_wb = write_images_excel(image_records, work_code, work_name, panchayat_name, file_base)
-    optc_wb = write_attendance_images_excel(option_c_records, work_code, work_name, panchayat_name, file_base)
-
-    att_xlsx = io.BytesIO()
-    att_wb.save(att_xlsx)
-    att_xlsx.seek(0)
-    img_xlsx = io.BytesIO()
-    img_wb.save(img_xlsx)
-    img_xlsx.seek(0)
-    optc_xlsx = io.BytesIO()
-    optc_wb.save(optc_xlsx)
-    optc_xlsx.seek(0)
-    return att_xlsx, img_xlsx, optc_xlsx, None
+    att_xlsx = write_attendance_excel(attendance_records, work_code, work_name, panchayat_name, file_base)
+    img_xlsx = write_images_excel(image_records, work_code, work_name, panchayat_name, file_base)
+    optc_xlsx = write_attendance_images_excel(option_c_records, work_code, work_name, panchayat_name, file_base)
+    if checkpoint:
+        checkpoint.finish(not failures)
+    failed = sorted(failures.items())
+    if failed:
+        summary = describe_failures(failed)
+        print(f"Failed muster rolls: {summary}")
+        if progress_callback:
+            progress_callback(f"{len(failed)} muster rolls could not be fetched: {summary}")
+    return att_xlsx, img_xlsx, optc_xlsx, None, failed
@@ -1,6 +1,9 @@
 import streamlit as st
+import time
 from datetime import date
-from attendance_downloader import run_attendance_downloader
+from attendance_downloader import MAX_IN_FLIGHT, run_attendance_downloader
+from job_runner import JobRunner, DONE, FAILED, RUNNING, QUEUED
+from metrics_panel import show_metrics, show_profile
 
 st.title('Attendance Downloader')
 
@@ -9,8 +12,29 @@ if 'submitted' not in st.session_state:
     st.session_state['submitted'] = False
 if 'files' not in st.session_state:
     st.session_state['files'] = None
-if 'progress_msgs' not in st.session_state:
-    st.session_state['progress_msgs'] = []
+
+@st.cache_resource
+def get_job_runner():
+    # Downloads run here, outside the script thread, and outlive reruns and reconnects
+    return JobRunner()
+
+runner = get_job_runner()
+if 'job_id' not in st.session_state:
+    # A refreshed page finds its job again through the URL
+    restored = runner.status(st.query_params.get('job'))
+    st.session_state['job_id'] = restored['id'] if restored else None
+
+def submit_download(args, workers, fresh=False):
+    job_id = runner.submit(
+        lambda report: run_attendance_downloader(*args, progress_callback=report, max_workers=workers, fresh=fresh),
+        label=f"{args[3]} {args[6]}",
+        meta={'file_base': f"{args[3]}_{args[6]}".replace('/', '_')},
+        profile=st.session_state.get('profile', False)
+    )
+    # Kept for resuming the same download after a failure
+    st.session_state['job_args'] = (args, workers)
+    st.session_state['job_id'] = job_id
+    st.query_params['job'] = job_id
 
 # User input fields
 panchayat_name = st.text_input('Panchayath Name (e.g., BALAKUNDHI)', key='panchayat_name')
@@ -21,21 +45,21 @@ msr_start = st.number_input('Muster Roll Start Number', min_value=1, step=1, key
 msr_end = st.number_input('Muster Roll End Number', min_value=1, step=1, key='msr_end')
 attendance_date = st.date_input('Attendance Date', value=date.today(), key='attendance_date')
 digest = st.text_input('Digest', key='digest')
+max_workers = st.number_input('Parallel Requests', min_value=1, max_value=32, value=MAX_IN_FLIGHT, step=1, key='max_workers',
+                              help='Upper bound; fewer requests run at once while the site is slow or throttling.')
+st.checkbox('Start fresh', value=False, key='fresh',
+            help='Fetches every muster roll again instead of resuming an unfinished download of the same muster rolls.')
+st.checkbox('Profile this download', value=False, key='profile',
+            help='Samples where the download spends its time and tracks memory per stage; a flame graph and a memory report are offered with the files. Slows the download down.')
 
 # Progress area
 progress_area = st.empty()
 
-# Progress callback for backend
-progress_msgs = st.session_state.get('progress_msgs', [])
-def progress_callback(msg):
-    progress_msgs.append(msg)
-    st.session_state['progress_msgs'] = progress_msgs
-    progress_area.write('\n'.join(progress_msgs))
-
 # Download button and status
 download_btn_col, status_col = st.columns([2, 1])
 with download_btn_col:
-    download_clicked = st.button('Download Attendance Data')
+    current = runner.status(st.session_state['job_id']) if st.session_state['job_id'] else None
+    download_clicked = st.button('Download Attendance Data', disabled=bool(current) and current['status'] in (QUEUED, RUNNING))
 
 if download_clicked:
     # Input validation
@@ -57,31 +81,46 @@ if download_clicked:
             st.error(err)
     else:
         st.session_state['submitted'] = True
-        st.session_state['progress_msgs'] = []
+        st.session_state['files'] = None
         att_date_str = attendance_date.strftime('%d/%m/%Y')
         if not panchayat_code.startswith('1505007'):
             panchayat_code_full = '1505007' + panchayat_code
         else:
             panchayat_code_full = panchayat_code
-        st.info('Running backend process...')
-        try:
-            files = run_attendance_downloader(
-                panchayat_name, panchayat_code_full, fin_year, work_code, int(msr_start), int(msr_end), att_date_str, digest,
-                progress_callback=progress_callback
-            )
-            st.session_state['files'] = files
-        except Exception as e:
-            st.error(f'Error during processing: {e}')
+        args = (panchayat_name, panchayat_code_full, fin_year, work_code, int(msr_start), int(msr_end), att_date_str, digest)
+        submit_download(args, int(max_workers), st.session_state.get('fresh', False))
 
-# Show progress messages
-if st.session_state.get('progress_msgs'):
-    progress_area.write('\n'.join(st.session_state['progress_msgs']))
+# Follow the background job
+job = runner.status(st.session_state['job_id']) if st.session_state['job_id'] else None
+if job:
+    if job['log']:
+        progress_area.write('\n'.join(job['log']))
+    if job['status'] == DONE:
+        st.session_state['files'] = runner.result(job['id'])
+        st.session_state['file_base'] = job['meta']['file_base']
+    elif job['finished_at'] is not None:
+        if job['status'] == FAILED:
+            st.error(f"Error during processing: {job['error']}")
+        else:
+            st.info('Download cancelled.')
+        show_metrics(job['metrics'], 'failed')
+        show_profile(job['profile'], 'failed')
+        # Muster rolls already fetched were checkpointed; only the rest are downloaded again
+        if 'job_args' in st.session_state and st.button('Resume Download'):
+            runner.forget(job['id'])
+            submit_download(*st.session_state['job_args'])
+            st.rerun()
+    else:
+        st.info('Running backend process...')
+        if st.button('Cancel'):
+            runner.cancel(job['id'])
+        time.sleep(1)
+        st.rerun()
 
 # Show download buttons if files exist
 files = st.session_state.get('files')
 if files:
-    att_date_str = attendance_date.strftime('%d/%m/%Y')
-    file_base = f"{work_code}_{att_date_str}".replace('/', '_')
+    file_base = st.session_state['file_base']
     file_labels = [
         (files[0], f'attendance_data_{file_base}.xlsx', 'Attendance Data Excel'),
         (files[1], f'attendance_images_{file_base}.xlsx', 'Images Excel'),
@@ -93,8 +132,25 @@ if files:
             st.download_button(f'Download {label}', file_obj, file_name=fname, key=fname)
     with status_col:
         st.success('✔️ Parsing complete! Files are ready for download.')
+    if job and job['status'] == DONE:
+        show_metrics(job['metrics'], 'done')
+        show_profile(job['profile'], 'done')
+    failed = files[4] if len(files) > 4 else []
+    if failed:
+        st.warning('These muster rolls could not be fetched and are missing from the files:\n\n' + '\n'.join(
+            f'- MSR {msr_no}: {reason}' for msr_no, reason in failed))
+        # Everything else was checkpointed, so only the failed muster rolls are fetched again
+        if 'job_args' in st.session_state and st.button('Retry Failed Muster Rolls'):
+            runner.forget(st.session_state['job_id'])
+            st.session_state['files'] = None
+            submit_download(*st.session_state['job_args'])
+            st.rerun()
     # Reset button below download buttons
     if st.button('Reset App'):
+        if st.session_state['job_id']:
+            runner.forget(st.session_state['job_id'])
+        if 'job' in st.query_params:
+            del st.query_params['job']
         for key in list(st.session_state.keys()):
             del st.session_state[key]
         st.rerun() 
\ No newline at end of file
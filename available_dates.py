@@ -0,0 +1,85 @@
+import os
+import threading
+import time
+from attend_2way import load_form, new_navigator
+
+DATES_TTL = float(os.environ.get('NMMS_DATES_TTL', 10 * 60))
+# A failed refresh is retried this soon rather than after a full TTL
+DATES_RETRY = float(os.environ.get('NMMS_DATES_RETRY', 30))
+
+
+def fetch_available_dates(session=None):
+    """One plain GET of the report form; returns the attendance dates on offer."""
+    return load_form(new_navigator(session))
+
+
+class AvailableDates:
+    """
+    Available attendance dates shared by every session in the process.
+
+    Only the very first get() waits for the site. Once the list is older than ttl
+    it is still served while a background thread fetches a fresh one, and
+    start_refresher() keeps it refreshed even when nobody is asking.
+    """
+
+    def __init__(self, fetch=fetch_available_dates, ttl=DATES_TTL):
+        self._fetch = fetch
+        self.ttl = ttl
+        self._dates = None
+        self._fetched_at = 0
+        self._next_refresh = 0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        # Serializes fetches; readers never wait on it once a list exists
+        self._fetch_lock = threading.Lock()
+        self._refresher = None
+
+    def get(self):
+        with self._lock:
+            dates = self._dates
+            if dates is not None and time.monotonic() >= self._next_refresh and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self.refresh, name='available-dates-refresh', daemon=True).start()
+        if dates is None:
+            # Nothing to serve yet; the first caller fetches while the others wait
+            self.refresh(force=False)
+            with self._lock:
+                dates = self._dates or []
+        return list(dates)
+
+    def refresh(self, force=True):
+        with self._fetch_lock:
+            if not force and self._dates is not None:
+                return
+            try:
+                dates = self._fetch()
+            except Exception as e:
+                print(f"Error fetching available dates: {e}")
+                dates = None
+            with self._lock:
+                now = time.monotonic()
+                if dates:
+                    self._dates = dates
+                    self._fetched_at = now
+                    self._next_refresh = now + self.ttl
+                else:
+                    # Keep serving the last good list; an empty first result is not remembered
+                    self._next_refresh = now + DATES_RETRY
+                self._refreshing = False
+
+    def age(self):
+        with self._lock:
+            return None if self._dates is None else time.monotonic() - self._fetched_at
+
+    def start_refresher(self, interval=None):
+        if self._refresher is not None:
+            return
+        interval = interval or self.ttl
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.refresh()
+
+        self._refresher = threading.Thread(target=loop, name='available-dates-refresher', daemon=True)
+        self._refresher.start()
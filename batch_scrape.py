@@ -0,0 +1,190 @@
+import argparse
+import io
+import os
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urljoin
+from attendance_downloader import describe_failures
+from attend_2way import (
+    get_muster_roll_rows, get_panchayath_links, new_navigator, open_muster_table, resolve_block,
+    save_raw_excel, scrape_muster_rolls,
+)
+from checkpoint_store import muster_roll_params, open_run
+from http_client import get_session
+from job_runner import JobCancelled
+import metrics
+from metrics import submit_in_context
+from profiler import profiled
+
+# Panchayaths scraped at once, and muster pages/photos in flight per panchayath
+BATCH_WORKERS = int(os.environ.get('NMMS_BATCH_WORKERS', 4))
+BATCH_MUSTER_WORKERS = int(os.environ.get('NMMS_BATCH_MUSTER_WORKERS', 4))
+
+
+def file_label(panchayath_name):
+    return panchayath_name.replace('.', '').replace(' ', '_')
+
+
+def scrape_panchayath(session, panchayath_name, panchayath_url, attendance_date, muster_workers=BATCH_MUSTER_WORKERS,
+                      delta=False, progress_callback=None, fresh=False):
+    # Each panchayath gets its own navigator; they all share the pooled session
+    muster_page = open_muster_table(new_navigator(session), panchayath_url, use_cache=not (delta or fresh))
+    if muster_page is None:
+        raise Exception("Could not read the muster roll table.")
+    muster_table, _, workcode_idx, muster_no_idx = muster_page
+    rows_to_save = get_muster_roll_rows(muster_table, 'all', None, workcode_idx, muster_no_idx)
+    if not rows_to_save:
+        raise Exception("No muster roll data found.")
+    # Same checkpoint run as a single scrape of all work codes, so a rerun batch resumes
+    checkpoint = open_run('muster_rolls', muster_roll_params(panchayath_url, attendance_date), fresh=fresh, any_age=delta)
+    return scrape_muster_rolls(session, rows_to_save, panchayath_name, panchayath_url, workcode_idx, muster_no_idx,
+                               fetch_workers=muster_workers, photo_workers=muster_workers,
+                               progress_callback=progress_callback, checkpoint=checkpoint)
+
+
+def run_batch(attendance_date, panchayath_names=None, session=None, progress_callback=None,
+              max_workers=BATCH_WORKERS, muster_workers=BATCH_MUSTER_WORKERS, delta=False, fresh=False):
+    """
+    Scrape every muster roll of several panchayaths for one date. The state -> block
+    hierarchy is walked at most once (the block link is cached); panchayaths are
+    then scraped concurrently.
+
+    panchayath_names=None selects every panchayath that generated muster rolls.
+    Returns (outputs, combined raw workbook, errors): outputs maps each panchayath
+    to its (attendance, images, raw) workbooks, errors maps it to a message.
+    progress_callback(message, percentage) is called from one thread at a time, with
+    percentage=None for the muster rolls of each panchayath. An exception it raises
+    (e.g. a cancelled job) stops the batch: running panchayaths stop at their next
+    muster roll and the ones not started are dropped.
+    delta=True rereads every muster table and fetches only the muster rolls that are
+    new or changed since the previous scrape of the date; fresh=True rereads them too and
+    fetches every muster roll again instead of resuming an unfinished batch.
+    """
+    session = session or get_session()
+    # The panchayath list is always read afresh, so a batch sees newly listed panchayaths
+    block_url, panch_table = resolve_block(new_navigator(session), attendance_date, use_cache=False)
+    if panch_table is None:
+        raise Exception("Could not reach the panchayath list for the selected date.")
+    links = get_panchayath_links(panch_table)
+
+    names = list(links) if panchayath_names is None else [name.strip().upper() for name in panchayath_names]
+    errors = {name: "No NMR generated by the Panchayath" for name in names if name not in links}
+    names = [name for name in names if name in links]
+
+    results = {}
+    raw_rows = {}
+    progress_lock = threading.Lock()
+
+    def panchayath_progress(name):
+        if progress_callback is None:
+            return None
+
+        def report(message, _):
+            with progress_lock:
+                progress_callback(f"{name}: {message}", None)
+        return report
+
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    try:
+        futures = {
+            submit_in_context(executor, scrape_panchayath, session, name, urljoin(block_url, links[name]), attendance_date,
+                              muster_workers, delta, panchayath_progress(name), fresh): name
+            for name in names
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            name = futures[future]
+            try:
+                att_out, img_out, raw_out, rows, failed = future.result()
+                results[name] = (att_out, img_out, raw_out)
+                raw_rows[name] = rows
+                if failed:
+                    # The workbooks are still produced; rerunning the batch fetches just these
+                    errors[name] = f"{len(failed)} muster rolls could not be fetched: {describe_failures(failed)}"
+            except JobCancelled:
+                # Raised by a panchayath's progress report; stop the whole batch, not just that one
+                raise
+            except Exception as e:
+                print(f"Error scraping {name}: {e}")
+                errors[name] = str(e)
+            if progress_callback:
+                with progress_lock:
+                    progress_callback(f"Finished {name} ({done}/{len(names)})", done / len(names) * 100)
+    finally:
+        # Only matters when the batch is stopped early: panchayaths not started yet are dropped
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    # Keep the selection order regardless of which panchayath finished first
+    outputs = {name: results[name] for name in names if name in results}
+    combined_raw = save_raw_excel(row for name in outputs for row in raw_rows[name])
+    return outputs, combined_raw, errors
+
+
+def batch_files(outputs, combined_raw, attendance_date):
+    """Yield (file name, workbook) for every file a batch produced."""
+    date_part = attendance_date.replace('/', '_')
+    for name, (att_out, img_out, raw_out) in outputs.items():
+        label = file_label(name)
+        yield f"muster_rolls_{label}_{date_part}.xlsx", att_out
+        yield f"muster_images_{label}_{date_part}.xlsx", img_out
+        yield f"raw_data_{label}_{date_part}.xlsx", raw_out
+    yield f"raw_data_all_{date_part}.xlsx", combined_raw
+
+
+def build_batch_zip(outputs, combined_raw, attendance_date):
+    zip_io = io.BytesIO()
+    with zipfile.ZipFile(zip_io, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for file_name, workbook in batch_files(outputs, combined_raw, attendance_date):
+            zf.writestr(file_name, workbook.getvalue())
+    zip_io.seek(0)
+    return zip_io
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrape several panchayaths of the block for one attendance date.")
+    parser.add_argument('attendance_date', help="e.g. 18/07/2025")
+    parser.add_argument('panchayaths', nargs='*', help="Panchayath names; all panchayaths when omitted")
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--zip', action='store_true', help="Write a single zip archive instead of separate files")
+    parser.add_argument('--delta', action='store_true',
+                        help="Only fetch muster rolls that are new or changed since the previous run for the date")
+    parser.add_argument('--fresh', action='store_true',
+                        help="Fetch every muster roll again instead of resuming an unfinished run for the date")
+    parser.add_argument('--metrics', metavar='PATH',
+                        help="Write the run's timings and counters here (Prometheus text for .prom, JSON otherwise)")
+    parser.add_argument('--profile', action='store_true',
+                        help="Profile the scrape (as does NMMS_PROFILE=1); a flame graph and memory report go to the output dir")
+    args = parser.parse_args()
+
+    with metrics.collect() as run_metrics, profiled(args.profile, run_metrics) as profile:
+        outputs, combined_raw, errors = run_batch(args.attendance_date, args.panchayaths or None,
+                                                  progress_callback=lambda message, _: print(message), delta=args.delta,
+                                                  fresh=args.fresh)
+    run_metrics.finish()
+    os.makedirs(args.output_dir, exist_ok=True)
+    if profile is not None:
+        profile.save(args.output_dir, f"profile_batch_{args.attendance_date.replace('/', '_')}")
+    if args.zip:
+        path = os.path.join(args.output_dir, f"muster_rolls_batch_{args.attendance_date.replace('/', '_')}.zip")
+        with open(path, 'wb') as f:
+            f.write(build_batch_zip(outputs, combined_raw, args.attendance_date).getvalue())
+        print(f"Saved {path}")
+    else:
+        for file_name, workbook in batch_files(outputs, combined_raw, args.attendance_date):
+            path = os.path.join(args.output_dir, file_name)
+            with open(path, 'wb') as f:
+                f.write(workbook.getvalue())
+            print(f"Saved {path}")
+    for name, message in errors.items():
+        print(f"{name}: {message}")
+    snapshot = run_metrics.snapshot()
+    for row in metrics.stage_rows(snapshot):
+        print(f"{row['stage']}: {row['count']} x {row['mean ms']} ms, {row['total s']} s total")
+    if args.metrics:
+        metrics.save_snapshot(snapshot, args.metrics)
+        print(f"Saved {args.metrics}")
+    metrics.write_metrics_file()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+End-to-end load test of the HTTP scrape paths against the stand-in NIC site.
+
+    python -m benchmarks.load_test batch --panchayaths 6 --musters 50 --latency 0.2 --max-concurrency 8
+    python -m benchmarks.load_test downloader --musters 200 --error-rate 0.05
+    python -m benchmarks.load_test batch --site-url http://10.0.0.5:8080/nregaarch/
+
+The stub runs in this process unless --site-url points at one started separately
+(python -m benchmarks.stub_server), which keeps its work off the scraper's GIL.
+Caches, checkpoints and the photo store live in a temporary directory, so every run
+starts cold. The report covers throughput, the client's request counters and
+stage timings, the adaptive per-host limit it settled on and what the server saw.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from urllib.request import urlopen
+from benchmarks import stub_server
+
+
+def configure_environment(site_url, work_dir):
+    # Read by the scraper modules at import time
+    os.environ['NMMS_SITE_URL'] = site_url
+    os.environ['NMMS_CACHE_DIR'] = os.path.join(work_dir, 'http')
+    os.environ['NMMS_PHOTO_DIR'] = os.path.join(work_dir, 'photos')
+    os.environ['NMMS_HIERARCHY_CACHE'] = os.path.join(work_dir, 'hierarchy.json')
+    os.environ['NMMS_CHECKPOINT_DB'] = os.path.join(work_dir, 'checkpoints.sqlite3')
+
+
+def run_batch_engine(args):
+    from batch_scrape import run_batch
+    outputs, _, errors = run_batch(stub_server.LAST_DATE.strftime('%d/%m/%Y'), max_workers=args.batch_workers,
+                                   muster_workers=args.muster_workers)
+    return len(outputs), errors
+
+
+def run_downloader_engine(args):
+    from attendance_downloader import run_attendance_downloader
+    code = f'{stub_server.BLOCK_CODE}001'
+    work_code = f'{code}/IF/93393000'
+    *_, failed = run_attendance_downloader(
+        stub_server.PANCHAYATHS[0], code, stub_server.FIN_YEAR, work_code, 1001, 1000 + args.musters,
+        stub_server.LAST_DATE.strftime('%d/%m/%Y'), 'stub', max_workers=args.muster_workers)
+    return 1, dict((str(msr_no), reason) for msr_no, reason in failed)
+
+
+ENGINES = {'batch': run_batch_engine, 'downloader': run_downloader_engine}
+
+
+def server_stats(server, site_url):
+    if server is not None:
+        return server.snapshot()
+    with urlopen(site_url.split(stub_server.SITE_PATH)[0] + stub_server.STATS_PATH) as response:
+        return json.load(response)
+
+
+def muster_pages(stats):
+    return stats['requests'].get(f'{stub_server.MUSTER_PAGE} 200', 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the scrapers against the stand-in NIC site.")
+    parser.add_argument('engine', choices=sorted(ENGINES))
+    parser.add_argument('--site-url', help="Use a stub server that is already running")
+    parser.add_argument('--batch-workers', type=int, default=4, help="Panchayaths scraped at once (batch)")
+    parser.add_argument('--muster-workers', type=int, default=16, help="Muster roll fetch workers")
+    parser.add_argument('--json', metavar='PATH', help="Also write the report here")
+    parser.add_argument('--profile', action='store_true',
+                        help="Profile the scrape (as does NMMS_PROFILE=1); the results go next to --json or here")
+    stub_server.add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = None
+    site_url = args.site_url
+    if not site_url:
+        server = stub_server.start_server(stub_server.config_from_args(args))
+        site_url = server.site_url
+    work_dir = tempfile.mkdtemp(prefix='nmms_load_')
+    configure_environment(site_url, work_dir)
+    import metrics
+    from concurrency_control import host_limits
+    from profiler import profiled
+
+    print(f"Scraping {site_url} with the {args.engine} engine...")
+    served_before = muster_pages(server_stats(server, site_url))
+    started = time.perf_counter()
+    with metrics.collect() as run_metrics, profiled(args.profile, run_metrics) as profile:
+        panchayaths, errors = ENGINES[args.engine](args)
+    elapsed = time.perf_counter() - started
+    run_metrics.finish()
+    snapshot = run_metrics.snapshot()
+    stats = server_stats(server, site_url)
+    if server is not None:
+        server.shutdown()
+    musters = muster_pages(stats) - served_before
+
+    report = {
+        'engine': args.engine,
+        'elapsed': elapsed,
+        'panchayaths': panchayaths,
+        'muster_pages': musters,
+        'muster_pages_per_second': musters / elapsed if elapsed else 0,
+        'errors': errors,
+        'metrics': snapshot,
+        'host_limits': host_limits(),
+        'server': stats,
+    }
+    print(f"{musters} muster pages from {panchayaths} panchayath(s) in {elapsed:.1f}s "
+          f"({report['muster_pages_per_second']:.1f}/s)")
+    print(f"Requests: {metrics.counter_total(snapshot, 'requests')}, retries: {metrics.counter_total(snapshot, 'retries')}, "
+          f"circuit rejections: {metrics.counter_total(snapshot, 'circuit_rejections')}")
+    for row in metrics.stage_rows(snapshot):
+        print(f"  {row['stage']}: {row['count']} x {row['mean ms']} ms, {row['total s']} s total")
+    for limit in report['host_limits']:
+        print(f"Host limit for {limit['host']}: {limit['limit']} in flight, {limit['congestion_events']} congestion events")
+    print(f"Server: peak concurrency {stats['peak_concurrency']}, throttled {stats['throttled']}, "
+          f"errors {stats['errors']}, error pages {stats['error_pages']}, dropped {stats['dropped']}")
+    for name, message in errors.items():
+        print(f"{name}: {message}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved {args.json}")
+    if profile is not None:
+        profile.save(os.path.dirname(args.json or '') or '.', f'profile_load_{args.engine}')
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
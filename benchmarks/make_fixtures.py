@@ -0,0 +1,84 @@
+"""
+Regenerate the benchmark fixtures in benchmarks/fixtures. The output is deterministic,
+so the committed files only change when the page builders do.
+
+    python -m benchmarks.make_fixtures
+"""
+import io
+import os
+import random
+from PIL import Image, ImageDraw
+from benchmarks import nic_pages
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+MUSTER_SIZES = (10, 25, 50, 100)
+MUSTER_LIST_SIZE = 300
+PANCHAYATHS = ['BAGEWADI', 'B.M. SUGURU', 'DESANUR', 'HACHOLLI', 'KARURU', 'KUDUDARAHAL', 'MUDDATANUR', 'NADAVI',
+               'RARAVI', 'SIRIGERI', 'TEKKALAKOTE', 'UPPARAHOSALLI']
+WORK_NAMES = ['Desilting of tank', 'Construction of farm pond', 'Bund formation', 'Road side plantation',
+              'Nala development', 'Construction of cattle shed']
+ATTENDANCE_DATE = '18/07/2025'
+# (file name, width, height): a photo as NIC serves it and one already downscaled
+PHOTOS = (('photo_large.jpg', 1600, 1200), ('photo_small.jpg', 640, 480))
+
+
+def photo(width, height, seed=0):
+    """A noisy outdoor-looking JPEG, so compression behaves like a site photo's."""
+    rng = random.Random(seed)
+    image = Image.new('RGB', (width, height))
+    draw = ImageDraw.Draw(image)
+    horizon = height * 2 // 5
+    draw.rectangle((0, 0, width, horizon), fill=(150, 185, 220))
+    draw.rectangle((0, horizon, width, height), fill=(140, 110, 75))
+    for _ in range(width * height // 400):
+        x, y = rng.randrange(width), rng.randrange(horizon, height)
+        shade = rng.randint(-40, 40)
+        draw.ellipse((x, y, x + rng.randint(2, 12), y + rng.randint(2, 8)), fill=(140 + shade, 110 + shade, 75 + shade))
+    for _ in range(12):
+        x, y = rng.randrange(width), rng.randrange(horizon, height - 60)
+        draw.rectangle((x, y, x + 20, y + 60), fill=(rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+    return image
+
+
+def fixtures():
+    """{file name: bytes} for every fixture."""
+    files = {
+        'report_form.html': nic_pages.report_form([ATTENDANCE_DATE, '17/07/2025', '16/07/2025']),
+        'state.html': nic_pages.hierarchy_grid('State', [('KARNATAKA', 'state.aspx?state_code=15', 5210)]),
+        'district.html': nic_pages.hierarchy_grid('District', [
+            (name, f'district.aspx?district_code=15{i:02d}', 100 + i)
+            for i, name in enumerate(['BAGALKOT', 'BALLARI', 'BELAGAVI', 'BIDAR', 'CHITRADURGA', 'DAVANAGERE'], 1)]),
+        'block.html': nic_pages.hierarchy_grid('Block', [
+            (name, f'block.aspx?block_code=150500{i}', 50 + i)
+            for i, name in enumerate(['BALLARI', 'HADAGALI', 'HAGARIBOMMANAHALLI', 'HOSPET', 'KAMPLI', 'SANDUR', 'SIRUGUPPA'], 1)]),
+        'panchayath_list.html': nic_pages.panchayath_list([
+            (name, f'panchayat.aspx?panchayat_code=1505007{i:03d}', 0 if name == 'KARURU' else 20 + i)
+            for i, name in enumerate(PANCHAYATHS, 1)]),
+        'muster_list.html': nic_pages.muster_list([
+            (f'1505007016/IF/{93393042 + i % 40}', WORK_NAMES[i % len(WORK_NAMES)], 9000 + i,
+             f'View_NMMS_atten_date_dtl_rpt.aspx?msr_no={9000 + i}&AttendanceDate={ATTENDANCE_DATE}', 10 + i % 90)
+            for i in range(MUSTER_LIST_SIZE)]),
+    }
+    for size in MUSTER_SIZES:
+        files[f'muster_{size}.html'] = nic_pages.muster_page(
+            WORK_NAMES[size % len(WORK_NAMES)], nic_pages.workers(size, seed=size), ATTENDANCE_DATE,
+            photo_href=f'/nregaarch/Photos/1505007016/{size}_large.jpg')
+    files = {name: page.encode('utf-8') for name, page in files.items()}
+    for name, width, height in PHOTOS:
+        buffer = io.BytesIO()
+        photo(width, height, seed=width).save(buffer, 'JPEG', quality=80)
+        files[name] = buffer.getvalue()
+    return files
+
+
+def main():
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    for name, content in fixtures().items():
+        path = os.path.join(FIXTURES_DIR, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        print(f"Saved {path}")
+
+
+if __name__ == '__main__':
+    main()
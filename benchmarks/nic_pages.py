@@ -0,0 +1,132 @@
+"""
+HTML in the shape of the NIC NMMS attendance report pages: the report form, the
+state / district / block grids, the RepPr1 panchayath and muster roll lists and the
+muster detail page. Markup follows what the scrapers look for, ASP.NET padding
+(hidden fields, layout tables) included, so parse timings stay representative.
+"""
+import base64
+import html
+import random
+
+FIRST_NAMES = ['RAMESH', 'SURESH', 'LAKSHMI', 'HANUMANTHA', 'YALLAMMA', 'BASAVARAJ', 'GANGAMMA', 'MALLESH',
+               'SHARANAMMA', 'VEERESH', 'NAGARAJ', 'PARVATHI', 'ERANNA', 'HULIGEMMA', 'SIDDAPPA', 'RENUKA']
+LAST_NAMES = ['K', 'B', 'H', 'M', 'NAYAK', 'GOUDA', 'SHETTY', 'POOJAR', 'KURUBA', 'MADIGA']
+
+
+def viewstate(size, seed=0):
+    """A __VIEWSTATE-like base64 blob of about size characters."""
+    rng = random.Random(seed)
+    return base64.b64encode(bytes(rng.getrandbits(8) for _ in range(size * 3 // 4))).decode('ascii')
+
+
+def _hidden_fields(state):
+    return (
+        f'<input type="hidden" name="__EVENTTARGET" id="__EVENTTARGET" value="" />\n'
+        f'<input type="hidden" name="__EVENTARGUMENT" id="__EVENTARGUMENT" value="" />\n'
+        f'<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="{state}" />\n'
+        f'<input type="hidden" name="__VIEWSTATEGENERATOR" id="__VIEWSTATEGENERATOR" value="6A1B2C3D" />\n'
+        f'<input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="{state[:160]}" />\n'
+    )
+
+
+def _page(title, body, state=''):
+    return (
+        '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" '
+        '"http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>' + html.escape(title) + '</title>\n'
+        '<style type="text/css">.grid td { border: 1px solid #ccc; }</style>\n'
+        '<script type="text/javascript">function __doPostBack(t, a) { }</script></head>\n'
+        '<body><form name="aspnetForm" method="post" id="aspnetForm">\n'
+        + _hidden_fields(state) +
+        '<table width="100%"><tr><td align="center"><b>Mahatma Gandhi National Rural Employment Guarantee Act</b></td></tr>\n'
+        '<tr><td align="center">National Mobile Monitoring System</td></tr></table>\n'
+        + body +
+        '\n<div class="footer">Designed and developed by NIC</div>\n'
+        '</form></body></html>\n'
+    )
+
+
+def _rows(rows):
+    return ''.join('<tr>' + ''.join(f'<td>{cell}</td>' for cell in row) + '</tr>\n' for row in rows)
+
+
+def _link(text, href):
+    return f'<a href="{html.escape(href)}">{html.escape(text)}</a>' if href else html.escape(text)
+
+
+def report_form(dates, state_value='15', state_name='KARNATAKA', state_size=6000):
+    """The View_NMMS_atten_date_new.aspx form: state and attendance date drop-downs."""
+    options = ''.join(f'<option value="{date}">{date}</option>' for date in dates)
+    body = (
+        '<table><tr><td>State</td><td><select name="ctl00$ContentPlaceHolder1$ddlstate" id="ContentPlaceHolder1_ddlstate">'
+        f'<option value="00">--Select--</option><option value="{state_value}">{state_name}</option></select></td></tr>\n'
+        '<tr><td>Attendance Date</td><td><select name="ctl00$ContentPlaceHolder1$ddl_attendance" id="ContentPlaceHolder1_ddl_attendance">'
+        f'<option value="">--Select--</option>{options}</select></td></tr>\n'
+        '<tr><td colspan="2"><input type="submit" name="ctl00$ContentPlaceHolder1$btn_showreport" value="Show Attendance" '
+        'id="ContentPlaceHolder1_btn_showreport" /></td></tr></table>'
+    )
+    return _page('NMMS Attendance', body, viewstate(state_size))
+
+
+def hierarchy_grid(level, entries, state_size=6000):
+    """State, district or block grid: entries is [(name, href, muster roll count)]."""
+    rows = [['S No', level, 'Muster Rolls']]
+    rows += [[str(i), _link(name, href), str(count)] for i, (name, href, count) in enumerate(entries, 1)]
+    body = f'<table id="grdTable" class="grid" cellspacing="0" border="1">\n{_rows(rows)}</table>'
+    return _page(f'NMMS Attendance - {level}', body, viewstate(state_size, len(entries)))
+
+
+def panchayath_list(entries, state_size=6000):
+    """Block page listing panchayaths: entries is [(name, href, muster roll count)]."""
+    rows = [['S No', 'Panchayat', 'Works', 'Muster Rolls', 'Workers']]
+    rows += [[str(i), html.escape(name), str(count // 2), _link(str(count), href if count else None), str(count * 12)]
+             for i, (name, href, count) in enumerate(entries, 1)]
+    body = f'<div id="RepPr1"><table class="grid" cellspacing="0" border="1">\n{_rows(rows)}</table></div>'
+    return _page('NMMS Attendance - Panchayat', body, viewstate(state_size, len(entries)))
+
+
+def muster_list(entries, state_size=6000):
+    """Panchayath page listing muster rolls: entries is [(work code, work name, muster roll no, href, workers)]."""
+    rows = [['S No', 'Work Code', 'Work Name', 'MustRoll No.', 'Workers']]
+    rows += [[str(i), html.escape(code), html.escape(name), _link(str(msr_no), href), str(workers)]
+             for i, (code, name, msr_no, href, workers) in enumerate(entries, 1)]
+    body = f'<div id="RepPr1"><table class="grid" cellspacing="0" border="1">\n{_rows(rows)}</table></div>'
+    return _page('NMMS Attendance - Muster Rolls', body, viewstate(state_size, len(entries)))
+
+
+def workers(count, seed=0, panchayath_code='1505007016'):
+    """[(job card no, worker name, gender, P/A)] for a muster roll."""
+    rng = random.Random(seed)
+    return [
+        (f"KN-05-007-{panchayath_code[-3:]}-{rng.randint(1, 999):03d}/{rng.randint(1, 999)}",
+         f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+         rng.choice('MF'),
+         'P' if rng.random() < 0.9 else 'A')
+        for _ in range(count)
+    ]
+
+
+def muster_page(work_name, worker_rows, attendance_date='18/07/2025', photo_href=None, state_size=4000):
+    """View_NMMS_atten_date_dtl_rpt.aspx: work details, photo link and the attendance grid."""
+    header = ['S.No', 'Job Card No', 'Worker Name(Gender)', 'Attendance Date', 'Present/Absent']
+    rows = [
+        [str(i), html.escape(job_card),
+         f'<span id="ContentPlaceHolder1_grd_lbl_workerName_{i - 1}">{html.escape(name)}({gender})</span>',
+         attendance_date, status]
+        for i, (job_card, name, gender, status) in enumerate(worker_rows, 1)
+    ]
+    photo = f'<a href="{html.escape(photo_href)}" target="_blank">Click here for large image</a>' if photo_href else ''
+    body = (
+        f'<table width="100%"><tr><td><b>Work Name</b> : {html.escape(work_name)}&nbsp;</td></tr>\n'
+        f'<tr><td>Attendance Date : {attendance_date}</td></tr>\n'
+        f'<tr><td>{photo}</td></tr></table>\n'
+        '<table id="ContentPlaceHolder1_grd" class="grid" cellspacing="0" border="1">\n'
+        '<tr>' + ''.join(f'<th scope="col">{cell}</th>' for cell in header) + '</tr>\n'
+        + _rows(rows) + '</table>'
+    )
+    return _page('NMMS Attendance - Muster Roll', body, viewstate(state_size, len(worker_rows)))
+
+
+def error_page(message='Server Error in \'/\' Application.'):
+    """The short error / throttle page NIC serves with a 200."""
+    return f'<html><head><title>Error</title></head><body><h1>{html.escape(message)}</h1></body></html>'
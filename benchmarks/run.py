@@ -0,0 +1,338 @@
+"""
+Offline benchmarks for the parsing and workbook hot paths, run against the saved NIC
+pages and photos in benchmarks/fixtures; nothing talks to the live site.
+
+    python -m benchmarks.run                  # run everything, compare with baselines.json
+    python -m benchmarks.run muster_roll_rows # only cases whose name contains the text
+    python -m benchmarks.run --save-baseline  # record this run as the new baseline
+    python -m benchmarks.run --cassette run.nmms  # also parse the muster pages of a recorded run
+
+Each case reports its best round, as pages/s, rows/s or seconds per MB written.
+Cases more than --tolerance worse than the baseline are flagged and make the run
+exit with status 1. Baselines are only comparable on the machine that recorded them.
+"""
+import os
+
+# Fixture responses must not end up in (or come from) the HTTP cache
+os.environ.setdefault('NMMS_CACHE', '0')
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+import requests
+from PIL import Image
+import attend_2way
+import attendance_downloader
+import cassette
+import excel_writer
+import html_parser
+from html_parser import HIERARCHY_STRAINER, make_soup
+from http_cache import resource_type
+from image_processing import ProcessedPhoto
+from muster_workbooks import MusterWorkbookRenderer
+from benchmarks.make_fixtures import FIXTURES_DIR, MUSTER_SIZES
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+DEFAULT_TOLERANCE = 0.25
+MIN_ROUNDS = 5
+MIN_SECONDS = 1.0
+# Workbook cases: musters of WORKBOOK_WORKERS workers, each with the downscaled photo
+WORKBOOK_MUSTERS = 40
+WORKBOOK_WORKERS = 25
+RAW_ROWS = 5000
+FIXTURE_HOST = 'https://mnregaweb4.nic.in/nregaarch/'
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), 'rb') as f:
+        return f.read()
+
+
+class FixtureSession:
+    """Stands in for a requests.Session, answering every request with one fixture page."""
+
+    def __init__(self, content):
+        self.content = content
+        self.headers = {}
+
+    def request(self, method, url, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response._content = self.content
+        response.headers['Content-Type'] = 'text/html; charset=utf-8'
+        return response
+
+
+class Case:
+    """
+    One benchmark. run() does one round and returns how much work it did: pages or
+    rows for a rate, bytes written for a seconds-per-MB case.
+    """
+
+    def __init__(self, name, unit, run):
+        self.name = name
+        self.unit = unit
+        self.run = run
+
+    @property
+    def higher_is_better(self):
+        return self.unit.endswith('/s')
+
+    def measure(self, min_rounds=MIN_ROUNDS, min_seconds=MIN_SECONDS):
+        best = None
+        rounds = 0
+        started = time.perf_counter()
+        while rounds < min_rounds or time.perf_counter() - started < min_seconds:
+            round_started = time.perf_counter()
+            # The writers announce every file they save
+            with contextlib.redirect_stdout(io.StringIO()):
+                amount = self.run()
+            elapsed = time.perf_counter() - round_started
+            if best is None or elapsed < best[0]:
+                best = (elapsed, amount)
+            rounds += 1
+        elapsed, amount = best
+        if self.unit == 's/MB':
+            return elapsed / (amount / 1e6)
+        return amount / elapsed
+
+
+def parser_backends():
+    return ['lxml', 'bs4'] if html_parser.lxml is not None else ['bs4']
+
+
+def workbook_backends():
+    return ['openpyxl', 'xlsxwriter'] if excel_writer.xlsxwriter is not None else ['openpyxl']
+
+
+def attendance_cases():
+    cases = []
+    for backend in parser_backends():
+        for size in MUSTER_SIZES:
+            session = FixtureSession(fixture(f'muster_{size}.html'))
+            url = FIXTURE_HOST + f'View_NMMS_atten_date_dtl_rpt.aspx?msr_no={size}'
+
+            def run(session=session, url=url, backend=backend):
+                default, html_parser.PARSER_BACKEND = html_parser.PARSER_BACKEND, backend
+                try:
+                    attendance_data = attendance_downloader.get_attendance_data(url, session)[0]
+                finally:
+                    html_parser.PARSER_BACKEND = default
+                assert attendance_data, "fixture page did not parse"
+                return 1
+
+            cases.append(Case(f'get_attendance_data[{backend},{size} workers]', 'pages/s', run))
+    return cases
+
+
+def cassette_cases(path):
+    """get_attendance_data over every muster page of a run recorded with cassette.py."""
+    recording = cassette.Cassette(path)
+    try:
+        pages = [(url, FixtureSession(body)) for url, body in recording.pages() if resource_type(url) == 'muster']
+    finally:
+        recording.close()
+    if not pages:
+        raise SystemExit(f"{path} has no muster pages")
+    name = os.path.splitext(os.path.basename(path))[0]
+    cases = []
+    for backend in parser_backends():
+        def run(backend=backend):
+            default, html_parser.PARSER_BACKEND = html_parser.PARSER_BACKEND, backend
+            try:
+                for url, session in pages:
+                    attendance_downloader.get_attendance_data(url, session)
+            finally:
+                html_parser.PARSER_BACKEND = default
+            return len(pages)
+
+        cases.append(Case(f'get_attendance_data[{backend},cassette {name}]', 'pages/s', run))
+    return cases
+
+
+def hierarchy_cases():
+    pages = [fixture(name) for name in ('state.html', 'district.html', 'block.html')]
+    panchayath_page = fixture('panchayath_list.html')
+    muster_page = fixture('muster_list.html')
+
+    def walk():
+        for content, name in zip(pages, (attend_2way.STATE_NAME, attend_2way.DISTRICT_NAME, attend_2way.BLOCK_NAME)):
+            table = attend_2way.get_table_by_id_or_div(make_soup(content, parse_only=HIERARCHY_STRAINER))
+            assert attend_2way.get_link_from_table(table, 1, name)
+        panch_table = make_soup(panchayath_page, parse_only=HIERARCHY_STRAINER).find('div', {'id': 'RepPr1'}).find('table')
+        assert attend_2way.get_panchayath_links(panch_table)
+        return len(pages) + 1
+
+    def summarize():
+        muster_table = make_soup(muster_page, parse_only=HIERARCHY_STRAINER).find('div', {'id': 'RepPr1'}).find('table')
+        assert attend_2way.summarize_muster_table(muster_table)
+        return len(muster_table.find_all('tr')) - 1
+
+    return [
+        Case('hierarchy_pages', 'pages/s', walk),
+        Case('summarize_muster_table', 'rows/s', summarize),
+    ]
+
+
+def muster_roll_row_cases():
+    muster_table = make_soup(fixture('muster_list.html'), parse_only=HIERARCHY_STRAINER).find('div', {'id': 'RepPr1'}).find('table')
+    work_codes, workcode_idx, muster_no_idx = attend_2way.summarize_muster_table(muster_table)
+    rows = len(muster_table.find_all('tr')) - 1
+    return [
+        Case('get_muster_roll_rows[all]', 'rows/s',
+             lambda: rows if attend_2way.get_muster_roll_rows(muster_table, 'all', None, workcode_idx, muster_no_idx) else 0),
+        Case('get_muster_roll_rows[work]', 'rows/s',
+             lambda: rows if attend_2way.get_muster_roll_rows(muster_table, 'work', work_codes[:5], workcode_idx, muster_no_idx) else 0),
+    ]
+
+
+def sample_musters():
+    """(muster roll no, work code, attendance_data, work_name, header_cells, photo) tuples for the workbook cases."""
+    attendance_data, _, work_name, header_cells = html_parser.parse_attendance_page(fixture(f'muster_{WORKBOOK_WORKERS}.html'))
+    path = os.path.join(FIXTURES_DIR, 'photo_small.jpg')
+    with Image.open(path) as image:
+        width, height = image.size
+    photo = ProcessedPhoto('fixture', path, os.path.getsize(path), width, height)
+    return [(str(9000 + i), '1505007016/IF/93393042', [list(row) for row in attendance_data], work_name, header_cells, photo)
+            for i in range(WORKBOOK_MUSTERS)]
+
+
+def raw_rows(musters):
+    rows = []
+    while len(rows) < RAW_ROWS:
+        for muster_roll_no, work_code, attendance_data, _, _, _ in musters:
+            for att_row in attendance_data:
+                rows.append([attend_2way.TALUK_NAME, 'BAGEWADI', work_code, muster_roll_no, att_row[1], att_row[2], 'M', att_row[4], att_row[3]])
+    return rows[:RAW_ROWS]
+
+
+def _size(*buffers):
+    return sum(len(buffer.getvalue()) for buffer in buffers)
+
+
+def workbook_cases():
+    musters = sample_musters()
+    rows = raw_rows(musters)
+    work_code, work_name = musters[0][1], musters[0][3]
+    cases = []
+    for backend in workbook_backends():
+        def raw_workbook(backend=backend):
+            default, excel_writer.XLSX_BACKEND = excel_writer.XLSX_BACKEND, backend
+            try:
+                attend_2way.save_raw_excel(rows)
+            finally:
+                excel_writer.XLSX_BACKEND = default
+            return len(rows)
+
+        def renderer(backend=backend):
+            workbooks = MusterWorkbookRenderer('BAGEWADI', attend_2way.DISTRICT_LABEL, attend_2way.TALUK_NAME, backend=backend)
+            for muster in musters:
+                workbooks.add_muster(*muster)
+            return _size(*workbooks.close())
+
+        def attendance_workbook(backend=backend):
+            records = [{'muster_roll_no': muster[0], 'row': list(row)} for muster in musters for row in muster[2]]
+            return _size(attendance_downloader.write_attendance_excel(records, work_code, work_name, 'BAGEWADI', 'bench', backend=backend))
+
+        def images_workbook(backend=backend):
+            records = [{'muster_roll_no': muster[0], 'image': muster[5]} for muster in musters]
+            return _size(attendance_downloader.write_images_excel(records, work_code, work_name, 'BAGEWADI', 'bench', backend=backend))
+
+        def attendance_images_workbook(backend=backend):
+            records = [{'muster_roll_no': muster[0], 'attendance': [list(row) for row in muster[2]], 'image': muster[5]}
+                       for muster in musters]
+            return _size(attendance_downloader.write_attendance_images_excel(records, work_code, work_name, 'BAGEWADI', 'bench', backend=backend))
+
+        cases += [
+            Case(f'save_raw_excel[{backend}]', 'rows/s', raw_workbook),
+            Case(f'muster_workbooks[{backend}]', 's/MB', renderer),
+            Case(f'write_attendance_excel[{backend}]', 's/MB', attendance_workbook),
+            Case(f'write_images_excel[{backend}]', 's/MB', images_workbook),
+            Case(f'write_attendance_images_excel[{backend}]', 's/MB', attendance_images_workbook),
+        ]
+    return cases
+
+
+def all_cases():
+    return attendance_cases() + hierarchy_cases() + muster_roll_row_cases() + workbook_cases()
+
+
+def load_baselines(path=BASELINES_PATH):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f).get('results', {})
+    except FileNotFoundError:
+        return {}
+
+
+def save_baselines(results, path=BASELINES_PATH):
+    baselines = {
+        'machine': f"{platform.machine()} {platform.processor() or platform.system()}",
+        'python': platform.python_version(),
+        'recorded_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'results': load_baselines(path),
+    }
+    baselines['results'].update(results)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def change(case, value, baseline):
+    """Relative change where positive is better, or None without a baseline."""
+    if not baseline or baseline.get('unit') != case.unit:
+        return None
+    ratio = value / baseline['value']
+    return ratio - 1 if case.higher_is_better else 1 / ratio - 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the scraper's parsers and workbook writers.")
+    parser.add_argument('patterns', nargs='*', help="Only run cases whose name contains one of these")
+    parser.add_argument('--save-baseline', action='store_true', help="Store this run's results as the baseline")
+    parser.add_argument('--baseline', default=BASELINES_PATH)
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="Flag cases this much worse than the baseline (default: %(default)s)")
+    parser.add_argument('--json', metavar='PATH', help="Also write the results here")
+    parser.add_argument('--cassette', action='append', default=[], metavar='PATH',
+                        help="Add cases for the muster pages of a recorded run (see cassette.py)")
+    args = parser.parse_args(argv)
+
+    cases = all_cases() + [case for path in args.cassette for case in cassette_cases(path)]
+    cases = [case for case in cases if not args.patterns or any(p in case.name for p in args.patterns)]
+    baselines = load_baselines(args.baseline)
+    results = {}
+    regressions = []
+    print(f"{'case':<48} {'result':>16} {'baseline':>16} {'change':>8}")
+    for case in cases:
+        value = case.measure()
+        results[case.name] = {'value': round(value, 4), 'unit': case.unit}
+        baseline = baselines.get(case.name)
+        delta = change(case, value, baseline)
+        flag = ''
+        if delta is not None and delta < -args.tolerance:
+            flag = '  REGRESSION'
+            regressions.append(case.name)
+        baseline_text = f"{baseline['value']:.2f}" if delta is not None else '-'
+        change_text = f"{delta:+.0%}" if delta is not None else ''
+        print(f"{case.name:<48} {value:>10.2f} {case.unit:<5} {baseline_text:>16} {change_text:>8}{flag}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.save_baseline:
+        save_baselines(results, args.baseline)
+        print(f"Saved {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} case(s) regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
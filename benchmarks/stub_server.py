@@ -0,0 +1,366 @@
+"""
+A local stand-in for the NIC NMMS attendance site, for end-to-end and load tests.
+
+It serves the report form (View_NMMS_atten_date_new.aspx) and its ViewState postback,
+the state -> district -> block -> panchayath -> muster roll pages, the muster detail
+pages (View_NMMS_atten_date_dtl_rpt.aspx) and the large photos, from a generated
+dataset of configurable size. Latency, failures and throttling can be injected.
+
+    python -m benchmarks.stub_server --port 8080 --latency 0.3 --jitter 0.2 --error-rate 0.02
+    NMMS_SITE_URL=http://127.0.0.1:8080/nregaarch/ python attend_2way.py
+
+Every scraper builds its URLs from NMMS_SITE_URL, the Streamlit apps included.
+GET /stub/stats returns what the server saw: requests by page and status, peak
+concurrency, throttled and failed requests.
+"""
+import argparse
+import io
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+from benchmarks import nic_pages
+from benchmarks.make_fixtures import PANCHAYATHS, WORK_NAMES, photo
+
+SITE_PATH = '/nregaarch/'
+FORM_PAGE = 'View_NMMS_atten_date_new.aspx'
+DISTRICT_PAGE = 'View_NMMS_atten_date_dist.aspx'
+BLOCK_PAGE = 'View_NMMS_atten_date_blk.aspx'
+PANCHAYATH_PAGE = 'View_NMMS_atten_date_panch.aspx'
+MUSTER_LIST_PAGE = 'View_NMMS_atten_date_mr.aspx'
+MUSTER_PAGE = 'View_NMMS_atten_date_dtl_rpt.aspx'
+PHOTO_DIR = 'Photos/'
+STATS_PATH = '/stub/stats'
+
+STATE_CODE = '15'
+STATE_NAME = 'KARNATAKA'
+DISTRICTS = ['BAGALKOT', 'BALLARI', 'BELAGAVI', 'BIDAR', 'CHITRADURGA', 'DAVANAGERE']
+BLOCKS = ['BALLARI', 'HADAGALI', 'HAGARIBOMMANAHALLI', 'HOSPET', 'KAMPLI', 'SANDUR', 'SIRUGUPPA']
+# Every district and block lists the same panchayaths, under Ballari / Siruguppa's codes
+DISTRICT_CODE = '1505'
+BLOCK_CODE = '1505007'
+FIN_YEAR = '2024-2025'
+LAST_DATE = date(2025, 7, 18)
+PHOTO_VARIANTS = 4
+
+
+class StubConfig:
+    """
+    Dataset size and misbehaviour of the stand-in site. Rates are per request; rate
+    limits requests per second and max_concurrency requests in flight, 0 meaning no
+    limit. Throttled requests get a 429 (throttle='status') or, as NIC often does,
+    a 200 with an error page (throttle='page').
+    """
+
+    def __init__(self, panchayaths=12, musters=40, workers=(10, 60), dates=3, photo_size=(1600, 1200),
+                 latency=0.0, jitter=0.0, error_rate=0.0, error_page_rate=0.0, drop_rate=0.0,
+                 max_concurrency=0, rate=0.0, throttle='status', seed=0):
+        self.panchayaths = panchayaths
+        self.musters = musters
+        self.workers = workers
+        self.dates = dates
+        self.photo_size = photo_size
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_page_rate = error_page_rate
+        self.drop_rate = drop_rate
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.throttle = throttle
+        self.seed = seed
+
+
+class Dataset:
+    """The panchayaths, muster rolls, workers and photos served, all derived from config.seed."""
+
+    def __init__(self, config):
+        self.config = config
+        names = PANCHAYATHS + [f'PANCHAYATH {i}' for i in range(len(PANCHAYATHS) + 1, config.panchayaths + 1)]
+        self.panchayaths = {f'{BLOCK_CODE}{i:03d}': name for i, name in enumerate(names[:config.panchayaths], 1)}
+        self.dates = [(LAST_DATE - timedelta(days=k)).strftime('%d/%m/%Y') for k in range(config.dates)]
+        width, height = config.photo_size
+        self._photos = []
+        for k in range(PHOTO_VARIANTS):
+            buffer = io.BytesIO()
+            photo(width, height, seed=config.seed + k).save(buffer, 'JPEG', quality=80)
+            self._photos.append(buffer.getvalue())
+
+    @lru_cache(maxsize=None)
+    def musters(self, panchayath_code):
+        """{muster roll no: (work code, work name, worker count)} of a panchayath."""
+        rng = random.Random(f'{self.config.seed}:{panchayath_code}')
+        low, high = self.config.workers
+        return {
+            1000 + i: (f'{panchayath_code}/IF/{93393000 + i // 3}', WORK_NAMES[(i // 3) % len(WORK_NAMES)], rng.randint(low, high))
+            for i in range(1, self.config.musters + 1)
+        }
+
+    def workers(self, panchayath_code, msr_no, count):
+        return nic_pages.workers(count, seed=f'{self.config.seed}:{panchayath_code}:{msr_no}', panchayath_code=panchayath_code)
+
+    def photo(self, panchayath_code, msr_no):
+        # Bytes after the JPEG end marker are ignored by decoders but give every muster its own photo
+        return self._photos[msr_no % PHOTO_VARIANTS] + f'{panchayath_code}/{msr_no}'.encode('ascii')
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config=None, verbose=False):
+        super().__init__(address, StubHandler)
+        self.config = config or StubConfig()
+        self.dataset = Dataset(self.config)
+        self.verbose = verbose
+        self.rng = random.Random(self.config.seed)
+        self.in_flight = 0
+        self.stats = {'requests': {}, 'peak_concurrency': 0, 'throttled': 0, 'errors': 0, 'error_pages': 0, 'dropped': 0}
+        self._tokens = float(self.config.rate)
+        self._refilled_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def site_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}{SITE_PATH}'
+
+    @contextmanager
+    def admit(self):
+        """Yields False when the request is over the concurrency or rate limit."""
+        config = self.config
+        with self._lock:
+            self.in_flight += 1
+            self.stats['peak_concurrency'] = max(self.stats['peak_concurrency'], self.in_flight)
+            admitted = not config.max_concurrency or self.in_flight <= config.max_concurrency
+            if admitted and config.rate:
+                now = time.monotonic()
+                self._tokens = min(config.rate, self._tokens + (now - self._refilled_at) * config.rate)
+                self._refilled_at = now
+                admitted = self._tokens >= 1
+                if admitted:
+                    self._tokens -= 1
+            if not admitted:
+                self.stats['throttled'] += 1
+        try:
+            yield admitted
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def fault(self):
+        """The failure to inject for this request, if any."""
+        config = self.config
+        with self._lock:
+            roll = self.rng.random()
+        for name, rate in (('dropped', config.drop_rate), ('errors', config.error_rate), ('error_pages', config.error_page_rate)):
+            if roll < rate:
+                with self._lock:
+                    self.stats[name] += 1
+                return name
+            roll -= rate
+        return None
+
+    def delay(self):
+        with self._lock:
+            jitter = self.rng.uniform(0, self.config.jitter) if self.config.jitter else 0
+        return self.config.latency + jitter
+
+    def record(self, page, status):
+        key = f'{page} {status}'
+        with self._lock:
+            self.stats['requests'][key] = self.stats['requests'].get(key, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return json.loads(json.dumps(dict(self.stats, in_flight=self.in_flight)))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'Microsoft-IIS/10.0'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self.serve({})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8', errors='replace')
+        self.serve({name: values[0] for name, values in parse_qs(body, keep_blank_values=True).items()})
+
+    def serve(self, form):
+        url = urlsplit(self.path)
+        if url.path == STATS_PATH:
+            return self.send(200, json.dumps(self.server.snapshot(), indent=2).encode('utf-8'), 'application/json')
+        if not url.path.startswith(SITE_PATH):
+            return self.send(404, nic_pages.error_page('The resource cannot be found.').encode('utf-8'))
+        page = url.path[len(SITE_PATH):]
+        query = {name: values[0] for name, values in parse_qs(url.query, keep_blank_values=True).items()}
+        server = self.server
+        with server.admit() as admitted:
+            time.sleep(server.delay())
+            if not admitted:
+                server.record(page, 'throttled')
+                if server.config.throttle == 'page':
+                    return self.send(200, nic_pages.error_page('Too many requests. Please try again later.').encode('utf-8'))
+                return self.send(429, nic_pages.error_page('Too many requests.').encode('utf-8'), headers={'Retry-After': '1'})
+            fault = server.fault()
+            if fault == 'dropped':
+                server.record(page, 'dropped')
+                self.close_connection = True
+                return
+            if fault == 'errors':
+                return self.send(500, nic_pages.error_page().encode('utf-8'), page=page)
+            if fault == 'error_pages':
+                server.record(page, 'error page')
+                return self.send(200, nic_pages.error_page('The service is temporarily unavailable.').encode('utf-8'))
+            self.route(page, query, form)
+
+    def route(self, page, query, form):
+        dataset = self.server.dataset
+        attendance_date = query.get('AttendanceDate', '')
+        if page == FORM_PAGE:
+            if self.command == 'POST':
+                return self.show_report(form)
+            return self.send_page(page, nic_pages.report_form(dataset.dates, STATE_CODE, STATE_NAME),
+                                  headers={'Set-Cookie': 'ASP.NET_SessionId=stub; path=/; HttpOnly'})
+        if page == DISTRICT_PAGE:
+            return self.send_page(page, nic_pages.hierarchy_grid('District', [
+                (name, f'{BLOCK_PAGE}?' + urlencode({'district_code': f'15{i:02d}', 'AttendanceDate': attendance_date}), 100 + i)
+                for i, name in enumerate(DISTRICTS, 1)]))
+        if page == BLOCK_PAGE:
+            return self.send_page(page, nic_pages.hierarchy_grid('Block', [
+                (name, f'{PANCHAYATH_PAGE}?' + urlencode({'block_code': f'{DISTRICT_CODE}{i:03d}', 'AttendanceDate': attendance_date}), 50 + i)
+                for i, name in enumerate(BLOCKS, 1)]))
+        if page == PANCHAYATH_PAGE:
+            return self.send_page(page, nic_pages.panchayath_list([
+                (name, f'{MUSTER_LIST_PAGE}?' + urlencode({'panchayat_code': code, 'AttendanceDate': attendance_date}),
+                 len(dataset.musters(code)))
+                for code, name in dataset.panchayaths.items()]))
+        if page == MUSTER_LIST_PAGE:
+            code = query.get('panchayat_code', '')
+            if code not in dataset.panchayaths:
+                return self.send(500, nic_pages.error_page().encode('utf-8'), page=page)
+            return self.send_page(page, nic_pages.muster_list([
+                (work_code, work_name, msr_no, muster_href(dataset.panchayaths[code], code, work_code, msr_no, attendance_date), workers)
+                for msr_no, (work_code, work_name, workers) in dataset.musters(code).items()]))
+        if page == MUSTER_PAGE:
+            return self.show_muster(query, attendance_date)
+        if page.startswith(PHOTO_DIR) and page.endswith('_large.jpg'):
+            code, _, name = page[len(PHOTO_DIR):].partition('/')
+            msr_no = name[:-len('_large.jpg')]
+            if code in dataset.panchayaths and msr_no.isdigit() and int(msr_no) in dataset.musters(code):
+                return self.send(200, dataset.photo(code, int(msr_no)), 'image/jpeg', page='photo')
+        self.send(404, nic_pages.error_page('The resource cannot be found.').encode('utf-8'), page=page)
+
+    def show_report(self, form):
+        # ASP.NET rejects a postback that does not carry the page's hidden fields back
+        if not form.get('__VIEWSTATE') or '__EVENTVALIDATION' not in form:
+            return self.send(500, nic_pages.error_page('Validation of viewstate MAC failed.').encode('utf-8'), page=FORM_PAGE)
+        attendance_date = form.get('ctl00$ContentPlaceHolder1$ddl_attendance', '')
+        if form.get('ctl00$ContentPlaceHolder1$ddlstate') != STATE_CODE or attendance_date not in self.server.dataset.dates:
+            return self.send_page(FORM_PAGE, nic_pages.report_form(self.server.dataset.dates, STATE_CODE, STATE_NAME))
+        total = sum(len(self.server.dataset.musters(code)) for code in self.server.dataset.panchayaths)
+        return self.send_page(FORM_PAGE, nic_pages.hierarchy_grid('State', [
+            (STATE_NAME, f'{DISTRICT_PAGE}?' + urlencode({'state_code': STATE_CODE, 'AttendanceDate': attendance_date}), total)]))
+
+    def show_muster(self, query, attendance_date):
+        dataset = self.server.dataset
+        code = query.get('panchayat_code', '')
+        msr_no = query.get('msr_no', '')
+        muster = dataset.musters(code).get(int(msr_no)) if code in dataset.panchayaths and msr_no.isdigit() else None
+        if muster is None or attendance_date not in dataset.dates or query.get('work_code', muster[0]) not in ('', muster[0]):
+            # Unknown muster rolls, and a work code that does not match, give an empty report
+            return self.send_page(MUSTER_PAGE, nic_pages.muster_page('', [], attendance_date))
+        work_code, work_name, workers = muster
+        photo_href = f"http://{self.headers.get('Host')}{SITE_PATH}{PHOTO_DIR}{code}/{msr_no}_large.jpg"
+        return self.send_page(MUSTER_PAGE, nic_pages.muster_page(
+            work_name, dataset.workers(code, int(msr_no), workers), attendance_date, photo_href))
+
+    def send_page(self, page, html, headers=None):
+        self.send(200, html.encode('utf-8'), page=page, headers=headers)
+
+    def send(self, status, content, content_type='text/html; charset=utf-8', page=None, headers=None):
+        if page is not None:
+            self.server.record(page, status)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def muster_href(panchayath_name, panchayath_code, work_code, msr_no, attendance_date):
+    """A muster detail link with the query attendance_downloader.build_muster_urls produces."""
+    return f'{MUSTER_PAGE}?' + urlencode({
+        'page': '', 'short_name': 'KN', 'state_name': STATE_NAME, 'state_code': STATE_CODE,
+        'district_name': 'BALLARI', 'district_code': DISTRICT_CODE, 'block_name': 'SIRUGUPPA', 'block_code': BLOCK_CODE,
+        'panchayat_name': panchayath_name, 'panchayat_code': panchayath_code, 'fin_year': FIN_YEAR, 'source': '',
+        'work_code': work_code, 'msr_no': msr_no, 'AttendanceDate': attendance_date, 'Digest': 'stub',
+    })
+
+
+def start_server(config=None, host='127.0.0.1', port=0, verbose=False):
+    """Serve in a daemon thread; returns the server (server.site_url, server.shutdown())."""
+    server = StubServer((host, port), config, verbose)
+    threading.Thread(target=server.serve_forever, name='nrega-stub', daemon=True).start()
+    return server
+
+
+def add_config_arguments(parser):
+    parser.add_argument('--panchayaths', type=int, default=12)
+    parser.add_argument('--musters', type=int, default=40, help="Muster rolls per panchayath")
+    parser.add_argument('--workers', default='10-60', help="Workers per muster roll, as min-max")
+    parser.add_argument('--dates', type=int, default=3, help="Attendance dates on offer, counting back from 18/07/2025")
+    parser.add_argument('--photo-size', default='1600x1200')
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Up to this many more seconds, at random")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests answered with a 500")
+    parser.add_argument('--error-page-rate', type=float, default=0.0, help="Share answered with a 200 error page")
+    parser.add_argument('--drop-rate', type=float, default=0.0, help="Share of connections closed without an answer")
+    parser.add_argument('--max-concurrency', type=int, default=0, help="Throttle requests beyond this many in flight")
+    parser.add_argument('--rate', type=float, default=0.0, help="Throttle requests beyond this many per second")
+    parser.add_argument('--throttle', choices=['status', 'page'], default='status')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def config_from_args(args):
+    low, _, high = args.workers.partition('-')
+    width, _, height = args.photo_size.partition('x')
+    return StubConfig(
+        panchayaths=args.panchayaths, musters=args.musters, workers=(int(low), int(high or low)), dates=args.dates,
+        photo_size=(int(width), int(height)), latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        error_page_rate=args.error_page_rate, drop_rate=args.drop_rate, max_concurrency=args.max_concurrency,
+        rate=args.rate, throttle=args.throttle, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a stand-in for the NIC NMMS attendance site.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--verbose', action='store_true', help="Log every request")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    server = StubServer((args.host, args.port), config_from_args(args), args.verbose)
+    print(f"Serving {server.site_url} (dates: {', '.join(server.dataset.dates)})")
+    print(f"Point the scrapers at it with NMMS_SITE_URL={server.site_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.snapshot(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,405 @@
+"""
+Record every HTTP exchange (and the browser steps of the Selenium scraper) of a run
+into a compressed archive, and replay it offline at full speed.
+
+    python cassette.py record run.nmms batch_scrape.py 18/07/2025 BAGEWADI
+    python cassette.py record run.nmms attend_2way.py
+    python cassette.py replay run.nmms              # the recorded command, offline
+    python cassette.py replay run.nmms batch_scrape.py 18/07/2025 BAGEWADI --output-dir /tmp/new
+    python cassette.py info run.nmms
+
+The archive is a zip of bodies stored once per distinct content, plus an index
+written when the recording is closed. Requests are matched on method, normalized URL
+and request body; repeats of the same request are answered in recorded order.
+Failed requests are recorded too, so a broken run fails the same way on replay.
+Answers typed at input() prompts are part of the recording.
+
+The response cache is bypassed while a cassette is active, and recording or replaying
+from the command line also gives the run its own empty photo store, hierarchy cache
+and no checkpoints, so every request goes over the wire (or to the archive). A
+recording can also be switched on for any process, the Streamlit apps included, with
+NMMS_CASSETTE=<path> and NMMS_CASSETTE_MODE=record|replay; photos, links and muster
+rolls answered from those local stores are then not part of it.
+"""
+import argparse
+import atexit
+import builtins
+import contextlib
+import hashlib
+import io
+import json
+import os
+import runpy
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3.response import HTTPResponse
+from http_cache import normalize_url
+
+CASSETTE_PATH = os.environ.get('NMMS_CASSETTE')
+CASSETTE_MODE = os.environ.get('NMMS_CASSETTE_MODE', 'replay')
+RECORD = 'record'
+REPLAY = 'replay'
+INDEX_NAME = 'index.json'
+FORMAT_VERSION = 1
+# Already compressed; deflating them again only costs time
+STORED_TYPES = ('image/', 'application/zip', 'application/octet-stream')
+# Describe the body as received, not as the archive returns it
+DROPPED_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')
+
+
+class CassetteMiss(requests.exceptions.ConnectionError):
+    """Raised on replay for a request the recording has no answer for."""
+
+
+def _digest(data):
+    if data is None:
+        return None
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+
+def request_key(method, url, body=None):
+    return f"{method.upper()} {normalize_url(url)} {_digest(body) or '-'}"
+
+
+class Cassette:
+    """
+    One archive, open for recording or replaying. Safe to share between the
+    scraper's threads.
+    """
+
+    def __init__(self, path, mode=REPLAY, command=None):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._closed = False
+        if mode == RECORD:
+            self._zip = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+            self._bodies = set()
+            self.index = {
+                'version': FORMAT_VERSION,
+                'recorded_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'command': command,
+                'exchanges': [],
+                'steps': [],
+            }
+            self._started = time.monotonic()
+        else:
+            self._zip = zipfile.ZipFile(path, 'r')
+            self.index = json.loads(self._zip.read(INDEX_NAME))
+            if self.index.get('version') != FORMAT_VERSION:
+                raise ValueError(f"{path} was recorded in an unsupported format")
+            self._exchanges = _by_key(self.index['exchanges'])
+            self._steps = _by_key(self.index['steps'])
+            self._served = {}
+
+    @property
+    def replaying(self):
+        return self.mode == REPLAY
+
+    def _put_body(self, data, stored=False):
+        digest = _digest(data)
+        with self._lock:
+            if digest not in self._bodies:
+                self._zip.writestr(f'bodies/{digest}', data,
+                                   zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED)
+                self._bodies.add(digest)
+        return digest
+
+    def _body(self, digest):
+        with self._lock:
+            return self._zip.read(f'bodies/{digest}')
+
+    def pages(self):
+        """(url, body) of every recorded HTML page, fetched over HTTP or by the browser."""
+        for entry in self.index['exchanges']:
+            content_type = CaseInsensitiveDict(entry.get('headers', {})).get('Content-Type', '')
+            if entry.get('status') == 200 and content_type.startswith('text/html'):
+                yield entry['url'], self._body(entry['content'])
+        for entry in self.index['steps']:
+            if entry['key'].startswith('page '):
+                page_source, url = json.loads(self._body(entry['value']))
+                yield url, page_source.encode('utf-8')
+
+    def _next(self, entries, key):
+        # Each repeat of a request gets the next recorded answer; the last one sticks
+        with self._lock:
+            served = self._served.get(key, 0)
+            self._served[key] = served + 1
+        return entries[min(served, len(entries) - 1)]
+
+    def record_exchange(self, request, response=None, error=None, elapsed=0.0):
+        entry = {
+            'key': request_key(request.method, request.url, request.body),
+            'method': request.method,
+            'url': request.url,
+            'elapsed': round(elapsed, 4),
+        }
+        if error is not None:
+            entry.update(error=type(error).__name__, message=str(error))
+        else:
+            content_type = response.headers.get('Content-Type', '')
+            entry.update(
+                status=response.status_code,
+                reason=response.reason,
+                headers={k: v for k, v in response.headers.items() if k.lower() not in DROPPED_HEADERS},
+                content=self._put_body(response.content, content_type.startswith(STORED_TYPES)),
+            )
+        with self._lock:
+            self.index['exchanges'].append(entry)
+
+    def replay_exchange(self, request):
+        """(entry, body) recorded for request; raises CassetteMiss when there is none."""
+        key = request_key(request.method, request.url, request.body)
+        entries = self._exchanges.get(key)
+        if not entries:
+            raise CassetteMiss(f"{self.path} has no recorded response for {request.method} {request.url}",
+                               request=request)
+        entry = self._next(entries, key)
+        return entry, (self._body(entry['content']) if 'content' in entry else None)
+
+    def step(self, kind, key, run):
+        """
+        The result of run() for a browser (or other non-HTTP) step: recorded while
+        recording, taken from the archive on replay. run returns bytes or anything
+        JSON can hold.
+        """
+        key = f"{kind} {json.dumps(key, sort_keys=True)}"
+        if self.replaying:
+            entries = self._steps.get(key)
+            if not entries:
+                raise CassetteMiss(f"{self.path} has no recorded {kind} step for {key}")
+            entry = self._next(entries, key)
+            data = self._body(entry['value'])
+            return data if entry['format'] == 'bytes' else json.loads(data)
+        value = run()
+        if isinstance(value, bytes):
+            entry = {'key': key, 'format': 'bytes', 'value': self._put_body(value, stored=True)}
+        else:
+            entry = {'key': key, 'format': 'json', 'value': self._put_body(json.dumps(value).encode('utf-8'))}
+        with self._lock:
+            self.index['steps'].append(entry)
+        return value
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self.mode == RECORD:
+                self.index['duration'] = round(time.monotonic() - self._started, 3)
+                self._zip.writestr(INDEX_NAME, json.dumps(self.index))
+            self._zip.close()
+
+
+def _by_key(entries):
+    grouped = {}
+    for entry in entries:
+        grouped.setdefault(entry['key'], []).append(entry)
+    return grouped
+
+
+class CassetteAdapter(HTTPAdapter):
+    """HTTPAdapter that records to, or replays from, the active cassette if there is one."""
+
+    def send(self, request, **kwargs):
+        cassette = get_cassette()
+        if cassette is None:
+            return super().send(request, **kwargs)
+        if cassette.replaying:
+            return self._replayed(request, *cassette.replay_exchange(request))
+        started = time.monotonic()
+        try:
+            response = super().send(request, **kwargs)
+            # Read the body here, where a broken connection can still be recorded
+            response.content
+        except requests.exceptions.RequestException as e:
+            cassette.record_exchange(request, error=e, elapsed=time.monotonic() - started)
+            raise
+        cassette.record_exchange(request, response, elapsed=time.monotonic() - started)
+        return response
+
+    def _replayed(self, request, entry, body):
+        if 'error' in entry:
+            error = getattr(requests.exceptions, entry['error'], None)
+            if not (isinstance(error, type) and issubclass(error, requests.exceptions.RequestException)):
+                error = requests.exceptions.ConnectionError
+            raise error(entry['message'], request=request)
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.reason = entry['reason']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response._content = body
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        # Redirect handling reads and releases the raw response
+        response.raw = HTTPResponse(body=io.BytesIO(b''), headers=entry['headers'], status=entry['status'],
+                                    preload_content=False)
+        return response
+
+
+_active = None
+_active_lock = threading.Lock()
+_from_env = False
+
+
+def get_cassette():
+    """The active cassette: one opened by use_cassette, or the one NMMS_CASSETTE names."""
+    global _active, _from_env
+    if _active is not None or _from_env:
+        return _active
+    with _active_lock:
+        if not _from_env:
+            _from_env = True
+            if CASSETTE_PATH and _active is None:
+                _active = Cassette(CASSETTE_PATH, CASSETTE_MODE)
+                atexit.register(_active.close)
+        return _active
+
+
+def replaying():
+    cassette = get_cassette()
+    return cassette is not None and cassette.replaying
+
+
+def step(kind, key, run):
+    """Cassette.step on the active cassette, or just run() without one."""
+    cassette = get_cassette()
+    if cassette is None:
+        return run()
+    return cassette.step(kind, key, run)
+
+
+@contextlib.contextmanager
+def use_cassette(path, mode=REPLAY, command=None):
+    """Record or replay every request made inside the block (from any thread)."""
+    global _active, _from_env
+    cassette = Cassette(path, mode, command)
+    with _active_lock:
+        previous, _active, _from_env = _active, cassette, True
+    try:
+        yield cassette
+    finally:
+        with _active_lock:
+            _active = previous
+        cassette.close()
+
+
+def isolate_environment(work_dir):
+    # Read by the scraper modules at import time; with an empty photo store and
+    # hierarchy cache and no checkpoints, every page and photo is fetched (or replayed)
+    os.environ['NMMS_CHECKPOINTS'] = '0'
+    os.environ['NMMS_PHOTO_DIR'] = os.path.join(work_dir, 'photos')
+    os.environ['NMMS_HIERARCHY_CACHE'] = os.path.join(work_dir, 'hierarchy.json')
+
+
+def run_command(command):
+    """Run a script (or -m module) as __main__ with command[1:] as its arguments."""
+    target, args = (command[1], command[2:]) if command[0] == '-m' else (command[0], command[1:])
+    sys.argv = [target] + list(args)
+    try:
+        if command[0] == '-m':
+            runpy.run_module(target, run_name='__main__', alter_sys=True)
+        else:
+            runpy.run_path(target, run_name='__main__')
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    return 0
+
+
+def _recorded_input(cassette):
+    original = builtins.input
+
+    def prompt(text=''):
+        if cassette.replaying:
+            answer = cassette.step('input', text, None)
+            print(f"{text}{answer}")
+            return answer
+        return cassette.step('input', text, lambda: original(text))
+    return prompt
+
+
+def summary(index):
+    exchanges = index['exchanges']
+    statuses = {}
+    for entry in exchanges:
+        status = str(entry.get('status', entry.get('error')))
+        statuses[status] = statuses.get(status, 0) + 1
+    return {
+        'recorded_at': index.get('recorded_at'),
+        'command': index.get('command'),
+        'duration': index.get('duration'),
+        'exchanges': len(exchanges),
+        'statuses': statuses,
+        'distinct_requests': len({entry['key'] for entry in exchanges}),
+        'steps': len(index['steps']),
+        'network_seconds': round(sum(entry['elapsed'] for entry in exchanges), 1),
+    }
+
+
+def print_info(path):
+    with zipfile.ZipFile(path) as archive:
+        index = json.loads(archive.read(INDEX_NAME))
+        raw = sum(info.file_size for info in archive.infolist())
+    info = summary(index)
+    print(f"{path}: recorded {info['recorded_at']}, {info['duration']}s")
+    if info['command']:
+        print(f"Command: {' '.join(info['command'])}")
+    print(f"{info['exchanges']} HTTP exchanges ({info['distinct_requests']} distinct requests), "
+          f"{info['steps']} browser/input steps")
+    if info['statuses']:
+        print("Responses: " + ', '.join(f"{status} x {count}" for status, count in sorted(info['statuses'].items())))
+    print(f"Archive: {os.path.getsize(path) / 1e6:.1f} MB, {raw / 1e6:.1f} MB uncompressed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record a scraper run to an archive, or replay one offline.")
+    sub = parser.add_subparsers(dest='action', required=True)
+    for action, text in ((RECORD, "Run a command and record its requests"),
+                         (REPLAY, "Run a command against a recording, offline")):
+        cmd = sub.add_parser(action, help=text)
+        cmd.add_argument('cassette')
+        cmd.add_argument('command', nargs=argparse.REMAINDER,
+                         help="Script (or -m module) and its arguments; on replay defaults to the recorded one")
+    sub.add_parser('info', help="Summarize a recording").add_argument('cassette')
+    args = parser.parse_args()
+
+    if args.action == 'info':
+        print_info(args.cassette)
+        return 0
+    command = args.command
+    if args.action == REPLAY and not command:
+        with zipfile.ZipFile(args.cassette) as archive:
+            command = json.loads(archive.read(INDEX_NAME)).get('command')
+    if not command:
+        parser.error("no command to run")
+    isolate_environment(tempfile.mkdtemp(prefix='nmms_cassette_'))
+    # The scraper modules import this file as cassette, not __main__
+    import cassette as shared
+    started = time.perf_counter()
+    with shared.use_cassette(args.cassette, args.action, command) as recording:
+        builtins.input = _recorded_input(recording)
+        status = run_command(command)
+    elapsed = time.perf_counter() - started
+    info = summary(recording.index)
+    if args.action == RECORD:
+        print(f"Recorded {info['exchanges']} exchanges and {info['steps']} steps to {args.cassette} in {elapsed:.1f}s")
+    else:
+        print(f"Replayed {args.cassette} in {elapsed:.1f}s (recorded run: {info['duration']}s)")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
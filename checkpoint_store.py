@@ -0,0 +1,266 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from http_cache import CACHE_DIR, get_cache, normalize_url
+from image_processing import ProcessedPhoto
+from photo_store import get_photo_store
+import metrics
+
+CHECKPOINT_ENABLED = os.environ.get('NMMS_CHECKPOINTS', '1') != '0'
+CHECKPOINT_DB = os.environ.get('NMMS_CHECKPOINT_DB', os.path.join(os.path.dirname(CACHE_DIR), 'checkpoints.sqlite3'))
+# An unfinished run started within this many seconds is resumed instead of starting over
+CHECKPOINT_MAX_AGE = float(os.environ.get('NMMS_CHECKPOINT_MAX_AGE', 6 * 60 * 60))
+
+INCOMPLETE = 'incomplete'
+DONE = 'done'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params_key TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_by_params ON runs (kind, params_key, created_at);
+CREATE TABLE IF NOT EXISTS musters (
+    run_id TEXT NOT NULL,
+    muster_key TEXT NOT NULL,
+    attendance TEXT NOT NULL,
+    photo_url TEXT,
+    work_name TEXT,
+    header_cells TEXT,
+    photo_digest TEXT,
+    photo_width INTEGER,
+    photo_height INTEGER,
+    saved_at REAL NOT NULL,
+    signature TEXT,
+    PRIMARY KEY (run_id, muster_key)
+);
+"""
+MUSTER_COLUMNS = ('run_id', 'muster_key', 'attendance', 'photo_url', 'work_name', 'header_cells',
+                  'photo_digest', 'photo_width', 'photo_height', 'saved_at', 'signature')
+
+
+def _params_key(params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _changed(saved, current):
+    # A muster saved or listed without a signature cannot be compared and is kept
+    return saved is not None and current is not None and saved != current
+
+
+class CheckpointRun:
+    """
+    The checkpoints of one scrape. Every muster whose page parsed (and whose photo,
+    if it has one, was stored) is saved as soon as it is fetched; a resumed run only
+    fetches the musters that are missing.
+
+    A muster result is the usual (attendance_data, photo_url, work_name, header_cells,
+    photo) tuple; the photo itself stays in the photo store and only its digest is saved.
+    Musters can be saved with the signature of their muster table row, so a later run
+    can tell which of them changed since.
+    """
+
+    def __init__(self, store, run_id, kind, params, status):
+        self.store = store
+        self.run_id = run_id
+        self.kind = kind
+        self.params = params
+        self.status = status
+
+    def save(self, key, result, signature=None):
+        attendance_data, photo_url, work_name, header_cells, photo = result
+        if attendance_data is None or (photo_url and photo is None):
+            # Incomplete; left for the next resume to fetch again
+            return False
+        self.store._execute(
+            f"INSERT OR REPLACE INTO musters ({', '.join(MUSTER_COLUMNS)}) VALUES ({', '.join('?' * len(MUSTER_COLUMNS))})",
+            (self.run_id, key, json.dumps(attendance_data), photo_url, work_name,
+             json.dumps(list(header_cells)) if header_cells is not None else None,
+             photo.digest if photo else None,
+             getattr(photo, 'width', None), getattr(photo, 'height', None), time.time(), signature),
+        )
+        return True
+
+    def load_all(self, signatures=None):
+        """
+        Return {muster key: result} for every checkpointed muster, leaving out those
+        whose saved signature differs from the one in signatures ({muster key: signature}).
+        """
+        rows = self.store._query(
+            "SELECT muster_key, attendance, photo_url, work_name, header_cells, photo_digest, photo_width, photo_height, "
+            "signature FROM musters WHERE run_id = ?", (self.run_id,))
+        photos = get_photo_store()
+        results = {}
+        for key, attendance, photo_url, work_name, header_cells, digest, width, height, signature in rows:
+            if _changed(signature, (signatures or {}).get(key)):
+                continue
+            photo = None
+            if digest:
+                stored = photos.get(digest)
+                if stored is None:
+                    # Photo was removed from the store; fetch this muster again
+                    continue
+                photo = ProcessedPhoto(stored.digest, stored.path, stored.size, width, height)
+            header_cells = json.loads(header_cells) if header_cells is not None else None
+            results[key] = (json.loads(attendance), photo_url, work_name, header_cells, photo)
+        metrics.count('checkpoint_hits', len(results))
+        return results
+
+    def changed(self, signatures):
+        """Keys of the saved musters whose row signature differs from the one in signatures."""
+        rows = self.store._query("SELECT muster_key, signature FROM musters WHERE run_id = ?", (self.run_id,))
+        return {key for key, signature in rows if _changed(signature, signatures.get(key))}
+
+    def saving(self, fetch, key=None, signature=None):
+        """Wrap fetch(item) so each complete result is checkpointed by the worker that fetched it."""
+        key = key or (lambda item: item)
+
+        def fetch_and_save(item):
+            result = fetch(item)
+            self.save(key(item), result, signature(item) if signature else None)
+            return result
+        return fetch_and_save
+
+    def finish(self, complete):
+        """Record the outcome; a run with gaps stays resumable."""
+        self.status = DONE if complete else INCOMPLETE
+        self.store._execute("UPDATE runs SET status = ?, updated_at = ? WHERE run_id = ?",
+                            (self.status, time.time(), self.run_id))
+
+
+class CheckpointStore:
+    def __init__(self, path=CHECKPOINT_DB, max_age=CHECKPOINT_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(musters)")}
+            if 'signature' not in columns:
+                self._conn.execute("ALTER TABLE musters ADD COLUMN signature TEXT")
+        return self._conn
+
+    def _execute(self, sql, args=()):
+        with self._lock:
+            self._connection().execute(sql, args)
+
+    def _query(self, sql, args=()):
+        with self._lock:
+            return self._connection().execute(sql, args).fetchall()
+
+    def open_run(self, kind, params, fresh=False, any_age=False):
+        """
+        Resume the latest run of kind with the same params if it is unfinished and
+        started less than max_age ago, otherwise start a new one. With any_age the
+        latest run is resumed however old it is, finished or not (a delta scrape builds
+        on it); fresh always starts a new run.
+        """
+        params_key = _params_key(params)
+        if not fresh:
+            rows = self._query(
+                "SELECT run_id, status FROM runs WHERE kind = ? AND params_key = ? AND created_at > ? "
+                "ORDER BY created_at DESC LIMIT 1",
+                (kind, params_key, 0 if any_age else time.time() - self.max_age))
+            if rows and (any_age or rows[0][1] != DONE):
+                run_id, status = rows[0]
+                return CheckpointRun(self, run_id, kind, params, status)
+        run_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        self._execute("INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                      (run_id, kind, params_key, json.dumps(params, sort_keys=True), INCOMPLETE, now, now))
+        return CheckpointRun(self, run_id, kind, params, INCOMPLETE)
+
+    def list_runs(self, kind=None):
+        sql = ("SELECT r.run_id, r.kind, r.params, r.status, r.created_at, r.updated_at, COUNT(m.muster_key) "
+               "FROM runs r LEFT JOIN musters m ON m.run_id = r.run_id")
+        args = ()
+        if kind:
+            sql += " WHERE r.kind = ?"
+            args = (kind,)
+        sql += " GROUP BY r.run_id ORDER BY r.created_at DESC"
+        return [
+            {'run_id': run_id, 'kind': run_kind, 'params': json.loads(params), 'status': status,
+             'created_at': created_at, 'updated_at': updated_at, 'musters': musters}
+            for run_id, run_kind, params, status, created_at, updated_at, musters in self._query(sql, args)
+        ]
+
+    def delete_run(self, run_id):
+        self._execute("DELETE FROM musters WHERE run_id = ?", (run_id,))
+        self._execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+
+    def purge(self, older_than=None):
+        """Drop runs started before older_than seconds ago (default: twice max_age)."""
+        cutoff = time.time() - (older_than if older_than is not None else 2 * self.max_age)
+        self._execute("DELETE FROM musters WHERE run_id IN (SELECT run_id FROM runs WHERE created_at < ?)", (cutoff,))
+        self._execute("DELETE FROM runs WHERE created_at < ?", (cutoff,))
+
+
+def muster_roll_params(panchayath_url, attendance_date, selected_work_codes=None):
+    # Shared by the browser and browserless engines, so either can resume the other's run
+    return {
+        'panchayath_url': normalize_url(panchayath_url),
+        'attendance_date': attendance_date,
+        'work_codes': ['all'] if not selected_work_codes or 'all' in selected_work_codes else sorted(selected_work_codes),
+    }
+
+
+def muster_key(muster_url):
+    return normalize_url(muster_url)
+
+
+def plan_musters(checkpoint, muster_urls, signatures=None):
+    """
+    Split the muster URLs of a run into (done, pending, changed): done maps the key of
+    every muster that can be reused to its result, pending lists the URLs still to
+    fetch, in order, and changed those of them whose row changed since they were saved.
+    Changed pages are dropped from the HTTP cache so their new version is fetched.
+    """
+    if checkpoint is None:
+        return {}, list(muster_urls), []
+    done = checkpoint.load_all(signatures)
+    changed_keys = checkpoint.changed(signatures) if signatures else set()
+    pending = [url for url in muster_urls if muster_key(url) not in done]
+    changed = [url for url in pending if muster_key(url) in changed_keys]
+    for url in changed:
+        get_cache().invalidate(url)
+    return done, pending, changed
+
+
+def describe_plan(total, pending, changed):
+    return (f"{total - len(pending)} unchanged, {len(changed)} changed and "
+            f"{len(pending) - len(changed)} new muster rolls")
+
+
+_shared_store = None
+_shared_lock = threading.Lock()
+
+
+def get_checkpoint_store():
+    global _shared_store
+    with _shared_lock:
+        if _shared_store is None:
+            _shared_store = CheckpointStore()
+            _shared_store.purge()
+        return _shared_store
+
+
+def open_run(kind, params, fresh=False, any_age=False):
+    """open_run on the shared store, or None when checkpointing is switched off."""
+    if not CHECKPOINT_ENABLED:
+        return None
+    return get_checkpoint_store().open_run(kind, params, fresh, any_age)
@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+# In-flight requests allowed per host: the controller starts at HOST_INITIAL_CONCURRENCY
+# and moves between the floor and the ceiling. NMMS_HOST_LIMITS sets per-host ceilings,
+# e.g. "mnregaweb4.nic.in=12,nregastrep.nic.in=6".
+HOST_MAX_CONCURRENCY = int(os.environ.get('NMMS_HOST_MAX_CONCURRENCY', 16))
+HOST_MIN_CONCURRENCY = int(os.environ.get('NMMS_HOST_MIN_CONCURRENCY', 1))
+HOST_INITIAL_CONCURRENCY = int(os.environ.get('NMMS_HOST_INITIAL_CONCURRENCY', 4))
+HOST_LIMITS = os.environ.get('NMMS_HOST_LIMITS', '')
+# Responses this many times slower than the best recent latency are slow; this many
+# slow responses in a row count as congestion
+LATENCY_TOLERANCE = float(os.environ.get('NMMS_LATENCY_TOLERANCE', 3))
+LATENCY_SLOW_SAMPLES = int(os.environ.get('NMMS_LATENCY_SLOW_SAMPLES', 8))
+BACKOFF_FACTOR = 0.5
+LATENCY_SMOOTHING = 0.2
+
+
+def _host_ceilings():
+    ceilings = {}
+    for entry in HOST_LIMITS.split(','):
+        host, _, limit = entry.partition('=')
+        if host.strip() and limit.strip():
+            ceilings[host.strip().lower()] = int(limit)
+    return ceilings
+
+
+def is_congestion(response):
+    return response.status_code == 429 or response.status_code >= 500
+
+
+class AdaptiveLimit:
+    """
+    AIMD limit on the requests in flight to one host.
+
+    Every request that comes back in good time raises the limit by 1/limit (about one
+    more slot per round of requests); a 429/5xx, a failed request, a throttle page or
+    a sustained latency well above the best recent one halves it, at most once per
+    round trip so that the requests already in flight do not cut it again for the same
+    episode. While responses are slow the limit is held; after a cut for latency the
+    slower latency becomes the new baseline, so a site that is just slower today is not
+    cut down to the floor.
+    """
+
+    def __init__(self, name, initial=HOST_INITIAL_CONCURRENCY, minimum=HOST_MIN_CONCURRENCY, maximum=HOST_MAX_CONCURRENCY):
+        self.name = name
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(self.maximum, max(self.minimum, initial)))
+        self.in_flight = 0
+        self.latency = None
+        self.baseline = None
+        self.congestion_events = 0
+        self._slow_samples = 0
+        self._last_decrease = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency=None, congested=False):
+        with self._cond:
+            self.in_flight -= 1
+            if latency is not None:
+                self._observe(latency)
+            if congested:
+                self._decrease()
+            elif self._slow_samples >= LATENCY_SLOW_SAMPLES:
+                if self._decrease():
+                    self.baseline = self.latency
+                    self._slow_samples = 0
+            elif latency is not None and not self._slow_samples:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def congestion(self):
+        """Report a congestion signal found after the fact, e.g. a throttle page served with 200."""
+        with self._cond:
+            self._decrease()
+            self._cond.notify_all()
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                'host': self.name,
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'latency': self.latency,
+                'baseline_latency': self.baseline,
+                'congestion_events': self.congestion_events,
+            }
+
+    def _observe(self, latency):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+        if self.baseline is None or self.latency < self.baseline:
+            self.baseline = self.latency
+        else:
+            # Let the baseline drift up so one unusually fast spell is not the yardstick forever
+            self.baseline += 0.01 * (self.latency - self.baseline)
+        self._slow_samples = self._slow_samples + 1 if self.latency > LATENCY_TOLERANCE * self.baseline else 0
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < (self.latency or 1.0):
+            return False
+        self._last_decrease = now
+        self.congestion_events += 1
+        self.limit = max(self.minimum, self.limit * BACKOFF_FACTOR)
+        return True
+
+
+_limits = {}
+_limits_lock = threading.Lock()
+
+
+def get_host_limit(url):
+    """The limit shared by every scrape path for the host of url."""
+    host = (urlsplit(url).hostname or '').lower()
+    with _limits_lock:
+        limit = _limits.get(host)
+        if limit is None:
+            ceiling = _host_ceilings().get(host, HOST_MAX_CONCURRENCY)
+            limit = _limits[host] = AdaptiveLimit(host, min(HOST_INITIAL_CONCURRENCY, ceiling), maximum=ceiling)
+        return limit
+
+
+def report_congestion(url):
+    get_host_limit(url).congestion()
+
+
+def host_limits():
+    with _limits_lock:
+        limits = list(_limits.values())
+    return [limit.snapshot() for limit in limits]
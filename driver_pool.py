@@ -0,0 +1,199 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+MAX_DRIVERS = int(os.environ.get('NMMS_DRIVER_POOL_SIZE', 3))
+MIN_IDLE = int(os.environ.get('NMMS_DRIVER_POOL_MIN_IDLE', 1))
+IDLE_TIMEOUT = float(os.environ.get('NMMS_DRIVER_IDLE_TIMEOUT', 600))
+LEASE_TIMEOUT = float(os.environ.get('NMMS_DRIVER_LEASE_TIMEOUT', 1800))
+REAP_INTERVAL = float(os.environ.get('NMMS_DRIVER_REAP_INTERVAL', 60))
+
+
+class DriverPool:
+    """
+    Process-wide pool of warm webdriver instances.
+
+    Drivers are checked out with checkout()/release() or the lease() context
+    manager. A background reaper quits drivers idle for longer than idle_timeout
+    (keeping min_idle warm) and reclaims drivers whose lease was not renewed for
+    lease_timeout, which is how drivers of abandoned Streamlit sessions are freed;
+    whoever holds a driver calls renew() while using it.
+    """
+
+    def __init__(self, factory, max_size=MAX_DRIVERS, min_idle=MIN_IDLE, idle_timeout=IDLE_TIMEOUT, lease_timeout=LEASE_TIMEOUT):
+        self._factory = factory
+        self.max_size = max(1, max_size)
+        self.min_idle = min(min_idle, self.max_size)
+        self.idle_timeout = idle_timeout
+        self.lease_timeout = lease_timeout
+        self._idle = []  # [(driver, returned_at)], most recently returned last
+        self._leased = {}  # id(driver) -> (driver, leased_or_renewed_at)
+        self._starting = 0
+        self._cond = threading.Condition()
+        self._reaper = None
+        self._closed = False
+
+    def _size(self):
+        return len(self._idle) + len(self._leased) + self._starting
+
+    def checkout(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                driver = None
+                if self._idle:
+                    driver, _ = self._idle.pop()
+                    # Counted as leased while its health is checked outside the lock
+                    self._leased[id(driver)] = (driver, time.monotonic())
+                elif self._size() < self.max_size:
+                    self._starting += 1
+                    break
+                else:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError("No browser available, all drivers are in use.")
+                    self._cond.wait(remaining)
+                    continue
+            if self._is_healthy(driver):
+                return driver
+            with self._cond:
+                self._leased.pop(id(driver), None)
+                self._cond.notify()
+            self._quit(driver)
+        try:
+            driver = self._factory()
+        except Exception:
+            with self._cond:
+                self._starting -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._starting -= 1
+            self._leased[id(driver)] = (driver, time.monotonic())
+        return driver
+
+    def release(self, driver, discard=False):
+        if driver is None:
+            return
+        with self._cond:
+            if self._leased.pop(id(driver), None) is None:
+                # Already reclaimed by the reaper
+                return
+            self._cond.notify()
+        if not discard and not self._closed and self._reset(driver):
+            with self._cond:
+                self._idle.append((driver, time.monotonic()))
+                self._cond.notify()
+        else:
+            self._quit(driver)
+
+    def renew(self, driver):
+        """Restart the lease of a checked-out driver, keeping it from the reaper."""
+        with self._cond:
+            if id(driver) in self._leased:
+                self._leased[id(driver)] = (driver, time.monotonic())
+
+    @contextmanager
+    def lease(self, timeout=None):
+        driver = self.checkout(timeout)
+        try:
+            yield driver
+        except Exception:
+            self.release(driver, discard=True)
+            raise
+        else:
+            self.release(driver)
+
+    def prewarm(self):
+        while True:
+            with self._cond:
+                if self._closed or len(self._idle) + self._starting >= self.min_idle or self._size() >= self.max_size:
+                    return
+                self._starting += 1
+            try:
+                driver = self._factory()
+            except Exception as e:
+                print(f"Error starting browser for pool: {e}")
+                with self._cond:
+                    self._starting -= 1
+                return
+            with self._cond:
+                self._starting -= 1
+                self._idle.append((driver, time.monotonic()))
+                self._cond.notify()
+
+    def reap(self):
+        now = time.monotonic()
+        to_quit = []
+        with self._cond:
+            keep = []
+            # Oldest first, so the most recently used drivers stay warm
+            for driver, returned_at in self._idle:
+                if now - returned_at > self.idle_timeout and len(self._idle) - len(to_quit) > self.min_idle:
+                    to_quit.append(driver)
+                else:
+                    keep.append((driver, returned_at))
+            self._idle = keep
+            for key, (driver, renewed_at) in list(self._leased.items()):
+                if now - renewed_at > self.lease_timeout:
+                    del self._leased[key]
+                    to_quit.append(driver)
+            if to_quit:
+                self._cond.notify_all()
+        for driver in to_quit:
+            self._quit(driver)
+        self.prewarm()
+
+    def start_reaper(self, interval=REAP_INTERVAL):
+        if self._reaper is not None:
+            return
+
+        def loop():
+            while not self._closed:
+                time.sleep(interval)
+                try:
+                    self.reap()
+                except Exception as e:
+                    print(f"Error reaping browser pool: {e}")
+
+        self._reaper = threading.Thread(target=loop, name='driver-pool-reaper', daemon=True)
+        self._reaper.start()
+
+    def stats(self):
+        with self._cond:
+            return {'idle': len(self._idle), 'leased': len(self._leased), 'starting': self._starting, 'max_size': self.max_size}
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            drivers = [d for d, _ in self._idle] + [d for d, _ in self._leased.values()]
+            self._idle = []
+            self._leased = {}
+            self._cond.notify_all()
+        for driver in drivers:
+            self._quit(driver)
+
+    @staticmethod
+    def _is_healthy(driver):
+        try:
+            driver.current_url
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _reset(driver):
+        try:
+            driver.delete_all_cookies()
+            driver.get('about:blank')
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _quit(driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
@@ -0,0 +1,221 @@
+import io
+import os
+from functools import lru_cache
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.drawing.image import Image as XLImage
+from openpyxl.styles import Alignment, Font
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.cell_range import CellRange
+from metrics import WORKBOOK_BUILD, WORKBOOK_SAVE, timed
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+# 'openpyxl' streams rows through a write-only workbook, 'xlsxwriter' uses its
+# constant_memory mode; 'auto' prefers xlsxwriter when it is installed.
+XLSX_BACKEND = os.environ.get('NMMS_XLSX_BACKEND', 'openpyxl')
+
+# Named cell styles shared by every workbook; each backend builds them once.
+STYLES = {
+    'bold': {'bold': True},
+    'bold_center_16': {'bold': True, 'size': 16, 'align': 'center', 'valign': 'center'},
+    'bold_center_18': {'bold': True, 'size': 18, 'align': 'center', 'valign': 'center'},
+}
+
+
+def resolve_backend(backend=None):
+    backend = backend or XLSX_BACKEND
+    if backend == 'auto':
+        return 'xlsxwriter' if xlsxwriter is not None else 'openpyxl'
+    if backend == 'xlsxwriter' and xlsxwriter is None:
+        raise ImportError("The xlsxwriter backend was requested but xlsxwriter is not installed.")
+    return backend
+
+
+def open_workbook(target=None, backend=None):
+    """
+    Open a streaming workbook writing to target (a path or a binary file object).
+    With no target the workbook is written to a BytesIO returned by close().
+    """
+    if resolve_backend(backend) == 'xlsxwriter':
+        return XlsxwriterWorkbookWriter(target)
+    return OpenpyxlWorkbookWriter(target)
+
+
+class _SheetWriter:
+    """
+    Rows are written strictly top to bottom. Column widths must be set before the
+    first row and a row height before that row is written.
+    """
+
+    def __init__(self):
+        self.row_count = 0
+        self._last_row = None
+
+    def append(self, values, styles=None):
+        # styles: one style name for every cell, or {1-based column: style name}
+        self.row_count += 1
+        self._last_row = (list(values), styles)
+        with timed(WORKBOOK_BUILD):
+            self._write_row(self.row_count, self._last_row[0], styles)
+
+    def skip(self, rows=1):
+        for _ in range(rows):
+            self.append([])
+
+    def merge_down(self, col, rows):
+        """Merge column col of the row just appended with the rows rows below it."""
+        if rows > 1:
+            self._merge(self.row_count, col, self.row_count + rows - 1, col)
+
+    @staticmethod
+    def _style_for(styles, col_idx):
+        if isinstance(styles, dict):
+            return styles.get(col_idx)
+        return styles
+
+
+class _OpenpyxlSheetWriter(_SheetWriter):
+    def __init__(self, ws):
+        super().__init__()
+        self.ws = ws
+
+    def set_column_width(self, col_letter, width):
+        self.ws.column_dimensions[col_letter].width = width
+
+    def set_row_height(self, row, height):
+        self.ws.row_dimensions[row].height = height
+
+    def _write_row(self, row_idx, values, styles):
+        if not styles:
+            self.ws.append(values)
+            return
+        cells = []
+        for col_idx, value in enumerate(values, 1):
+            style = self._style_for(styles, col_idx)
+            if style is None or value is None:
+                cells.append(value)
+                continue
+            cell = WriteOnlyCell(self.ws, value=value)
+            font, alignment = _openpyxl_style(style)
+            cell.font = font
+            if alignment is not None:
+                cell.alignment = alignment
+            cells.append(cell)
+        self.ws.append(cells)
+
+    def _merge(self, first_row, first_col, last_row, last_col):
+        self.ws.merged_cells.add(CellRange(min_col=first_col, min_row=first_row, max_col=last_col, max_row=last_row))
+
+    def add_image(self, path, row, col, width=None, height=None):
+        img = XLImage(path)
+        if width and height:
+            img.width, img.height = width, height
+        self.ws.add_image(img, f"{get_column_letter(col)}{row}")
+
+
+@lru_cache(maxsize=None)
+def _openpyxl_style(style):
+    spec = STYLES[style]
+    font = Font(bold=spec.get('bold', False), size=spec.get('size'))
+    alignment = None
+    if 'align' in spec or 'valign' in spec:
+        alignment = Alignment(horizontal=spec.get('align'), vertical=spec.get('valign'))
+    return font, alignment
+
+
+class OpenpyxlWorkbookWriter:
+    def __init__(self, target=None):
+        self.target = target
+        self.wb = Workbook(write_only=True)
+
+    def add_sheet(self, title=None):
+        return _OpenpyxlSheetWriter(self.wb.create_sheet(title))
+
+    def close(self):
+        target = self.target if self.target is not None else io.BytesIO()
+        with timed(WORKBOOK_SAVE):
+            self.wb.save(target)
+        if self.target is None:
+            target.seek(0)
+        return target
+
+
+class _XlsxwriterSheetWriter(_SheetWriter):
+    def __init__(self, book, ws):
+        super().__init__()
+        self.book = book
+        self.ws = ws
+
+    def set_column_width(self, col_letter, width):
+        self.ws.set_column(f"{col_letter}:{col_letter}", width)
+
+    def set_row_height(self, row, height):
+        self.ws.set_row(row - 1, height)
+
+    def _write_row(self, row_idx, values, styles):
+        for col_idx, value in enumerate(values, 1):
+            if value is None:
+                continue
+            style = self._style_for(styles, col_idx)
+            fmt = self.book.format_for(style) if style else None
+            self.ws.write(row_idx - 1, col_idx - 1, value, fmt)
+
+    def _merge(self, first_row, first_col, last_row, last_col):
+        # constant_memory only accepts cells at or below the current row, so the
+        # merge is issued while its first row is still the one being written.
+        values, styles = self._last_row
+        value = values[first_col - 1] if len(values) >= first_col else None
+        style = self._style_for(styles, first_col)
+        self.ws.merge_range(first_row - 1, first_col - 1, last_row - 1, last_col - 1,
+                            value, self.book.format_for(style) if style else None)
+
+    def add_image(self, path, row, col, width=None, height=None):
+        options = {'object_position': 2}
+        if width and height:
+            src_width, src_height = _image_size(path)
+            options['x_scale'] = width / src_width
+            options['y_scale'] = height / src_height
+        self.ws.insert_image(row - 1, col - 1, path, options)
+
+
+def _image_size(path):
+    from PIL import Image as PILImage
+    with PILImage.open(path) as img:
+        return img.size
+
+
+class XlsxwriterWorkbookWriter:
+    def __init__(self, target=None):
+        self.target = target
+        self._buffer = io.BytesIO() if target is None else None
+        self.book = xlsxwriter.Workbook(target if target is not None else self._buffer, {'constant_memory': True})
+        self._formats = {}
+
+    def format_for(self, style):
+        fmt = self._formats.get(style)
+        if fmt is None:
+            spec = STYLES[style]
+            props = {'bold': spec.get('bold', False)}
+            if 'size' in spec:
+                props['font_size'] = spec['size']
+            if 'align' in spec:
+                props['align'] = spec['align']
+            if 'valign' in spec:
+                props['valign'] = 'vcenter' if spec['valign'] == 'center' else spec['valign']
+            fmt = self._formats[style] = self.book.add_format(props)
+        return fmt
+
+    def add_sheet(self, title=None):
+        return _XlsxwriterSheetWriter(self, self.book.add_worksheet(title))
+
+    def close(self):
+        with timed(WORKBOOK_SAVE):
+            self.book.close()
+        if self._buffer is not None:
+            self._buffer.seek(0)
+            return self._buffer
+        return self.target
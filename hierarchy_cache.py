@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+from http_cache import CACHE_DIR, CACHE_ENABLED
+
+HIERARCHY_CACHE_PATH = os.environ.get('NMMS_HIERARCHY_CACHE', os.path.join(os.path.dirname(CACHE_DIR), 'hierarchy.json'))
+# Seconds a resolved link, and a panchayath's muster-table summary, stay valid
+HIERARCHY_TTL = int(os.environ.get('NMMS_HIERARCHY_TTL', 6 * 60 * 60))
+MUSTER_TABLE_TTL = int(os.environ.get('NMMS_MUSTER_TABLE_TTL', 15 * 60))
+
+
+def hierarchy_key(base_url, attendance_date, state, district, block, panchayath=None):
+    """Key of a resolved link; panchayath=None stands for the block's panchayath list."""
+    fin_year = parse_qs(urlsplit(base_url).query).get('fin_year', [''])[0]
+    parts = [fin_year, attendance_date, state, district, block, panchayath or '']
+    return '|'.join(part.strip().upper() for part in parts)
+
+
+class HierarchyCache:
+    """
+    Resolved report links and muster-table summaries, kept in one small JSON file so
+    repeat lookups can jump straight to a page instead of re-walking the hierarchy.
+    Entries expire after their TTL; callers invalidate a link as soon as it fails.
+    """
+
+    def __init__(self, path=HIERARCHY_CACHE_PATH, url_ttl=HIERARCHY_TTL, muster_table_ttl=MUSTER_TABLE_TTL, enabled=CACHE_ENABLED):
+        self.path = path
+        self.url_ttl = url_ttl
+        self.muster_table_ttl = muster_table_ttl
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+            # Old dates pile up otherwise
+            now = time.time()
+            self._entries = {k: v for k, v in self._entries.items() if v.get('expires', 0) > now}
+        return self._entries
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
+
+    def _get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._load().get(key)
+            if entry is None:
+                return None
+            if time.time() > entry['expires']:
+                del self._entries[key]
+                self._save()
+                return None
+            return entry['value']
+
+    def _put(self, key, value, ttl):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._load()[key] = {'value': value, 'expires': time.time() + ttl}
+            self._save()
+
+    def _invalidate(self, key):
+        with self._lock:
+            if self._load().pop(key, None) is not None:
+                self._save()
+
+    def get_url(self, key):
+        return self._get(f"url:{key}")
+
+    def put_url(self, key, url):
+        self._put(f"url:{key}", url, self.url_ttl)
+
+    def invalidate_url(self, key):
+        self._invalidate(f"url:{key}")
+
+    def get_muster_table(self, panchayath_url):
+        """Return (work codes, workcode_idx, muster_no_idx) for a panchayath page, or None."""
+        value = self._get(f"muster_table:{panchayath_url}")
+        if value is None:
+            return None
+        return value['work_codes'], value['workcode_idx'], value['muster_no_idx']
+
+    def put_muster_table(self, panchayath_url, work_codes, workcode_idx, muster_no_idx):
+        value = {'work_codes': list(work_codes), 'workcode_idx': workcode_idx, 'muster_no_idx': muster_no_idx}
+        self._put(f"muster_table:{panchayath_url}", value, self.muster_table_ttl)
+
+    def invalidate_muster_table(self, panchayath_url):
+        self._invalidate(f"muster_table:{panchayath_url}")
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._save()
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_hierarchy_cache():
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = HierarchyCache()
+        return _shared_cache
@@ -0,0 +1,265 @@
+import hashlib
+import os
+import re
+from functools import lru_cache
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.dammit import UnicodeDammit
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:
+    lxml = None
+
+# 'auto' uses lxml when it is installed and falls back to BeautifulSoup's html.parser
+PARSER_BACKEND = os.environ.get('NMMS_HTML_PARSER', 'auto')
+
+WORK_NAME_ID = 'ContentPlaceHolder1_lbl_dtl'
+LARGE_IMAGE_TEXT = 'Click here for large image'
+
+# Hierarchy pages only ever need the state/district/block grid or the RepPr1 repeater
+HIERARCHY_STRAINER = SoupStrainer(attrs={'id': ['grdTable', 'RepPr1']})
+# The report form page only needs its hidden ASP.NET fields and the drop-downs
+FORM_STRAINER = SoupStrainer(['input', 'select'])
+
+_SKIPPED_TEXT_TAGS = ('script', 'style')
+_XML_DECLARATION = re.compile(r'^\s*<\?xml[^>]*\?>')
+_WORKER_NAME_ID = re.compile('lbl_workerName_')
+
+
+def resolve_backend(backend=None):
+    backend = backend or PARSER_BACKEND
+    if backend == 'auto':
+        return 'lxml' if lxml is not None else 'bs4'
+    if backend == 'lxml' and lxml is None:
+        raise ImportError("The lxml parser backend was requested but lxml is not installed.")
+    return backend
+
+
+def make_soup(content, parse_only=None, backend=None):
+    features = 'lxml' if resolve_backend(backend) == 'lxml' else 'html.parser'
+    return BeautifulSoup(content, features, parse_only=parse_only)
+
+
+# Text of the error, maintenance and throttling pages NIC serves with a 200
+ERROR_PAGE_MARKERS = (
+    b'server error', b'runtime error', b'service unavailable', b'temporarily unavailable',
+    b'too many requests', b'request rejected', b'an error occurred', b'please try again',
+)
+
+
+def is_error_page(content):
+    """True for pages that are an error or throttle response rather than a report."""
+    if not content or not content.strip():
+        return True
+    if isinstance(content, str):
+        content = content.encode('utf-8', errors='replace')
+    lowered = content[:20000].lower()
+    if any(marker in lowered for marker in ERROR_PAGE_MARKERS):
+        return True
+    # Real reports, even empty ones, are full ASP.NET pages with tables
+    return len(content) < 1024 and b'<table' not in lowered
+
+
+def row_signature(cols):
+    """
+    Fingerprint of a muster table row, used to tell whether a muster roll changed since
+    it was fetched. The leading serial number is left out: it shifts when rows are added.
+    """
+    text = '\x1f'.join(col.get_text(' ', strip=True) for col in cols[1:])
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def parse_attendance_page(content, backend=None):
+    """
+    Extract (attendance_data, photo_url, work_name, header_cells) from a muster detail page.
+    Both backends return identical tuples; photo_url is the raw href from the page.
+    """
+    if resolve_backend(backend) == 'lxml':
+        return _parse_attendance_lxml(content)
+    return _parse_attendance_bs4(BeautifulSoup(content, 'html.parser'))
+
+
+class RowLayout:
+    """
+    Column positions of one attendance grid layout, compiled once per header signature
+    and shared by every thread, so it is never changed after construction. The worker-name
+    span column is learned per page: extract() takes the column found so far and returns
+    it with the row, and rows where it is not in that column fall back to scanning every cell.
+    """
+
+    def __init__(self, header_cells):
+        col_map = {name: idx for idx, name in enumerate(header_cells)}
+        self.header_cells = tuple(header_cells)
+        self.sno_idx = col_map.get('S.No')
+        self.job_card_idx = col_map.get('Job Card No')
+        self.date_idx = col_map.get('Attendance Date')
+        self.status_idx = col_map.get('Present/Absent')
+
+    def extract(self, cols, get_text, find_worker_name, name_col=None):
+        """Return (row values, worker-name column for the next row of the page)."""
+        span = None
+        if name_col is not None and name_col < len(cols):
+            span = find_worker_name(cols[name_col])
+        if span is None:
+            for idx, td in enumerate(cols):
+                span = find_worker_name(td)
+                if span is not None:
+                    name_col = idx
+                    break
+        return [
+            get_text(cols[self.sno_idx]) if self.sno_idx is not None else '',
+            get_text(cols[self.job_card_idx]) if self.job_card_idx is not None else '',
+            get_text(span) if span is not None else '',
+            get_text(cols[self.date_idx]) if self.date_idx is not None else '',
+            get_text(cols[self.status_idx]) if self.status_idx is not None else ''
+        ], name_col
+
+
+@lru_cache(maxsize=64)
+def get_row_layout(header_signature):
+    return RowLayout(header_signature)
+
+
+# --- BeautifulSoup backend ---
+
+def _bs4_text_stripped(el):
+    return el.get_text(strip=True)
+
+
+def _bs4_find_worker_name(td):
+    return td.find('span', id=_WORKER_NAME_ID)
+
+
+def _parse_attendance_bs4(soup):
+    work_name = None
+    for b in soup.find_all('b'):
+        if b.text.strip().startswith('Work Name'):
+            next_text = b.next_sibling
+            if next_text:
+                work_name = str(next_text).strip(' :\u00a0-')
+            break
+    if not work_name:
+        work_name_elem = soup.find(id=WORK_NAME_ID)
+        if work_name_elem:
+            work_name = work_name_elem.text.strip()
+    attendance_data = []
+    tables = soup.find_all('table')
+    if not tables:
+        print("No tables found on the page.")
+        return None, None, work_name, None
+    attendance_table = tables[-1]
+    rows = attendance_table.find_all('tr')
+    if not rows:
+        # A report cut short, e.g. a truncated or half-rendered page
+        print("No rows in the attendance table.")
+        return None, None, work_name, None
+    header_cells = [th.text.strip() for th in rows[0].find_all(['th', 'td'])]
+    layout = get_row_layout(tuple(header_cells))
+    name_col = None
+    for row in rows[1:]:
+        cols = row.find_all('td')
+        if cols and any(c.get_text(strip=True) for c in cols):
+            values, name_col = layout.extract(cols, _bs4_text_stripped, _bs4_find_worker_name, name_col)
+            attendance_data.append(values)
+    photo_url = None
+    img_link = soup.find('a', string=LARGE_IMAGE_TEXT)
+    if img_link and img_link.has_attr('href'):
+        photo_url = img_link['href']
+    return attendance_data, photo_url, work_name, header_cells
+
+
+# --- lxml backend ---
+# Works on the lxml tree directly with XPath instead of building a soup, and
+# mirrors BeautifulSoup's text rules (comments, <script> and <style> are skipped).
+
+if lxml is not None:
+    _LXML_CELLS_XPATH = etree.XPath('.//td')
+    _LXML_WORKER_NAME_XPATH = etree.XPath('.//span[contains(@id, "lbl_workerName_")]')
+
+
+def _lxml_strings(el):
+    if isinstance(el.tag, str) and el.tag not in _SKIPPED_TEXT_TAGS and el.text:
+        yield el.text
+    for child in el:
+        if isinstance(child.tag, str):
+            yield from _lxml_strings(child)
+        if child.tail:
+            yield child.tail
+
+
+def _lxml_text(el):
+    return ''.join(_lxml_strings(el))
+
+
+def _lxml_text_stripped(el):
+    return ''.join(s.strip() for s in _lxml_strings(el))
+
+
+def _lxml_string(el):
+    # BeautifulSoup's Tag.string: the only string child, looking through single-child tags
+    if len(el) == 0:
+        return el.text
+    if len(el) == 1 and not el.text and not el[0].tail and isinstance(el[0].tag, str):
+        return _lxml_string(el[0])
+    return None
+
+
+def _lxml_find_worker_name(td):
+    spans = _LXML_WORKER_NAME_XPATH(td)
+    return spans[0] if spans else None
+
+
+def _parse_attendance_lxml(content):
+    if isinstance(content, bytes):
+        # Decode the way BeautifulSoup does, so non-ASCII names come out identical
+        content = UnicodeDammit(content, is_html=True).unicode_markup
+    # lxml refuses str input that carries an XML encoding declaration
+    content = _XML_DECLARATION.sub('', content, count=1)
+    try:
+        doc = lxml.html.fromstring(content)
+    except Exception:
+        # Empty or non-HTML body; nothing for either backend to extract
+        print("No tables found on the page.")
+        return None, None, None, None
+    work_name = None
+    for b in doc.iter('b'):
+        if _lxml_text(b).strip().startswith('Work Name'):
+            if b.tail:
+                next_text = b.tail
+            else:
+                nxt = b.getnext()
+                next_text = lxml.html.tostring(nxt, encoding='unicode', with_tail=False) if nxt is not None else None
+            if next_text:
+                work_name = next_text.strip(' :\u00a0-')
+            break
+    if not work_name:
+        work_name_elems = doc.xpath('//*[@id=$id]', id=WORK_NAME_ID)
+        if work_name_elems:
+            work_name = _lxml_text(work_name_elems[0]).strip()
+    attendance_data = []
+    tables = doc.xpath('//table')
+    if not tables:
+        print("No tables found on the page.")
+        return None, None, work_name, None
+    attendance_table = tables[-1]
+    rows = attendance_table.xpath('.//tr')
+    if not rows:
+        # A report cut short, e.g. a truncated or half-rendered page
+        print("No rows in the attendance table.")
+        return None, None, work_name, None
+    header_cells = [_lxml_text(th).strip() for th in rows[0].xpath('.//th|.//td')]
+    layout = get_row_layout(tuple(header_cells))
+    name_col = None
+    for row in rows[1:]:
+        cols = _LXML_CELLS_XPATH(row)
+        if cols and any(_lxml_text_stripped(c) for c in cols):
+            values, name_col = layout.extract(cols, _lxml_text_stripped, _lxml_find_worker_name, name_col)
+            attendance_data.append(values)
+    photo_url = None
+    for a in doc.iter('a'):
+        if _lxml_string(a) == LARGE_IMAGE_TEXT:
+            if a.get('href') is not None:
+                photo_url = a.get('href')
+            break
+    return attendance_data, photo_url, work_name, header_cells
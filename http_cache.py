@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import requests
+from requests.structures import CaseInsensitiveDict
+
+CACHE_ENABLED = os.environ.get('NMMS_CACHE', '1') != '0'
+CACHE_DIR = os.environ.get('NMMS_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'nmms_attendance', 'http'))
+CACHE_MAX_BYTES = int(float(os.environ.get('NMMS_CACHE_MAX_MB', 512)) * 1024 * 1024)
+
+# Seconds an entry stays fresh, by resource type. Photos never change once published;
+# muster pages are still being filled in on the day, so they are only kept briefly.
+CACHE_TTLS = {
+    'hierarchy': int(os.environ.get('NMMS_CACHE_TTL_HIERARCHY', 15 * 60)),
+    'muster': int(os.environ.get('NMMS_CACHE_TTL_MUSTER', 5 * 60)),
+    'photo': int(os.environ.get('NMMS_CACHE_TTL_PHOTO', 365 * 24 * 60 * 60)),
+}
+
+# Query parameters that change between links to the same resource
+VOLATILE_PARAMS = {'digest'}
+
+MUSTER_PAGE = 'View_NMMS_atten_date_dtl_rpt.aspx'
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp')
+
+
+def normalize_url(url):
+    parts = urlsplit(url)
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in VOLATILE_PARAMS
+    )
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ''))
+
+
+def resource_type(url, content_type=None):
+    path = urlsplit(url).path
+    if (content_type and content_type.lower().startswith('image/')) or path.lower().endswith(PHOTO_EXTENSIONS):
+        return 'photo'
+    if path.endswith(MUSTER_PAGE):
+        return 'muster'
+    return 'hierarchy'
+
+
+class ResponseCache:
+    """
+    On-disk cache of GET responses keyed by normalized URL.
+    Each entry is a body file plus a small JSON sidecar; the body's mtime is bumped
+    on every hit so eviction can drop the least recently used entries first.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, ttls=None, enabled=CACHE_ENABLED):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttls = dict(CACHE_TTLS, **(ttls or {}))
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._total_bytes = None
+
+    def _paths(self, url):
+        key = hashlib.sha256(normalize_url(url).encode('utf-8')).hexdigest()
+        base = os.path.join(self.cache_dir, key[:2], key)
+        return base + '.body', base + '.json'
+
+    def get(self, url):
+        if not self.enabled:
+            return None
+        body_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if time.time() - meta['stored_at'] > self.ttls.get(meta['type'], 0):
+                self.invalidate(url)
+                return None
+            with open(body_path, 'rb') as f:
+                body = f.read()
+            os.utime(body_path)
+        except (OSError, ValueError, KeyError):
+            return None
+        return _build_response(url, body, meta)
+
+    def put(self, url, response):
+        if not self.enabled or response.status_code != 200 or not response.content:
+            return
+        body_path, meta_path = self._paths(url)
+        meta = {
+            'url': normalize_url(url),
+            'final_url': response.url,
+            'type': resource_type(url, response.headers.get('Content-Type')),
+            'stored_at': time.time(),
+            'content_type': response.headers.get('Content-Type'),
+            'encoding': response.encoding,
+        }
+        try:
+            os.makedirs(os.path.dirname(body_path), exist_ok=True)
+            old_size = os.path.getsize(body_path) if os.path.exists(body_path) else 0
+            _atomic_write(body_path, response.content)
+            _atomic_write(meta_path, json.dumps(meta).encode('utf-8'))
+        except OSError as e:
+            print(f"Error writing response cache: {e}")
+            return
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += len(response.content) - old_size
+        self._evict_if_needed()
+
+    def invalidate(self, url):
+        body_path, meta_path = self._paths(url)
+        for path in (body_path, meta_path):
+            try:
+                size = os.path.getsize(path) if path == body_path else 0
+                os.remove(path)
+                with self._lock:
+                    if self._total_bytes is not None:
+                        self._total_bytes -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        for entry in self._entries():
+            self._remove_entry(entry[2])
+        with self._lock:
+            self._total_bytes = 0
+
+    def _entries(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.body'):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _remove_entry(self, body_path):
+        for path in (body_path, body_path[:-len('.body')] + '.json'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _evict_if_needed(self):
+        with self._lock:
+            if self._total_bytes is not None and self._total_bytes <= self.max_bytes:
+                return
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            if total > self.max_bytes:
+                # Evict down to 90% so we do not rescan on every put
+                target = self.max_bytes * 0.9
+                for _, size, path in sorted(entries):
+                    if total <= target:
+                        break
+                    self._remove_entry(path)
+                    total -= size
+            self._total_bytes = total
+
+
+def _atomic_write(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _build_response(url, body, meta):
+    response = requests.Response()
+    response.status_code = 200
+    response._content = body
+    response.url = meta.get('final_url') or url
+    response.encoding = meta.get('encoding')
+    response.headers = CaseInsensitiveDict({'Content-Type': meta.get('content_type') or ''})
+    response.from_cache = True
+    return response
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_cache():
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = ResponseCache()
+        return _shared_cache
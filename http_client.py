@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+import requests
+from http_cache import get_cache
+from cassette import CassetteAdapter, get_cassette
+from concurrency_control import get_host_limit, is_congestion
+from retry_policy import DEFAULT_POLICY, CircuitOpen, get_breaker, is_retryable
+import metrics
+
+# Connection pool tuning; every scrape path talks to the same NIC host, so the
+# per-host limit (POOL_MAXSIZE) is the one that matters.
+POOL_CONNECTIONS = int(os.environ.get('NMMS_POOL_CONNECTIONS', 4))
+POOL_MAXSIZE = int(os.environ.get('NMMS_POOL_MAXSIZE', 16))
+POOL_BLOCK = os.environ.get('NMMS_POOL_BLOCK', '1') != '0'
+REQUEST_TIMEOUT = float(os.environ.get('NMMS_REQUEST_TIMEOUT', 60))
+# Root of the NIC report pages; point it at a stand-in server (benchmarks/stub_server.py) to test offline
+SITE_URL = os.environ.get('NMMS_SITE_URL', 'https://mnregaweb4.nic.in/nregaarch/').rstrip('/') + '/'
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3',
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive',
+}
+
+_shared_session = None
+_shared_lock = threading.Lock()
+
+
+def create_session(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, pool_block=POOL_BLOCK, headers=None):
+    """
+    Build a requests.Session with a keep-alive connection pool.
+    With pool_block=True no more than pool_maxsize connections are opened per host;
+    extra threads wait for a free connection instead of opening new ones.
+    Requests go through the active cassette (see cassette.py), if any.
+    """
+    session = requests.Session()
+    adapter = CassetteAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update(DEFAULT_HEADERS)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+def get_session():
+    global _shared_session
+    with _shared_lock:
+        if _shared_session is None:
+            _shared_session = create_session()
+        return _shared_session
+
+
+def send_request(method, url, session=None, policy=None, **kwargs):
+    """
+    Send one request through the adaptive per-host limit and the host's circuit
+    breaker. Failed requests and 429/5xx answers are retried with backoff; the last
+    answer is returned (or the last error raised) once policy's attempts run out.
+    """
+    session = session or get_session()
+    policy = policy or DEFAULT_POLICY
+    kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+    limit = get_host_limit(url)
+    breaker = get_breaker(url)
+    for attempt in range(policy.attempts):
+        if attempt:
+            metrics.count('retries')
+        try:
+            probe = breaker.before_request()
+        except CircuitOpen:
+            metrics.count('circuit_rejections')
+            raise
+        limit.acquire()
+        started = time.monotonic()
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            limit.release(congested=True)
+            breaker.record_failure()
+            metrics.count('requests', method=method, status='error')
+            if attempt + 1 >= policy.attempts:
+                raise
+            print(f"Request to {url} failed ({e}); retrying")
+            policy.sleep(attempt)
+            continue
+        except BaseException:
+            limit.release()
+            if probe:
+                breaker.abandon_probe()
+            raise
+        limit.release(time.monotonic() - started, congested=is_congestion(response))
+        metrics.count('requests', method=method, status=response.status_code)
+        metrics.count('bytes_received', len(response.content))
+        if not is_retryable(response):
+            breaker.record_success()
+            return response
+        breaker.record_failure()
+        if attempt + 1 >= policy.attempts:
+            return response
+        print(f"Request to {url} answered {response.status_code}; retrying")
+        policy.sleep(attempt, response)
+
+
+def http_get(url, session=None, use_cache=True, **kwargs):
+    cache = get_cache()
+    # A recording must see every response, and a replay must not be answered from disk
+    use_cache = use_cache and get_cassette() is None
+    if use_cache:
+        cached = cache.get(url)
+        if cached is not None:
+            metrics.count('cache_hits')
+            return cached
+        metrics.count('cache_misses')
+    response = send_request('GET', url, session, **kwargs)
+    if use_cache:
+        cache.put(url, response)
+    return response
+
+
+def http_post(url, session=None, **kwargs):
+    return send_request('POST', url, session, **kwargs)
@@ -0,0 +1,130 @@
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image as PILImage
+from photo_store import PhotoStore, StoredPhoto, get_photo_store
+from metrics import IMAGE_PROCESSING as IMAGE_PROCESSING_STAGE, timed
+
+IMAGE_PROCESSING = os.environ.get('NMMS_IMAGE_PROCESSING', '1') != '0'
+MAX_WIDTH = int(os.environ.get('NMMS_IMAGE_MAX_WIDTH', 640))
+MAX_HEIGHT = int(os.environ.get('NMMS_IMAGE_MAX_HEIGHT', 480))
+JPEG_QUALITY = int(os.environ.get('NMMS_IMAGE_QUALITY', 70))
+IMAGE_WORKERS = int(os.environ.get('NMMS_IMAGE_WORKERS', os.cpu_count() or 2))
+
+
+class ProcessedPhoto(StoredPhoto):
+    """A stored photo ready for embedding, with its pixel size known up front."""
+
+    __slots__ = ('width', 'height')
+
+    def __init__(self, digest, path, size, width, height):
+        super().__init__(digest, path, size)
+        self.width = width
+        self.height = height
+
+
+def _variant_key(digest, max_width, max_height, quality):
+    return f"variant:{digest}:{max_width}x{max_height}:q{quality}"
+
+
+def _downscale(src_path, src_size, store_root, max_width, max_height, quality):
+    # Runs in a worker process; only paths and numbers cross the process boundary
+    with PILImage.open(src_path) as img:
+        src_width, src_height = img.size
+        src_format = img.format
+        if img.format == 'JPEG':
+            # Let libjpeg decode at a reduced scale instead of full resolution
+            img.draft('RGB', (max_width, max_height))
+        img.thumbnail((max_width, max_height))
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        out = io.BytesIO()
+        img.save(out, format='JPEG', quality=quality, optimize=True)
+        width, height = img.size
+    fits = src_width <= max_width and src_height <= max_height
+    if fits and src_format in ('JPEG', 'PNG') and src_size <= out.tell():
+        # Already small enough; re-encoding would only lose quality
+        return None, src_width, src_height, False
+    # The parent process accounts for a newly written blob and does any eviction
+    store = PhotoStore(store_root, max_bytes=0)
+    data = out.getvalue()
+    existing = store.get(hashlib.sha256(data).hexdigest())
+    photo = existing or store.put(data)
+    return photo.digest, width, height, existing is None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Forking a process that runs scraper and Streamlit threads can copy held locks
+            _pool = ProcessPoolExecutor(max_workers=max(1, IMAGE_WORKERS), mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+
+def _read_size(photo):
+    with PILImage.open(photo.path) as img:
+        return img.size
+
+
+def prepare_photo(photo, max_width=MAX_WIDTH, max_height=MAX_HEIGHT, quality=JPEG_QUALITY, store=None):
+    """
+    Return a size-capped, recompressed copy of a stored photo as a ProcessedPhoto.
+    Work is done in a shared process pool; results are remembered in the photo
+    store, so a photo is only processed once per settings.
+    """
+    if photo is None:
+        return None
+    if isinstance(photo, ProcessedPhoto):
+        return photo
+    with timed(IMAGE_PROCESSING_STAGE):
+        return _prepare_photo(photo, max_width, max_height, quality, store or get_photo_store())
+
+
+def _prepare_photo(photo, max_width, max_height, quality, store):
+    try:
+        if not IMAGE_PROCESSING:
+            width, height = _read_size(photo)
+            return ProcessedPhoto(photo.digest, photo.path, photo.size, width, height)
+        key = _variant_key(photo.digest, max_width, max_height, quality)
+        variant = store.lookup_alias(key)
+        if variant is not None:
+            width, height = _read_size(variant)
+            return ProcessedPhoto(variant.digest, variant.path, variant.size, width, height)
+        args = (photo.path, photo.size, store.root, max_width, max_height, quality)
+        try:
+            digest, width, height, written = _get_pool().submit(_downscale, *args).result()
+        except BrokenProcessPool:
+            _reset_pool()
+            digest, width, height, written = _downscale(*args)
+        variant = photo
+        if digest:
+            variant = store.get(digest)
+            if variant is None:
+                # Evicted before we got to it; embed the original this time
+                raise FileNotFoundError(f"variant {digest[:12]} is gone from the store")
+            if written:
+                store.added(variant.size)
+        store.remember_alias(key, variant)
+        return ProcessedPhoto(variant.digest, variant.path, variant.size, width, height)
+    except Exception as e:
+        print(f"Error processing photo {photo}: {e}")
+    try:
+        width, height = _read_size(photo)
+        return ProcessedPhoto(photo.digest, photo.path, photo.size, width, height)
+    except Exception:
+        return None
@@ -0,0 +1,202 @@
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+from profiler import profiled
+
+JOB_WORKERS = int(os.environ.get('NMMS_JOB_WORKERS', 4))
+# Seconds a finished job (and its result) is kept for the UI to collect
+JOB_RETENTION = float(os.environ.get('NMMS_JOB_RETENTION', 2 * 60 * 60))
+JOB_LOG_LINES = 500
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """
+    One background scrape. The target receives job.report as its progress callback;
+    report() is also where a cancellation request takes effect.
+    """
+
+    def __init__(self, label=None, meta=None, profile=False):
+        self.id = uuid.uuid4().hex[:12]
+        self.label = label or ''
+        self.meta = dict(meta or {})
+        self.status = QUEUED
+        self.message = 'Waiting for a free worker...'
+        self.percentage = 0
+        self.log = deque(maxlen=JOB_LOG_LINES)
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.metrics = None
+        self.profile = profile
+        self.profile_files = None
+        self.profile_stages = None
+        self._cancel = threading.Event()
+        self._future = None
+        self._lock = threading.Lock()
+
+    def report(self, message, percentage=None):
+        if self._cancel.is_set():
+            raise JobCancelled()
+        with self._lock:
+            self.message = message
+            self.log.append(message)
+            if percentage is not None:
+                self.percentage = max(0, min(100, percentage))
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'id': self.id,
+                'label': self.label,
+                'status': self.status,
+                'message': self.message,
+                'percentage': self.percentage,
+                'log': list(self.log),
+                'error': self.error,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'meta': dict(self.meta),
+                'metrics': self.metrics.snapshot() if self.metrics else None,
+                'profile': {'files': self.profile_files, 'stages': self.profile_stages} if self.profile_files else None,
+            }
+
+    def _set_state(self, status, message=None, **fields):
+        with self._lock:
+            self.status = status
+            if message is not None:
+                self.message = message
+            for name, value in fields.items():
+                setattr(self, name, value)
+
+
+class JobRunner:
+    """
+    Process-wide pool running scrapes outside the Streamlit script thread.
+
+    Jobs are looked up by ID, so a reconnecting browser can pick up its job again.
+    At most max_workers jobs run at once; the rest wait in submission order.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, retention=JOB_RETENTION):
+        self.max_workers = max(1, max_workers)
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='scrape-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, target, label=None, meta=None, profile=False):
+        """
+        Run target(progress_callback) in the background and return the job ID.
+        With profile (or NMMS_PROFILE set) the job is profiled, see profiler.py.
+        """
+        job = Job(label, meta, profile)
+        with self._lock:
+            self._purge_locked()
+            self._jobs[job.id] = job
+        job._future = self._executor.submit(self._run, job, target)
+        return job.id
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id):
+        job = self.get(job_id)
+        return job.snapshot() if job else None
+
+    def result(self, job_id):
+        job = self.get(job_id)
+        if job is None or job.status != DONE:
+            return None
+        return job.result
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return False
+        job._cancel.set()
+        if job._future.cancel():
+            # Never started
+            job._set_state(CANCELLED, 'Cancelled.', finished_at=time.time())
+        else:
+            # Takes effect at the job's next progress report
+            with job._lock:
+                if not job.finished:
+                    job.message = 'Cancelling...'
+        return True
+
+    def forget(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def jobs(self):
+        with self._lock:
+            self._purge_locked()
+            return [job.snapshot() for job in self._jobs.values()]
+
+    def _run(self, job, target):
+        if job.cancel_requested:
+            job._set_state(CANCELLED, 'Cancelled.', finished_at=time.time())
+            return
+        job._set_state(RUNNING, 'Starting...', started_at=time.time(), metrics=metrics.Metrics())
+        try:
+            with metrics.collect(job.metrics):
+                result = self._call(job, target)
+        except JobCancelled:
+            job._set_state(CANCELLED, 'Cancelled.', finished_at=time.time())
+        except Exception as e:
+            print(f"Job {job.id} ({job.label}) failed: {e}")
+            job._set_state(FAILED, f"Failed: {e}", error=str(e), finished_at=time.time())
+        else:
+            job._set_state(DONE, 'Done.', result=result, percentage=100, finished_at=time.time())
+        finally:
+            job.metrics.finish()
+            metrics.write_metrics_file()
+
+    def _call(self, job, target):
+        profile = None
+        try:
+            with profiled(job.profile, job.metrics) as profile:
+                return target(job.report)
+        finally:
+            # Attached before the job is seen to finish
+            if profile is not None:
+                with job._lock:
+                    job.profile_files = profile.files(f'profile_{job.id}')
+                    job.profile_stages = profile.stage_rows()
+
+    def _purge_locked(self):
+        cutoff = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def shutdown(self):
+        for job in list(self._jobs.values()):
+            job._cancel.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,241 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# When set, the process-wide metrics are written here in Prometheus text format after
+# every job, for node_exporter's textfile collector or a quick look
+METRICS_FILE = os.environ.get('NMMS_METRICS_FILE')
+METRICS_PREFIX = 'nmms_'
+
+# Stages timed across the scrape paths
+NAVIGATION = 'navigation'
+PAGE_FETCH = 'page_fetch'
+PARSE = 'parse'
+PHOTO_FETCH = 'photo_fetch'
+IMAGE_PROCESSING = 'image_processing'
+WORKBOOK_BUILD = 'workbook_build'
+WORKBOOK_SAVE = 'workbook_save'
+
+
+def _key(name, labels):
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+class Metrics:
+    """Counters and per-stage timers (count, total and max seconds)."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.finished_at = None
+        self._counters = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            timer = self._timers.setdefault(stage, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    def finish(self):
+        """Stop the clock for elapsed; counting still works afterwards."""
+        self.finished_at = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'started_at': self.started_at,
+                'elapsed': (self.finished_at or time.time()) - self.started_at,
+                'stages': {
+                    stage: {'count': count, 'seconds': total, 'max_seconds': longest}
+                    for stage, (count, total, longest) in self._timers.items()
+                },
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(self._counters.items())
+                ],
+            }
+
+
+def counter_total(snapshot, name):
+    return sum(counter['value'] for counter in snapshot['counters'] if counter['name'] == name)
+
+
+def to_json(snapshot):
+    return json.dumps(snapshot, indent=2, sort_keys=True)
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_label_value(value)}"' for name, value in sorted(labels.items())) + '}'
+
+
+def to_prometheus(snapshot, prefix=METRICS_PREFIX):
+    lines = []
+    typed = set()
+    for counter in snapshot['counters']:
+        name = f"{prefix}{counter['name']}_total"
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{_labels(counter['labels'])} {counter['value']}")
+    if snapshot['stages']:
+        lines.append(f"# TYPE {prefix}stage_seconds summary")
+        for stage, timer in sorted(snapshot['stages'].items()):
+            lines.append(f'{prefix}stage_seconds_sum{_labels({"stage": stage})} {timer["seconds"]:.6f}')
+            lines.append(f'{prefix}stage_seconds_count{_labels({"stage": stage})} {timer["count"]}')
+        lines.append(f"# TYPE {prefix}stage_seconds_max gauge")
+        for stage, timer in sorted(snapshot['stages'].items()):
+            lines.append(f'{prefix}stage_seconds_max{_labels({"stage": stage})} {timer["max_seconds"]:.6f}')
+    return '\n'.join(lines) + '\n'
+
+
+def stage_rows(snapshot):
+    """One row per stage, slowest in total first, for a summary table."""
+    return [
+        {
+            'stage': stage,
+            'count': timer['count'],
+            'total s': round(timer['seconds'], 2),
+            'mean ms': round(timer['seconds'] / timer['count'] * 1000, 1) if timer['count'] else 0,
+            'max ms': round(timer['max_seconds'] * 1000, 1),
+        }
+        for stage, timer in sorted(snapshot['stages'].items(), key=lambda item: -item[1]['seconds'])
+    ]
+
+
+_process_metrics = Metrics()
+# The metrics of the run (job, CLI invocation) the current thread works for
+_run_metrics = contextvars.ContextVar('nmms_run_metrics', default=None)
+# The same per thread ID, and the stages each thread is inside of, for the sampling
+# profiler to read from its own thread
+_thread_runs = {}
+_thread_stages = {}
+
+
+def get_metrics():
+    """Totals for the whole process since it started."""
+    return _process_metrics
+
+
+def count(name, value=1, **labels):
+    _process_metrics.count(name, value, **labels)
+    run = _run_metrics.get()
+    if run is not None:
+        run.count(name, value, **labels)
+
+
+def observe(stage, seconds):
+    _process_metrics.observe(stage, seconds)
+    run = _run_metrics.get()
+    if run is not None:
+        run.observe(stage, seconds)
+
+
+@contextmanager
+def timed(stage):
+    thread_id = threading.get_ident()
+    stages = _thread_stages.setdefault(thread_id, [])
+    stages.append(stage)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started)
+        stages.pop()
+        if not stages:
+            # Thread IDs are reused, and pool threads come and go
+            _thread_stages.pop(thread_id, None)
+
+
+def thread_activity(thread_id):
+    """(run metrics, innermost stage or None) of a thread, as of now."""
+    try:
+        stage = _thread_stages[thread_id][-1]
+    except (KeyError, IndexError):
+        stage = None
+    return _thread_runs.get(thread_id), stage
+
+
+@contextmanager
+def collect(run=None):
+    """
+    Also record everything measured in this context into run (a new Metrics by
+    default). Worker threads take part when their work is handed over with
+    submit_in_context() or submit_in(), as the pipeline does.
+    """
+    run = run or Metrics()
+    token = _run_metrics.set(run)
+    thread_id = threading.get_ident()
+    previous = _thread_runs.get(thread_id)
+    _thread_runs[thread_id] = run
+    try:
+        yield run
+    finally:
+        _run_metrics.reset(token)
+        _set_thread_run(thread_id, previous)
+
+
+def _run_for(func, *args, **kwargs):
+    thread_id = threading.get_ident()
+    previous = _thread_runs.get(thread_id)
+    _set_thread_run(thread_id, _run_metrics.get())
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _set_thread_run(thread_id, previous)
+
+
+def _set_thread_run(thread_id, run):
+    if run is None:
+        _thread_runs.pop(thread_id, None)
+    else:
+        _thread_runs[thread_id] = run
+
+
+def submit_in_context(executor, func, *args, **kwargs):
+    """executor.submit(func, ...) with func running under the caller's run metrics."""
+    return submit_in(contextvars.copy_context(), executor, func, *args, **kwargs)
+
+
+def submit_in(context, executor, func, *args, **kwargs):
+    """
+    submit_in_context() under the run metrics of context, a contextvars.copy_context()
+    taken earlier; for work handed over from threads that are not part of the run.
+    """
+    # A context can only be entered by one thread at a time
+    return executor.submit(context.copy().run, _run_for, func, *args, **kwargs)
+
+
+def save_snapshot(snapshot, path):
+    """Write snapshot to path: Prometheus text for a .prom file, JSON otherwise."""
+    text = to_prometheus(snapshot) if path.endswith('.prom') else to_json(snapshot)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def write_metrics_file(path=None):
+    path = path or METRICS_FILE
+    if not path:
+        return
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(to_prometheus(_process_metrics.snapshot()))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Error writing metrics file: {e}")
@@ -0,0 +1,35 @@
+import streamlit as st
+from metrics import counter_total, stage_rows, to_json, to_prometheus
+
+
+def show_metrics(snapshot, key='run'):
+    """Summary of a run's metrics with JSON / Prometheus downloads."""
+    if not snapshot:
+        return
+    with st.expander('Run Metrics'):
+        requests_col, data_col, retries_col, cache_col = st.columns(4)
+        requests_col.metric('Requests', counter_total(snapshot, 'requests'))
+        data_col.metric('Downloaded', f"{counter_total(snapshot, 'bytes_received') / 1e6:.1f} MB")
+        retries_col.metric('Retries', counter_total(snapshot, 'retries'))
+        cache_col.metric('Cache Hits', counter_total(snapshot, 'cache_hits') + counter_total(snapshot, 'checkpoint_hits'))
+        st.caption(f"Elapsed: {snapshot['elapsed']:.1f}s")
+        rows = stage_rows(snapshot)
+        if rows:
+            st.dataframe(rows, use_container_width=True, hide_index=True)
+        json_col, prometheus_col = st.columns(2)
+        json_col.download_button('Download JSON', to_json(snapshot), file_name='metrics.json',
+                                 mime='application/json', key=f'metrics_json_{key}')
+        prometheus_col.download_button('Download Prometheus', to_prometheus(snapshot), file_name='metrics.prom',
+                                       mime='text/plain', key=f'metrics_prom_{key}')
+
+
+def show_profile(profile, key='run'):
+    """Samples and peak memory per stage of a profiled run, with the profile files to download."""
+    if not profile:
+        return
+    with st.expander('Profile'):
+        st.dataframe(profile['stages'], use_container_width=True, hide_index=True)
+        columns = st.columns(len(profile['files']))
+        for column, (file_name, content) in zip(columns, profile['files'].items()):
+            column.download_button(f"Download {file_name.rsplit('.', 1)[-1]}", content, file_name=file_name,
+                                   key=f'profile_{file_name}_{key}')
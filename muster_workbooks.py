@@ -0,0 +1,77 @@
+import math
+from excel_writer import open_workbook
+
+# Default worksheet rows are 20 px high
+ROW_HEIGHT_PX = 20
+
+
+class MusterWorkbookRenderer:
+    """
+    Streams the muster-roll workbook and the image-only workbook one muster at a time.
+
+    Both sheets start with a "Work code / Work Name" row taken from the first muster that
+    has an attendance header. Musters arriving before that one are held back and replayed
+    once the header rows are written, so every row can be streamed top to bottom.
+    """
+
+    def __init__(self, panchayath_name, district_label, taluk_name, attendance_target=None, images_target=None, backend=None):
+        self.panchayath_name = panchayath_name
+        self.district_label = district_label
+        self.taluk_name = taluk_name
+        self.att_book = open_workbook(attendance_target, backend)
+        self.ws = self.att_book.add_sheet()
+        self.img_book = open_workbook(images_target, backend)
+        self.img_ws = self.img_book.add_sheet()
+        self._pending = []
+        self._started = False
+        self._header_written = False
+
+    def add_muster(self, muster_roll_no, work_code, attendance_data, work_name, header_cells, photo):
+        muster = (muster_roll_no, attendance_data, header_cells, photo)
+        if not self._started:
+            if not header_cells:
+                self._pending.append(muster)
+                return
+            self._start(work_code, work_name or '')
+        self._render(*muster)
+
+    def close(self):
+        if not self._started:
+            self._start(None, None)
+        return self.att_book.close(), self.img_book.close()
+
+    def _start(self, work_code, work_name):
+        self._started = True
+        for ws in (self.ws, self.img_ws):
+            ws.append(["District:", self.district_label, "Taluk/Block:", self.taluk_name], styles={1: 'bold', 3: 'bold'})
+            ws.append(["Panchayath:", self.panchayath_name], styles={1: 'bold'})
+            ws.append(["Work code:", work_code, "Work Name:", work_name], styles={1: 'bold', 3: 'bold'})
+        self.img_ws.append(['Muster Roll No', 'Image'], styles='bold')
+        pending, self._pending = self._pending, []
+        for muster in pending:
+            self._render(*muster)
+
+    def _render(self, muster_roll_no, attendance_data, header_cells, photo):
+        ws = self.ws
+        if not self._header_written and header_cells:
+            ws.append(["Muster Roll No"] + list(header_cells), styles='bold')
+            self._header_written = True
+        first_row = ws.row_count + 1
+        for att_row in attendance_data or []:
+            ws.append([muster_roll_no] + list(att_row))
+        if photo:
+            ws.add_image(photo.path, first_row, 8, photo.width, photo.height)
+            ws.skip(5)
+        else:
+            ws.skip(4)
+
+        img_ws = self.img_ws
+        start_row = img_ws.row_count + 1
+        img_ws.append([muster_roll_no], styles='bold_center_18')
+        if photo:
+            img_height_rows = max(1, math.ceil(photo.height / ROW_HEIGHT_PX))
+            img_ws.add_image(photo.path, start_row, 2, photo.width, photo.height)
+            img_ws.merge_down(1, img_height_rows)
+            img_ws.skip(img_height_rows + 1)
+        else:
+            img_ws.skip(4)
@@ -0,0 +1,201 @@
+import hashlib
+import mmap
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http_cache import normalize_url
+import metrics
+
+PHOTO_STORE_DIR = os.environ.get('NMMS_PHOTO_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'nmms_attendance', 'photos'))
+# 0 for no limit
+PHOTO_STORE_MAX_BYTES = int(float(os.environ.get('NMMS_PHOTO_MAX_MB', 2048)) * 1024 * 1024)
+# Blobs used this recently are never evicted: workbooks being built read them from
+# disk, and checkpointed musters of a resumable run refer to them
+PHOTO_STORE_MIN_AGE = float(os.environ.get('NMMS_PHOTO_MIN_AGE', 6 * 60 * 60))
+
+
+class StoredPhoto:
+    """
+    A photo kept once on disk under its SHA-256. Workbook writers take the path
+    (openpyxl reads the file itself while saving), so no in-memory copies are made.
+    """
+
+    __slots__ = ('digest', 'path', 'size')
+
+    def __init__(self, digest, path, size):
+        self.digest = digest
+        self.path = path
+        self.size = size
+
+    def open(self):
+        return open(self.path, 'rb')
+
+    @contextmanager
+    def view(self):
+        # Read-only memory map; zero-copy access for consumers that need the bytes
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield memoryview(mm)
+
+    def __repr__(self):
+        return f"StoredPhoto({self.digest[:12]}, {self.size} bytes)"
+
+
+class PhotoStore:
+    """
+    Originals and resized variants under their SHA-256, with URL and variant aliases
+    pointing at them. A blob's mtime is bumped on every hit, so once the store grows
+    past max_bytes the least recently used blobs are evicted first, as long as they
+    were not used within min_age seconds.
+    """
+
+    def __init__(self, root=PHOTO_STORE_DIR, max_bytes=PHOTO_STORE_MAX_BYTES, min_age=PHOTO_STORE_MIN_AGE):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._lock = threading.Lock()
+        self._total_bytes = None
+        self._scan_above = max_bytes
+
+    def _blob_path(self, digest):
+        return os.path.join(self.root, 'blobs', digest[:2], digest)
+
+    def _alias_path(self, alias):
+        key = hashlib.sha256(alias.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, 'urls', key[:2], key)
+
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        try:
+            os.utime(path)
+        except OSError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self.added(len(data))
+        return StoredPhoto(digest, path, len(data))
+
+    def get(self, digest):
+        path = self._blob_path(digest)
+        try:
+            os.utime(path)
+            return StoredPhoto(digest, path, os.path.getsize(path))
+        except OSError:
+            return None
+
+    def lookup_alias(self, alias):
+        alias_path = self._alias_path(alias)
+        try:
+            with open(alias_path, 'r', encoding='ascii') as f:
+                photo = self.get(f.read().strip())
+        except OSError:
+            return None
+        if photo is None:
+            # The blob was evicted
+            try:
+                os.remove(alias_path)
+            except OSError:
+                pass
+        return photo
+
+    def remember_alias(self, alias, photo):
+        # Aliases map a source URL (or a derived-variant key) to a blob digest
+        path = self._alias_path(alias)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='ascii') as f:
+            f.write(photo.digest)
+        os.replace(tmp_path, path)
+
+    def lookup_url(self, url):
+        return self.lookup_alias(normalize_url(url))
+
+    def remember_url(self, url, photo):
+        self.remember_alias(normalize_url(url), photo)
+
+    def fetch(self, url, fetch_bytes, alias=None):
+        """
+        Return the stored photo for url, calling fetch_bytes(url) only if it has
+        never been stored. Concurrent fetches of the same URL wait for the first one.
+        alias replaces the URL as the lookup key, for copies that are not the original.
+        """
+        key = alias or normalize_url(url)
+        photo = self.lookup_alias(key)
+        if photo is not None:
+            metrics.count('photo_store_hits')
+            return photo
+        with self._locks_guard:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            photo = self.lookup_alias(key)
+            if photo is None:
+                data = fetch_bytes(url)
+                if data:
+                    photo = self.put(data)
+                    self.remember_alias(key, photo)
+        with self._locks_guard:
+            self._locks.pop(key, None)
+        return photo
+
+    def added(self, size):
+        """Account for a new blob of size bytes, also one written by another process."""
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += size
+        self._evict_if_needed()
+
+    def _entries(self):
+        entries = []
+        for root, _, files in os.walk(os.path.join(self.root, 'blobs')):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _evict_if_needed(self):
+        if not self.max_bytes:
+            return
+        with self._lock:
+            if self._total_bytes is not None and self._total_bytes <= self._scan_above:
+                return
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            if total > self.max_bytes:
+                # Evict down to 90% so we do not rescan on every put; aliases of
+                # evicted blobs are dropped when next looked up
+                target = self.max_bytes * 0.9
+                cutoff = time.time() - self.min_age
+                for mtime, size, path in sorted(entries):
+                    if total <= target or mtime > cutoff:
+                        break
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        continue
+                    total -= size
+            self._total_bytes = total
+            # Recently used blobs can keep the store over the limit for a while
+            self._scan_above = max(self.max_bytes, total + self.max_bytes * 0.1)
+
+
+_shared_store = None
+_shared_lock = threading.Lock()
+
+
+def get_photo_store():
+    global _shared_store
+    with _shared_lock:
+        if _shared_store is None:
+            _shared_store = PhotoStore()
+        return _shared_store
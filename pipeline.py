@@ -0,0 +1,59 @@
+import contextvars
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from metrics import submit_in
+
+PIPELINE_DEPTH = int(os.environ.get('NMMS_PIPELINE_DEPTH', 32))
+
+
+def pipelined(items, stages, max_pending=PIPELINE_DEPTH):
+    """
+    Run every item through stages, a list of (func, workers), and yield the final
+    results in input order.
+
+    Each stage has its own thread pool and an item is handed to the next stage as
+    soon as it clears the previous one, so slow items never hold up the others.
+    At most max_pending items are queued ahead of the consumer; a stage that
+    raises re-raises when its item is reached.
+    """
+    executors = [ThreadPoolExecutor(max_workers=max(1, workers)) for _, workers in stages]
+    funcs = [func for func, _ in stages]
+    # Later stages are submitted from the worker threads of the one before, so every
+    # stage is handed the consumer's context to record its work in the caller's run
+    context = contextvars.copy_context()
+
+    def advance(stage_idx, value, final):
+        if stage_idx == len(funcs):
+            final.set_result(value)
+            return
+        try:
+            future = submit_in(context, executors[stage_idx], funcs[stage_idx], value)
+        except RuntimeError as e:
+            # Pipeline was shut down while this item was between stages
+            final.set_exception(e)
+            return
+
+        def on_done(f):
+            try:
+                result = f.result()
+            except BaseException as e:
+                final.set_exception(e)
+                return
+            advance(stage_idx + 1, result, final)
+
+        future.add_done_callback(on_done)
+
+    window = deque()
+    try:
+        for item in items:
+            final = Future()
+            advance(0, item, final)
+            window.append(final)
+            if len(window) >= max(1, max_pending):
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+    finally:
+        for executor in executors:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,263 @@
+"""
+Opt-in profiling of a whole scrape: a sampling profiler that records the stacks of
+the threads working for it, tagged with the stage each is in, and tracemalloc for
+memory.
+
+Switched on with NMMS_PROFILE=1, batch_scrape.py --profile or the "Profile this
+scrape" checkbox in the apps. The results, written next to the workbooks (or offered
+for download), are:
+
+    <name>.collapsed   one "frame;frame;... samples" line per stack, for
+                       flamegraph.pl, speedscope or inferno
+    <name>.svg         a flame graph of the same samples
+    <name>.memory.txt  samples and peak traced memory per stage, and the largest
+                       allocation sites still held when the scrape ends
+
+Threads inside a stage are sampled even while they wait (for the site, a lock or the
+image process pool); threads waiting outside of one are idle and left out. Work done
+in the image process pool is not sampled. tracemalloc slows allocation-heavy code
+down noticeably, and sees the whole process: jobs running alongside a profiled one
+share its memory numbers.
+"""
+import html
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import zlib
+from contextlib import contextmanager
+import metrics
+
+PROFILE_ENABLED = os.environ.get('NMMS_PROFILE', '0') != '0'
+# Seconds between samples
+PROFILE_INTERVAL = float(os.environ.get('NMMS_PROFILE_INTERVAL', 0.01))
+# Frames tracemalloc keeps per allocation; more give better sites but cost more
+PROFILE_TRACE_FRAMES = int(os.environ.get('NMMS_PROFILE_TRACE_FRAMES', 1))
+MAX_STACK_DEPTH = 128
+TOP_ALLOCATIONS = 15
+NO_STAGE = '(no stage)'
+# Innermost frames of a thread with nothing to do
+IDLE_FRAMES = {('_worker', 'thread.py'), ('wait', 'threading.py'), ('select', 'selectors.py'), ('get', 'queue.py')}
+
+_active_lock = threading.Lock()
+_active = None
+
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+_frame_names = {}
+
+
+def _frame_name(code):
+    name = _frame_names.get(code)
+    if name is None:
+        path = code.co_filename
+        if path.startswith(_ROOT + os.sep):
+            path = os.path.relpath(path, _ROOT)
+        else:
+            # Enough of the path to tell bs4/__init__.py from PIL/__init__.py
+            path = '/'.join(path.replace(os.sep, '/').split('/')[-2:])
+        name = _frame_names[code] = f"{code.co_name} ({path}:{code.co_firstlineno})".replace(';', ':')
+    return name
+
+
+class Profiler:
+    """
+    Samples the stacks of the threads working for run (every thread with run=None)
+    from a daemon thread, and tracks traced memory while the stages are active.
+    """
+
+    def __init__(self, run=None, interval=PROFILE_INTERVAL, trace_frames=PROFILE_TRACE_FRAMES):
+        self.run = run
+        self.interval = interval
+        self.trace_frames = trace_frames
+        self.stacks = {}
+        self.stage_samples = {}
+        self.stage_peaks = {}
+        self.samples = 0
+        self.peak = 0
+        self.held = 0
+        self.allocations = None
+        self.started_at = None
+        self.elapsed = 0.0
+        self._previous_stages = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        tracemalloc.start(self.trace_frames)
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._sample_loop, name='nmms-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started_at
+        self.held, peak = tracemalloc.get_traced_memory()
+        self.peak = max(self.peak, peak)
+        # Snapshots take a while with many traced blocks, so there is just this one
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)])
+        self.allocations = snapshot.statistics('lineno')[:TOP_ALLOCATIONS]
+        tracemalloc.stop()
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            active = set()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                run, stage = metrics.thread_activity(thread_id)
+                if self.run is not None and run is not self.run:
+                    continue
+                code = frame.f_code
+                if stage is None and (code.co_name, os.path.basename(code.co_filename)) in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.append(stage or NO_STAGE)
+                key = ';'.join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+                self.stage_samples[stage or NO_STAGE] = self.stage_samples.get(stage or NO_STAGE, 0) + 1
+                self.samples += 1
+                if stage:
+                    active.add(stage)
+            self._sample_memory(active)
+
+    def _sample_memory(self, active):
+        # The peak since the last sample is put down to the stages active at either end
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for stage in active | self._previous_stages:
+            self.stage_peaks[stage] = max(self.stage_peaks.get(stage, 0), peak)
+        self._previous_stages = active
+        self.peak = max(self.peak, peak)
+
+    def stage_rows(self):
+        """One row per stage, most sampled first."""
+        return [
+            {
+                'stage': stage,
+                'samples': samples,
+                'share': f"{samples / self.samples:.0%}" if self.samples else '-',
+                'peak MB': round(self.stage_peaks[stage] / 1e6, 1) if stage in self.stage_peaks else None,
+            }
+            for stage, samples in sorted(self.stage_samples.items(), key=lambda item: -item[1])
+        ]
+
+    def collapsed(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+    def memory_report(self):
+        lines = [
+            f"Profiled {self.elapsed:.1f}s, {self.samples} samples every {self.interval * 1000:g} ms",
+            f"Peak traced memory: {self.peak / 1e6:.1f} MB",
+            '',
+            f"{'stage':<24} {'samples':>8} {'share':>6} {'peak MB':>8}",
+        ]
+        for row in self.stage_rows():
+            peak = f"{row['peak MB']:.1f}" if row['peak MB'] is not None else '-'
+            lines.append(f"{row['stage']:<24} {row['samples']:>8} {row['share']:>6} {peak:>8}")
+        if self.allocations:
+            lines += ['', f"Largest allocation sites still held at the end ({self.held / 1e6:.1f} MB traced):"]
+            lines += [f"{stat.size / 1e6:>8.1f} MB {stat.count:>9} blocks  {stat.traceback}"
+                      for stat in self.allocations]
+        return '\n'.join(lines) + '\n'
+
+    def files(self, name):
+        """{file name: bytes} of the results."""
+        return {
+            f'{name}.collapsed': self.collapsed().encode('utf-8'),
+            f'{name}.svg': flame_graph(self.stacks, title=name).encode('utf-8'),
+            f'{name}.memory.txt': self.memory_report().encode('utf-8'),
+        }
+
+    def save(self, directory, name):
+        paths = []
+        for file_name, content in self.files(name).items():
+            path = os.path.join(directory, file_name)
+            with open(path, 'wb') as f:
+                f.write(content)
+            print(f"Saved {path}")
+            paths.append(path)
+        return paths
+
+
+@contextmanager
+def profiled(enabled=False, run=None):
+    """
+    Profile the block if enabled or NMMS_PROFILE is set. Yields the Profiler (stopped
+    when the block ends), or None; only one profile runs at a time.
+    """
+    global _active
+    profiler = None
+    if enabled or PROFILE_ENABLED:
+        with _active_lock:
+            if _active is None and not tracemalloc.is_tracing():
+                profiler = _active = Profiler(run)
+        if profiler is None:
+            print("Another profile is already running; this run is not profiled")
+        else:
+            profiler.start()
+    try:
+        yield profiler
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            with _active_lock:
+                _active = None
+
+
+def _color(name):
+    # Stable warm colours, so a function keeps its colour between graphs
+    value = zlib.crc32(name.encode('utf-8'))
+    return f"rgb({205 + value % 50},{80 + (value >> 8) % 130},{(value >> 16) % 55})"
+
+
+def flame_graph(stacks, title='Flame graph', width=1200, frame_height=16):
+    """An SVG flame graph of {collapsed stack: samples}."""
+    root = [0, {}]
+    for stack, count in stacks.items():
+        node = root
+        node[0] += count
+        for frame in stack.split(';'):
+            node = node[1].setdefault(frame, [0, {}])
+            node[0] += count
+    rects = []
+    depth_reached = [0]
+
+    def layout(children, x, depth, scale):
+        for name, (count, grandchildren) in sorted(children.items()):
+            box_width = count * scale
+            if box_width >= 0.5:
+                depth_reached[0] = max(depth_reached[0], depth)
+                rects.append((name, count, x, depth, box_width))
+                layout(grandchildren, x, depth + 1, scale)
+            x += box_width
+
+    total = root[0] or 1
+    layout(root[1], 0.0, 0, width / total)
+    top = 24
+    height = top + (depth_reached[0] + 1) * frame_height + 4
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="Verdana" font-size="11">',
+        '<rect width="100%" height="100%" fill="#f8f8f8"/>',
+        f'<text x="{width / 2}" y="16" text-anchor="middle" font-size="14">{html.escape(title)} ({root[0]} samples)</text>',
+    ]
+    for name, count, x, depth, box_width in rects:
+        y = height - 4 - (depth + 1) * frame_height
+        label = html.escape(name)
+        parts.append(
+            f'<g><title>{label} ({count} samples, {count / total:.1%})</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{box_width:.1f}" height="{frame_height - 1}" fill="{_color(name)}" rx="2"/>')
+        chars = int(box_width / 7)
+        if chars >= 3:
+            text = name if len(name) <= chars else name[:chars - 2] + '..'
+            parts.append(f'<text x="{x + 3:.1f}" y="{y + frame_height - 4}">{html.escape(text)}</text>')
+        parts.append('</g>')
+    parts.append('</svg>')
+    return '\n'.join(parts) + '\n'
@@ -0,0 +1,133 @@
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import requests
+from cassette import replaying
+
+RETRY_ATTEMPTS = int(os.environ.get('NMMS_RETRY_ATTEMPTS', 4))
+RETRY_BASE_DELAY = float(os.environ.get('NMMS_RETRY_BASE_DELAY', 1))
+RETRY_MAX_DELAY = float(os.environ.get('NMMS_RETRY_MAX_DELAY', 30))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Consecutive failed requests that open a host's circuit, and how long it stays open
+BREAKER_THRESHOLD = int(os.environ.get('NMMS_BREAKER_THRESHOLD', 8))
+BREAKER_COOLDOWN = float(os.environ.get('NMMS_BREAKER_COOLDOWN', 60))
+
+
+class CircuitOpen(requests.exceptions.ConnectionError):
+    """Raised instead of sending a request while the host is considered down."""
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: the nth retry waits a random time up to
+    base_delay * 2**n, capped at max_delay. A Retry-After header is honoured when
+    it asks for longer.
+    """
+
+    def __init__(self, attempts=RETRY_ATTEMPTS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, retry, response=None):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+        retry_after = _retry_after(response)
+        if retry_after is not None:
+            delay = max(delay, min(self.max_delay, retry_after))
+        return delay
+
+    def sleep(self, retry, response=None):
+        if replaying():
+            # A replayed run goes at full speed
+            return
+        time.sleep(self.delay(retry, response))
+
+
+def _retry_after(response):
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(response):
+    return response.status_code in RETRY_STATUSES
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a host after threshold consecutive failures. Once
+    cooldown has passed a single probe request is let through; its success closes
+    the circuit, its failure keeps it open for another cooldown.
+    """
+
+    def __init__(self, name, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.name = name
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self.opened_at is not None
+
+    def before_request(self):
+        """Raise CircuitOpen while the host is held off; True when this request is the probe."""
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            remaining = self.opened_at + self.cooldown - time.monotonic()
+            if remaining > 0 or self._probing:
+                raise CircuitOpen(f"{self.name} looks down; requests resume in {max(0.0, remaining):.0f}s")
+            self._probing = True
+            return True
+
+    def abandon_probe(self):
+        """The probe ended without an answer (e.g. interrupted); let the next request probe."""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.threshold:
+                if self.opened_at is None or self._probing:
+                    print(f"Circuit opened for {self.name} after {self.failures} failed requests")
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(url):
+    host = (urlsplit(url).hostname or '').lower()
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker(host)
+        return breaker
+
+
+DEFAULT_POLICY = RetryPolicy()
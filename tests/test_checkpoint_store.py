@@ -0,0 +1,62 @@
+from checkpoint_store import DONE, INCOMPLETE, CheckpointStore
+
+PARAMS = {'panchayath_url': 'https://example.org/panch', 'attendance_date': '01/04/2025', 'work_codes': ['all']}
+
+
+def _result(muster_roll_no):
+    return [['1', 'KN-01', f'Worker {muster_roll_no}', '01/04/2025', 'P']], None, 'Road work', ['S.No'], None
+
+
+def test_partial_run_is_resumed_with_its_saved_musters(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'checkpoints.sqlite3'))
+    run = store.open_run('muster_rolls', PARAMS)
+    assert run.save('m1', _result(1))
+    assert run.save('m2', _result(2))
+    # Incomplete results are left for the resumed run to fetch again
+    assert not run.save('m3', (None, None, None, None, None))
+    assert not run.save('m4', ([], 'https://example.org/photo.jpg', None, None, None))
+    run.finish(complete=False)
+
+    resumed = store.open_run('muster_rolls', PARAMS)
+    assert resumed.run_id == run.run_id
+    assert resumed.status == INCOMPLETE
+    assert resumed.load_all() == {'m1': _result(1), 'm2': _result(2)}
+
+
+def test_fresh_and_finished_runs_start_over(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'checkpoints.sqlite3'))
+    run = store.open_run('muster_rolls', PARAMS)
+    run.save('m1', _result(1))
+    fresh = store.open_run('muster_rolls', PARAMS, fresh=True)
+    assert fresh.run_id != run.run_id
+    assert fresh.load_all() == {}
+
+    fresh.finish(complete=True)
+    assert store.open_run('muster_rolls', PARAMS).run_id not in (run.run_id, fresh.run_id)
+    other = store.open_run('muster_rolls', dict(PARAMS, attendance_date='02/04/2025'))
+    assert other.load_all() == {}
+
+
+def test_delta_run_builds_on_the_latest_finished_run(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'checkpoints.sqlite3'))
+    run = store.open_run('muster_rolls', PARAMS)
+    run.save('m1', _result(1), signature='a')
+    run.save('m2', _result(2), signature='b')
+    run.save('m3', _result(3))
+    run.finish(complete=True)
+
+    delta = store.open_run('muster_rolls', PARAMS, any_age=True)
+    assert delta.run_id == run.run_id
+    assert delta.status == DONE
+    signatures = {'m1': 'a', 'm2': 'changed', 'm3': 'c'}
+    # m3 was saved without a signature, so it cannot be compared and is kept
+    assert set(delta.load_all(signatures)) == {'m1', 'm3'}
+    assert delta.changed(signatures) == {'m2'}
+
+
+def test_runs_older_than_max_age_are_not_resumed(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'checkpoints.sqlite3'), max_age=0)
+    run = store.open_run('muster_rolls', PARAMS)
+    run.save('m1', _result(1))
+    assert store.open_run('muster_rolls', PARAMS).run_id != run.run_id
+    assert store.open_run('muster_rolls', PARAMS, any_age=True).load_all() == {}
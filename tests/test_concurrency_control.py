@@ -0,0 +1,61 @@
+import time
+
+import concurrency_control
+from concurrency_control import AdaptiveLimit
+
+
+def _round(limit, latency):
+    limit.acquire()
+    limit.release(latency)
+
+
+def test_isolated_slow_responses_do_not_cut_the_limit():
+    limit = AdaptiveLimit('host', initial=4)
+    for _ in range(20):
+        _round(limit, 0.001)
+    grown = limit.limit
+    for _ in range(3):
+        # A few stragglers, each followed by fast responses again
+        _round(limit, 0.02)
+        for _ in range(10):
+            _round(limit, 0.001)
+    assert limit.congestion_events == 0
+    assert limit.limit >= grown
+
+
+def test_sustained_slowdown_cuts_once_and_rebaselines():
+    limit = AdaptiveLimit('host', initial=8)
+    for _ in range(20):
+        _round(limit, 0.001)
+    before = limit.limit
+    for _ in range(concurrency_control.LATENCY_SLOW_SAMPLES + 5):
+        _round(limit, 0.01)
+    assert limit.congestion_events == 1
+    assert limit.limit < before
+    # The slower latency is the new yardstick, so staying slow does not cut it again
+    for _ in range(40):
+        _round(limit, 0.01)
+        time.sleep(0.001)
+    assert limit.congestion_events == 1
+    assert limit.baseline > 0.003
+
+
+def test_congestion_halves_the_limit_and_fast_responses_win_it_back():
+    limit = AdaptiveLimit('host', initial=8, maximum=16)
+    limit.acquire()
+    limit.release(0.001, congested=True)
+    assert limit.limit == 4
+    assert limit.congestion_events == 1
+    for _ in range(40):
+        _round(limit, 0.001)
+    assert limit.limit > 8
+    assert limit.congestion_events == 1
+
+
+def test_limit_stays_between_floor_and_ceiling():
+    limit = AdaptiveLimit('host', initial=2, minimum=1, maximum=3)
+    limit.congestion()
+    assert limit.limit == 1
+    for _ in range(100):
+        _round(limit, 0.001)
+    assert limit.limit == 3
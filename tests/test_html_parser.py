@@ -0,0 +1,43 @@
+import glob
+import os
+
+import pytest
+
+from html_parser import is_error_page, parse_attendance_page
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'fixtures')
+PAGES = sorted(glob.glob(os.path.join(FIXTURES, '*.html')))
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('path', PAGES, ids=os.path.basename)
+def test_backends_extract_identical_rows(path):
+    content = _read(path)
+    assert parse_attendance_page(content, backend='lxml') == parse_attendance_page(content, backend='bs4')
+    text = content.decode('utf-8')
+    assert parse_attendance_page(text, backend='lxml') == parse_attendance_page(text, backend='bs4')
+
+
+@pytest.mark.parametrize('path', glob.glob(os.path.join(FIXTURES, 'muster_[0-9]*.html')), ids=os.path.basename)
+def test_muster_pages_have_rows_and_a_photo(path):
+    attendance_data, photo_url, work_name, header_cells = parse_attendance_page(_read(path), backend='lxml')
+    assert attendance_data and all(len(row) == 5 for row in attendance_data)
+    assert all(row[2] for row in attendance_data)
+    assert photo_url and work_name and header_cells
+
+
+@pytest.mark.parametrize('backend', ['lxml', 'bs4'])
+def test_truncated_page_has_no_rows(backend):
+    content = _read(os.path.join(FIXTURES, 'muster_10.html'))
+    truncated = content[:content.index(b'<tr')] + b'<table></table></body></html>'
+    assert parse_attendance_page(truncated, backend=backend)[0] is None
+
+
+def test_throttle_pages_are_error_pages():
+    assert is_error_page(b'<html><body>Too Many Requests</body></html>')
+    assert is_error_page(b'')
+    assert not is_error_page(_read(os.path.join(FIXTURES, 'muster_10.html')))
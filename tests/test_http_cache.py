@@ -0,0 +1,66 @@
+import os
+import time
+
+import requests
+
+from http_cache import ResponseCache, normalize_url
+
+SITE = 'https://nregastrep.nic.in/netnrega/nmms/'
+
+
+def _response(url, body):
+    response = requests.Response()
+    response.status_code = 200
+    response._content = body
+    response.url = url
+    response.headers['Content-Type'] = 'text/html; charset=utf-8'
+    return response
+
+
+def _put(cache, url, body, age=0):
+    cache.put(url, _response(url, body))
+    if age:
+        past = time.time() - age
+        os.utime(cache._paths(url)[0], (past, past))
+
+
+def test_entries_expire_by_resource_type(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=10 ** 6, ttls={'muster': 0, 'hierarchy': 60})
+    muster_url = SITE + 'View_NMMS_atten_date_dtl_rpt.aspx?msrno=1'
+    block_url = SITE + 'View_NMMS_atten_date_blk.aspx?state_code=15'
+    _put(cache, muster_url, b'<table>muster</table>')
+    _put(cache, block_url, b'<table>block</table>')
+    time.sleep(0.01)
+    assert cache.get(muster_url) is None
+    assert not os.path.exists(cache._paths(muster_url)[0])
+    hit = cache.get(block_url)
+    assert hit.content == b'<table>block</table>'
+    assert hit.from_cache
+
+
+def test_volatile_parameters_do_not_split_entries(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=10 ** 6)
+    _put(cache, SITE + 'View_NMMS_atten_date_blk.aspx?state_code=15&Digest=abc', b'<table>block</table>')
+    assert cache.get(SITE + 'View_NMMS_atten_date_blk.aspx?Digest=xyz&state_code=15') is not None
+    assert normalize_url(SITE + 'a.aspx?b=2&a=1') == normalize_url(SITE + 'a.aspx?a=1&b=2')
+
+
+def test_least_recently_used_entries_are_evicted_down_to_90_percent(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=1000)
+    urls = [SITE + f'View_NMMS_atten_date_panch.aspx?block={n}' for n in range(4)]
+    _put(cache, urls[0], b'a' * 300, age=300)
+    _put(cache, urls[1], b'b' * 300, age=200)
+    _put(cache, urls[2], b'c' * 300, age=100)
+    # A hit makes the oldest entry the most recently used one
+    assert cache.get(urls[0]) is not None
+    _put(cache, urls[3], b'd' * 300)
+    assert cache.get(urls[1]) is None
+    assert [cache.get(url) is not None for url in (urls[0], urls[2], urls[3])] == [True, True, True]
+    assert cache._total_bytes == 900
+
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    cache = ResponseCache(str(tmp_path), enabled=False)
+    _put(cache, SITE + 'View_NMMS_atten_date_blk.aspx', b'<table>block</table>')
+    assert cache.get(SITE + 'View_NMMS_atten_date_blk.aspx') is None
+    assert os.listdir(tmp_path) == []
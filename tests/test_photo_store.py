@@ -0,0 +1,58 @@
+import os
+import time
+
+from photo_store import PhotoStore
+
+PHOTO_URL = 'https://mnregaweb4.nic.in/photos/1.jpg'
+
+
+def _age(photo, seconds):
+    past = time.time() - seconds
+    os.utime(photo.path, (past, past))
+
+
+def test_fetch_stores_a_url_once(tmp_path):
+    store = PhotoStore(str(tmp_path), max_bytes=0)
+    calls = []
+
+    def fetch_bytes(url):
+        calls.append(url)
+        return b'photo bytes'
+
+    first = store.fetch(PHOTO_URL, fetch_bytes)
+    again = store.fetch(PHOTO_URL + '?Digest=changed', fetch_bytes)
+    assert calls == [PHOTO_URL]
+    assert again.digest == first.digest
+    assert store.lookup_url(PHOTO_URL).digest == first.digest
+
+
+def test_aliases_keep_copies_apart_from_the_original(tmp_path):
+    store = PhotoStore(str(tmp_path), max_bytes=0)
+    original = store.fetch(PHOTO_URL, lambda url: b'original')
+    screenshot = store.fetch(PHOTO_URL, lambda url: b'screenshot', alias=f'screenshot:{PHOTO_URL}')
+    assert screenshot.digest != original.digest
+    assert store.lookup_url(PHOTO_URL).digest == original.digest
+    # Identical bytes under two aliases share one blob
+    duplicate = store.fetch('https://mnregaweb4.nic.in/photos/2.jpg', lambda url: b'original')
+    assert duplicate.digest == original.digest
+    assert store.put(b'original').size == original.size
+
+
+def test_least_recently_used_blobs_are_evicted(tmp_path):
+    store = PhotoStore(str(tmp_path), max_bytes=1000, min_age=60)
+    old = store.fetch('https://mnregaweb4.nic.in/photos/old.jpg', lambda url: b'o' * 400)
+    used = store.fetch('https://mnregaweb4.nic.in/photos/used.jpg', lambda url: b'u' * 400)
+    _age(old, 600)
+    _age(used, 300)
+    assert store.lookup_url('https://mnregaweb4.nic.in/photos/used.jpg') is not None
+    store.fetch('https://mnregaweb4.nic.in/photos/new.jpg', lambda url: b'n' * 400)
+    assert store.get(old.digest) is None
+    assert store.get(used.digest) is not None
+    # The alias of the evicted blob is dropped when next looked up
+    assert store.lookup_url('https://mnregaweb4.nic.in/photos/old.jpg') is None
+
+
+def test_recently_used_blobs_are_never_evicted(tmp_path):
+    store = PhotoStore(str(tmp_path), max_bytes=1000, min_age=60)
+    photos = [store.put(bytes([n]) * 400) for n in range(3)]
+    assert all(store.get(photo.digest) is not None for photo in photos)
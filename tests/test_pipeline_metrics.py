@@ -0,0 +1,67 @@
+import threading
+import metrics
+from pipeline import pipelined
+
+
+def fetch(item):
+    with metrics.timed('fetch'):
+        return item
+
+
+def process(item):
+    with metrics.timed('process'):
+        metrics.count('processed')
+        return item, threading.get_ident()
+
+
+def test_later_stages_are_recorded_in_the_run():
+    with metrics.collect() as run:
+        results = list(pipelined(range(20), [(fetch, 4), (process, 4)]))
+    assert [item for item, _ in results] == list(range(20))
+    snapshot = run.snapshot()
+    assert snapshot['stages']['fetch']['count'] == 20
+    assert snapshot['stages']['process']['count'] == 20
+    assert metrics.counter_total(snapshot, 'processed') == 20
+
+
+def test_later_stages_are_attributed_to_the_run():
+    seen = []
+
+    def record(item):
+        seen.append(metrics.thread_activity(threading.get_ident())[0])
+        return item
+
+    with metrics.collect() as run:
+        list(pipelined(range(10), [(fetch, 2), (record, 2)]))
+    assert seen == [run] * 10
+
+
+def test_concurrent_runs_keep_their_own_stages():
+    runs = []
+
+    def scrape():
+        with metrics.collect() as run:
+            list(pipelined(range(10), [(fetch, 2), (process, 2)]))
+        runs.append(run)
+
+    threads = [threading.Thread(target=scrape) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [run.snapshot()['stages']['process']['count'] for run in runs] == [10, 10, 10]
+
+
+def test_thread_entries_are_dropped_when_work_ends():
+    with metrics.collect():
+        list(pipelined(range(10), [(fetch, 3), (process, 3)]))
+    assert metrics._thread_runs == {}
+    assert metrics._thread_stages == {}
+
+
+def test_prometheus_label_values_are_escaped():
+    run = metrics.Metrics()
+    run.count('errors', reason='bad "quote" \\ and\nnewline')
+    text = metrics.to_prometheus(run.snapshot())
+    assert 'reason="bad \\"quote\\" \\\\ and\\nnewline"' in text
+    assert len(text.splitlines()) == 2
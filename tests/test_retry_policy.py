@@ -0,0 +1,56 @@
+import time
+
+import pytest
+import requests
+
+from retry_policy import CircuitBreaker, CircuitOpen, RetryPolicy
+
+
+def test_breaker_opens_probes_and_closes():
+    breaker = CircuitBreaker('host', threshold=3, cooldown=0.05)
+    for _ in range(3):
+        assert breaker.before_request() is False
+        breaker.record_failure()
+    assert breaker.is_open
+    with pytest.raises(CircuitOpen):
+        breaker.before_request()
+
+    time.sleep(0.06)
+    # Half-open: one probe goes through, everyone else is still held off
+    assert breaker.before_request() is True
+    with pytest.raises(CircuitOpen):
+        breaker.before_request()
+    breaker.record_success()
+    assert not breaker.is_open
+    assert breaker.before_request() is False
+
+
+def test_failed_probe_keeps_the_breaker_open_for_another_cooldown():
+    breaker = CircuitBreaker('host', threshold=1, cooldown=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.before_request() is True
+    breaker.record_failure()
+    with pytest.raises(CircuitOpen):
+        breaker.before_request()
+    time.sleep(0.06)
+    assert breaker.before_request() is True
+
+
+def test_abandoned_probe_lets_the_next_request_probe():
+    breaker = CircuitBreaker('host', threshold=1, cooldown=0)
+    breaker.record_failure()
+    assert breaker.before_request() is True
+    breaker.abandon_probe()
+    assert breaker.before_request() is True
+
+
+def test_retry_delay_is_capped_and_honours_retry_after():
+    policy = RetryPolicy(attempts=4, base_delay=1, max_delay=5)
+    assert all(0 <= policy.delay(retry) <= 5 for retry in range(10))
+    response = requests.Response()
+    response.status_code = 429
+    response.headers['Retry-After'] = '3'
+    assert 3 <= policy.delay(0, response) <= 5
+    response.headers['Retry-After'] = '120'
+    assert policy.delay(0, response) == 5
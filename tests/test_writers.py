@@ -0,0 +1,72 @@
+import os
+
+import pytest
+from openpyxl import load_workbook
+
+from excel_writer import open_workbook
+from image_processing import ProcessedPhoto
+from muster_workbooks import MusterWorkbookRenderer
+
+PHOTO_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'fixtures', 'photo_small.jpg')
+HEADER = ['S.No', 'Job Card No', 'Worker Name', 'Attendance Date', 'Present/Absent']
+BACKENDS = ['openpyxl', 'xlsxwriter']
+
+
+def _rows(muster_roll_no, count):
+    return [[str(n), f'KN-{n:03}', f'Worker {muster_roll_no}-{n} (M)', '01/04/2025', 'P'] for n in range(1, count + 1)]
+
+
+def _values(ws):
+    return list(ws.iter_rows(values_only=True))
+
+
+def _render(backend, tmp_path):
+    photo = ProcessedPhoto('digest', PHOTO_PATH, os.path.getsize(PHOTO_PATH), 320, 240)
+    renderer = MusterWorkbookRenderer('HAGARANUR', 'Ballari', 'Siruguppa',
+                                      str(tmp_path / f'att_{backend}.xlsx'), str(tmp_path / f'img_{backend}.xlsx'), backend)
+    # A muster whose page had no table is held back until one with a header arrives
+    renderer.add_muster('1001', 'WC-1', None, None, None, None)
+    renderer.add_muster('1002', 'WC-1', _rows(1002, 3), 'Road work', HEADER, photo)
+    renderer.add_muster('1003', 'WC-1', _rows(1003, 1), 'Road work', HEADER, None)
+    att_path, img_path = renderer.close()
+    return load_workbook(att_path).active, load_workbook(img_path).active
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_muster_workbooks(backend, tmp_path):
+    att_ws, img_ws = _render(backend, tmp_path)
+    values = _values(att_ws)
+    assert values[2][:4] == ('Work code:', 'WC-1', 'Work Name:', 'Road work')
+    assert ('Muster Roll No', *HEADER) in [row[:6] for row in values]
+    assert [row[0] for row in values if row[0] in ('1001', '1002', '1003')] == ['1002'] * 3 + ['1003']
+    assert [row[0] for row in _values(img_ws) if row[0] in ('1001', '1002', '1003')] == ['1001', '1002', '1003']
+    assert len(att_ws._images) == 1
+    assert len(img_ws._images) == 1
+    # The 240 px photo spans 12 rows from its muster number down
+    assert [str(cell_range) for cell_range in img_ws.merged_cells.ranges] == ['A10:A21']
+
+
+def test_backends_write_the_same_cells(tmp_path):
+    (att_a, img_a), (att_b, img_b) = (_render(backend, tmp_path) for backend in BACKENDS)
+
+    def trimmed(ws):
+        # xlsxwriter leaves skipped rows out altogether; only written values are compared
+        return [tuple(value for value in row if value is not None) for row in _values(ws) if any(v is not None for v in row)]
+    assert trimmed(att_a) == trimmed(att_b)
+    assert trimmed(img_a) == trimmed(img_b)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_workbook_written_to_memory_and_styles(backend):
+    book = open_workbook(backend=backend)
+    ws = book.add_sheet('Raw')
+    ws.set_column_width('B', 30)
+    ws.append(['Name', 'Count'], styles='bold')
+    ws.append(['a', 1])
+    ws.append(['b', None, 'c'], styles={3: 'bold_center_16'})
+    out = book.close()
+    sheet = load_workbook(out)['Raw']
+    assert _values(sheet) == [('Name', 'Count', None), ('a', 1, None), ('b', None, 'c')]
+    assert sheet['A1'].font.b and not sheet['A2'].font.b
+    assert sheet['C3'].font.sz == 16 and sheet['C3'].alignment.horizontal == 'center'
+    assert sheet.column_dimensions['B'].width == pytest.approx(30, abs=1)